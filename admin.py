@@ -1,7 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model, forms as auth_forms
-from .models import Place, Profile, Carfare, Carpool, Comment, Car
+from django.db.models import Max, Min
+from .matching import match_drivers
+from .models import ArchivedCarpool, Place, Profile, Carfare, Carpool, Comment, Car
+from .models import RecurringCarpool
 
 
 @admin.register(Carpool)
@@ -16,11 +19,44 @@ class CarpoolAdmin(admin.ModelAdmin):
         "status",
     ]
     ordering = ["date", "time"]
+    actions = ["match_drivers_action"]
+
+    @admin.action(description="Match drivers to the selected waiting carpools")
+    def match_drivers_action(self, request, queryset):
+        window = queryset.aggregate(start=Min("date"), end=Max("date"))
+        result = match_drivers(window["start"], window["end"], carpools=queryset)
+        total = len(result.assignments) + len(result.unmatched)
+        self.message_user(
+            request,
+            f"assigned a driver to {len(result.applied)} of {total} waiting carpool(s)",
+            messages.SUCCESS if result.applied else messages.WARNING,
+        )
 
     # def get_passengers(self, obj):
     #     return "\n".join([p.type for p in obj.passengers.all()])
 
 
+@admin.register(RecurringCarpool)
+class RecurringCarpoolAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "time",
+        "carfare",
+        "weekday_names",
+        "start_date",
+        "end_date",
+        "active",
+    ]
+    list_filter = ["active"]
+
+
+@admin.register(ArchivedCarpool)
+class ArchivedCarpoolAdmin(admin.ModelAdmin):
+    list_display = ["id", "date", "time", "driver", "seats_taken", "archived_at"]
+    ordering = ["date", "time"]
+    raw_id_fields = ["carfare", "driver", "passengers"]
+
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ["time", "content", "score", "critic", "criticed"]
@@ -29,7 +65,8 @@ class CommentAdmin(admin.ModelAdmin):
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
-    pass
+    list_display = ["name", "latitude", "longitude"]
+    search_fields = ["name"]
 
 
 @admin.register(Carfare)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app"
+
+    def ready(self):
+        # 連接 signal receivers
+        from . import card_cache, conditional, events, fare_matrix  # noqa: F401
+        from . import carpool_index, metrics, place_index, recurrence  # noqa: F401
@@ -0,0 +1,64 @@
+"""Moving arrived carpools out of the live table.
+
+Each batch copies the carpools and their passenger links into the archive
+tables and deletes the originals in one transaction, so an interrupted run
+leaves every carpool in exactly one place and the next run carries on.
+Archive rows keep the original ids, and the copies ignore conflicts, so a
+batch that is repeated does no harm.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from .models import ArchivedCarpool, Carpool, update_trip_count
+
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVED_FIELDS = (
+    "id",
+    "date",
+    "time",
+    "carfare_id",
+    "lower_passengers",
+    "driver_id",
+    "seats_taken",
+    "status",
+)
+
+Passenger = Carpool.passengers.through
+ArchivedPassenger = ArchivedCarpool.passengers.through
+
+
+def archivable(before):
+    return Carpool.objects.filter(status="a", date__lt=before)
+
+
+def archive_batch(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive up to ``batch_size`` carpools that arrived before ``before``."""
+    with transaction.atomic():
+        rows = list(
+            archivable(before)
+            .select_for_update()
+            .order_by("id")
+            .values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        ids = [row["id"] for row in rows]
+
+        ArchivedCarpool.objects.bulk_create(
+            [ArchivedCarpool(**row) for row in rows], ignore_conflicts=True
+        )
+        ArchivedPassenger.objects.bulk_create(
+            [
+                ArchivedPassenger(archivedcarpool_id=carpool_id, student_id=student_id)
+                for carpool_id, student_id in Passenger.objects.filter(
+                    carpool_id__in=ids
+                ).values_list("carpool_id", "student_id")
+            ],
+            ignore_conflicts=True,
+        )
+        Carpool.objects.filter(pk__in=ids).delete()
+        # 刪除時扣掉的趟數加回來，封存的行程仍算完成
+        for driver_id, count in Counter(row["driver_id"] for row in rows).items():
+            update_trip_count(driver_id, count)
+    return len(ids)
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class UserBackend(ModelBackend):
+    """ModelBackend that loads the user's profile and car with the user.
+
+    ``request.user`` is resolved once per request, so with these joined in
+    the views and templates never query them again.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related("profile", "car").get(
+                pk=user_id
+            )
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,187 @@
+"""Benchmarks run by the ``benchmark_*`` management commands.
+
+One module per command, each with a ``run`` that returns a JSON-ready
+report:
+
+``views``
+    Every route in ``urls.py`` per role, the comment flow per session
+    engine, ETag revalidation and the cost of ``MetricsMiddleware``.
+``servers``
+    WSGI vs ASGI throughput of the async read views.
+``templates``
+    Board cards with and without the cached loader, star loop vs tag.
+``sqlite``
+    Multi-process contention under the old and the current SQLite settings.
+``spatial``
+    Radius queries, grid index of ``place_index`` vs linear scan.
+``window_search``
+    Multi-route time-window searches, ORM vs ``carpool_index``.
+
+This module holds what they share: SQL capture, sample rows and URLs, and
+the report metadata.  ``command.BenchmarkCommand`` is the shared command.
+"""
+import platform
+import time
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.db.backends.utils import CursorDebugWrapper
+from django.urls import reverse
+
+from .. import urls
+from ..models import Carfare, Carpool, Comment, Driver, Place, Student, User
+
+ROLES = ("anonymous", "student", "driver")
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+# 以 async 實作的唯讀頁面，WSGI/ASGI 吞吐量比較只打這些
+ASYNC_VIEWS = (
+    "carpools_region",
+    "carpool-detail",
+    "drivers",
+    "driver_detail",
+    "driver_reviews",
+    "price",
+)
+
+
+class RowCountingCursor(CursorDebugWrapper):
+    """Debug cursor that also counts the rows fetched."""
+
+    def __init__(self, cursor, db, counter):
+        super().__init__(cursor, db)
+        self.counter = counter
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.counter["rows"] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size else self.cursor.fetchmany()
+        self.counter["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.counter["rows"] += len(rows)
+        return rows
+
+
+@contextmanager
+def capture_sql():
+    """Collect query count, SQL time and fetched rows on the default connection."""
+    counter = {"rows": 0}
+    connection.queries_log.clear()
+    force_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    connection.make_debug_cursor = lambda cursor: RowCountingCursor(
+        cursor, connection, counter
+    )
+    try:
+        yield counter
+    finally:
+        del connection.make_debug_cursor
+        connection.force_debug_cursor = force_debug_cursor
+        queries = list(connection.queries_log)
+        counter["queries"] = len(queries)
+        counter["writes"] = sum(
+            query["sql"].lstrip().upper().startswith(WRITE_STATEMENTS)
+            for query in queries
+        )
+        counter["sql_ms"] = sum(float(query["time"]) for query in queries) * 1000
+
+
+def sample_objects():
+    """Pick representative users and rows for the URL arguments."""
+    arrived = Carpool.objects.filter(status="a", seats_taken__gt=0).first()
+    student = arrived.passengers.first() if arrived else Student.objects.first()
+    driving = Carpool.objects.filter(driver__isnull=False, status__in="wd").first()
+    driver = driving.driver if driving else Driver.objects.first()
+    return {
+        "student": student,
+        "driver": driver,
+        "carpool": Carpool.objects.filter(status="w").first(),
+        "driving": driving,
+        "arrived": arrived,
+        "comment": Comment.objects.first(),
+    }
+
+
+# 需要 pk 的路由使用哪一筆樣本
+URL_SAMPLES = {
+    "carpool-detail": "carpool",
+    "carpool_change_status": "driving",
+    "carpool_update_status": "arrived",
+    "driver_detail": "driver",
+    "driver_reviews": "driver",
+    "delete_comment": "comment",
+    "edit_comment": "comment",
+}
+
+
+def collect_cases(samples, roles=ROLES):
+    """One case per named route and role; routes missing a sample are skipped."""
+    cases = []
+    for pattern in urls.urlpatterns:
+        name = pattern.name
+        kwargs = {}
+        if "pk" in pattern.pattern.converters:
+            sample = samples.get(URL_SAMPLES.get(name))
+            if sample is None:
+                cases.append({"name": name, "skipped": "no sample row"})
+                continue
+            kwargs["pk"] = sample.pk
+        path = reverse(f"{urls.app_name}:{name}", kwargs=kwargs)
+        for role in roles:
+            cases.append({"name": name, "path": path, "role": role})
+    return cases
+
+
+def async_view_paths(samples, only=None):
+    """Anonymous paths of the async read views, or of the URL names in ``only``."""
+    return [
+        case["path"]
+        for case in collect_cases(samples, roles=("anonymous",))
+        if case["name"] in (only or ASYNC_VIEWS) and "skipped" not in case
+    ]
+
+
+def host_name():
+    """A Host header that passes ALLOWED_HOSTS (the test runner adds testserver)."""
+    hosts = settings.ALLOWED_HOSTS
+    if "testserver" in hosts:
+        return "testserver"
+    named = [host.lstrip(".") for host in hosts if host != "*"]
+    return named[0] if named else "localhost"
+
+
+def dataset_summary():
+    return {
+        "users": User.objects.count(),
+        "students": Student.objects.count(),
+        "drivers": Driver.objects.count(),
+        "places": Place.objects.count(),
+        "carfares": Carfare.objects.count(),
+        "carpools": Carpool.objects.count(),
+        "comments": Comment.objects.count(),
+    }
+
+
+def report_meta(**fields):
+    """The ``meta`` of a report: when and on what it ran, plus ``fields``."""
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        **fields,
+    }
+
+
+def percentile(timings, fraction, digits=3):
+    """The ``fraction`` percentile of sorted ``timings``, rounded; None if empty."""
+    if not timings:
+        return None
+    return round(timings[min(int(len(timings) * fraction), len(timings) - 1)], digits)
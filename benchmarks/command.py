@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class BenchmarkCommand(BaseCommand):
+    """Options, JSON output and report printing shared by ``benchmark_*``.
+
+    ``counts`` maps the integer options every benchmark takes to their
+    defaults; each must be at least 1.  Subclasses add their own options in
+    ``add_benchmark_arguments``, return the report from ``benchmark`` (raising
+    ``CommandError`` when the dataset cannot be measured) and print it in
+    ``write_report``.
+    """
+
+    counts = {}
+    # 預設不寫檔；設定後一定會寫出報告
+    default_output = None
+
+    def add_arguments(self, parser):
+        for name, default in self.counts.items():
+            parser.add_argument(f"--{name}", type=int, default=default)
+        self.add_benchmark_arguments(parser)
+        parser.add_argument(
+            "--output",
+            default=self.default_output,
+            help="Also write the report as JSON here.",
+        )
+
+    def add_benchmark_arguments(self, parser):
+        pass
+
+    def benchmark(self, **options):
+        raise NotImplementedError
+
+    def write_report(self, report, **options):
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        if any(options[name] < 1 for name in self.counts):
+            flags = " and ".join(f"--{name}" for name in self.counts)
+            raise CommandError(f"{flags} must be at least 1")
+
+        report = self.benchmark(**options)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        self.write_report(report, **options)
+        if options["output"]:
+            self.stdout.write(
+                self.style.SUCCESS(f"report written to {options['output']}")
+            )
@@ -0,0 +1,150 @@
+"""WSGI vs ASGI throughput.
+
+Both handlers serve many concurrent anonymous GETs of the async read views,
+the WSGI one from a thread pool and the ASGI one from tasks on one event loop.
+"""
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+
+from . import (
+    async_view_paths,
+    dataset_summary,
+    host_name,
+    percentile,
+    report_meta,
+    sample_objects,
+)
+
+
+def wsgi_environ(path, host):
+    return {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": host,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": host,
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def asgi_scope(path, host):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": (host, 80),
+    }
+
+
+def wsgi_load(paths, concurrency, total, host):
+    """``total`` requests over ``paths`` from a pool of ``concurrency`` threads."""
+    handler = WSGIHandler()
+
+    def request(path):
+        status = []
+        start = time.perf_counter()
+        response = handler(
+            wsgi_environ(path, host), lambda s, headers: status.append(int(s[:3]))
+        )
+        try:
+            b"".join(response)
+        finally:
+            response.close()
+        return status[0], (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(request, (paths[i % len(paths)] for i in range(total))))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def asgi_load(paths, concurrency, total, host):
+    """The same load as ``wsgi_load`` from ``concurrency`` tasks on one event loop."""
+    handler = ASGIHandler()
+
+    async def request(path):
+        status = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        start = time.perf_counter()
+        await handler(asgi_scope(path, host), receive, send)
+        return status[0], (time.perf_counter() - start) * 1000
+
+    async def main():
+        queue = iter(range(total))
+        results = []
+
+        async def worker():
+            for i in queue:
+                results.append(await request(paths[i % len(paths)]))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def summarize_load(results, elapsed):
+    latencies = sorted(ms for _, ms in results)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(results) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "statuses": statuses,
+    }
+
+
+def run(concurrency=64, requests=2000, only=None):
+    """WSGI vs ASGI throughput of the async read views, anonymous GETs only."""
+    paths = async_view_paths(sample_objects(), only)
+    host = host_name()
+    results = {}
+    for name, load in (("wsgi", wsgi_load), ("asgi", asgi_load)):
+        load(paths, concurrency, len(paths), host)  # 暖身：填滿各種快取
+        results[name] = summarize_load(*load(paths, concurrency, requests, host))
+    return {
+        "meta": report_meta(
+            database=connection.vendor,
+            concurrency=concurrency,
+            paths=paths,
+            dataset=dataset_summary(),
+        ),
+        "servers": results,
+    }
@@ -0,0 +1,65 @@
+"""Radius queries over synthetic places.
+
+The grid index of ``place_index`` answers every query; the first few are
+also answered by a linear scan, which must return the same places.
+"""
+import random
+import statistics
+import time
+
+from ..place_index import PlaceIndex, brute_force_near
+from . import percentile, report_meta
+
+# 附近搜尋的合成地點範圍（約台灣本島）與查詢半徑（公里）
+SPATIAL_BOUNDS = ((21.9, 25.3), (120.0, 122.0))
+SPATIAL_RADII = (1, 3, 10)
+# 線性掃描太慢，只對前幾筆查詢做對照
+BRUTE_FORCE_QUERIES = 20
+
+
+def run(places=100000, queries=200, radii=SPATIAL_RADII, seed=0):
+    """Radius queries over ``places`` random points: grid index vs linear scan."""
+    rng = random.Random(seed)
+    (south, north), (west, east) = SPATIAL_BOUNDS
+    points = [
+        (pk, rng.uniform(south, north), rng.uniform(west, east))
+        for pk in range(1, places + 1)
+    ]
+    centers = [
+        (rng.uniform(south, north), rng.uniform(west, east)) for _ in range(queries)
+    ]
+
+    start = time.perf_counter()
+    index = PlaceIndex(points)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    for radius in radii:
+        grid, brute, found, mismatches = [], [], 0, 0
+        for i, (latitude, longitude) in enumerate(centers):
+            start = time.perf_counter()
+            near = index.near(latitude, longitude, radius)
+            grid.append((time.perf_counter() - start) * 1000)
+            found += len(near)
+            if i < BRUTE_FORCE_QUERIES:
+                start = time.perf_counter()
+                expected = brute_force_near(points, latitude, longitude, radius)
+                brute.append((time.perf_counter() - start) * 1000)
+                mismatches += [pk for _, pk in near] != [pk for _, pk in expected]
+        grid.sort()
+        results[str(radius)] = {
+            "grid_p50_ms": percentile(grid, 0.5),
+            "grid_p95_ms": percentile(grid, 0.95),
+            "brute_force_p50_ms": round(statistics.median(brute), 3),
+            "mean_results": round(found / len(centers), 1),
+            "mismatches": mismatches,
+        }
+    return {
+        "meta": report_meta(
+            places=places,
+            queries=queries,
+            cells=len(index.cells),
+            build_ms=round(build_ms, 1),
+        ),
+        "radii": results,
+    }
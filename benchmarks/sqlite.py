@@ -0,0 +1,173 @@
+"""Write/read contention from several processes on SQLite.
+
+Each process joins, comments and reads at random on a copy of the database,
+once under the stock settings the app used to run with and once under the
+ones in ``settings.DATABASES``.
+"""
+import multiprocessing
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.db import OperationalError, close_old_connections, connections
+from django.db.utils import load_backend
+
+from ..models import Carpool, Comment, Driver, Student
+from ..routers import sync_sqlite_replica
+from ..seats import SeatResult, release_seat, reserve_seat
+from . import dataset_summary, percentile, report_meta
+
+# 改版前的資料庫設定：內建 backend、rollback journal、DEFERRED、每次請求新連線
+LEGACY_SQLITE = {
+    "ENGINE": "django.db.backends.sqlite3",
+    "CONN_MAX_AGE": 0,
+    "CONN_HEALTH_CHECKS": False,
+    "OPTIONS": {},
+}
+# 競爭測試中每種操作被抽中的比例
+CONTENTION_MIX = ("join", "comment", "edit", "read", "read")
+
+
+def contention_sample(limit=200):
+    """Ids the contention workers pick from."""
+    return {
+        "carpools": list(
+            Carpool.objects.filter(status="w", seats_taken__gt=0).values_list(
+                "pk", flat=True
+            )[:limit]
+        ),
+        "students": list(Student.objects.values_list("pk", flat=True)[:limit]),
+        "drivers": list(Driver.objects.values_list("pk", flat=True)[:limit]),
+        "comments": list(Comment.objects.values_list("pk", flat=True)[:limit]),
+    }
+
+
+def join_and_leave(rng, sample):
+    carpool = Carpool(pk=rng.choice(sample["carpools"]))
+    student = Student(pk=rng.choice(sample["students"]))
+    if reserve_seat(carpool, student) == SeatResult.JOINED:
+        release_seat(carpool, student)
+
+
+def write_comment(rng, sample):
+    Comment.objects.create(
+        content="benchmark",
+        score=rng.randint(1, 5),
+        critic_id=rng.choice(sample["students"]),
+        criticed_id=rng.choice(sample["drivers"]),
+    )
+
+
+def edit_comment(rng, sample):
+    # Comment.save 在交易中先讀舊分數再寫入
+    comment = Comment.objects.get(pk=rng.choice(sample["comments"]))
+    comment.score = rng.randint(1, 5)
+    comment.save()
+
+
+def read_board(rng, sample):
+    list(Carpool.objects.for_board()[:20])
+
+
+CONTENTION_OPERATIONS = {
+    "join": join_and_leave,
+    "comment": write_comment,
+    "edit": edit_comment,
+    "read": read_board,
+}
+
+# 每種操作需要哪一類樣本才能執行
+KIND_SAMPLES = {
+    "join": "carpools",
+    "comment": "drivers",
+    "edit": "comments",
+    "read": "students",
+}
+
+
+def contention_worker(settings_dict, seed, operations, sample):
+    """Run random operations on ``settings_dict`` in a child process."""
+    connections["default"] = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(
+        settings_dict
+    )
+    rng = random.Random(seed)
+    kinds = [kind for kind in CONTENTION_MIX if sample[KIND_SAMPLES[kind]]]
+    errors = {}
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(operations):
+        kind = rng.choice(kinds)
+        began = time.perf_counter()
+        try:
+            CONTENTION_OPERATIONS[kind](rng, sample)
+        except OperationalError as e:
+            errors[f"{kind}: {e}"] = errors.get(f"{kind}: {e}", 0) + 1
+        latencies.append((time.perf_counter() - began) * 1000)
+        # 和請求結束時一樣，依 CONN_MAX_AGE 關閉或保留連線
+        close_old_connections()
+    elapsed = time.perf_counter() - start
+    connections.close_all()
+    return {"seconds": elapsed, "errors": errors, "latencies": latencies}
+
+
+def sqlite_profiles():
+    """The stock settings the app used to run with and the current ones."""
+    current = connections["default"].settings_dict
+    return {
+        "legacy": {**current, **LEGACY_SQLITE},
+        "production": dict(current),
+    }
+
+
+def run(processes=8, operations=200):
+    """Concurrent writes and reads from ``processes`` processes per profile."""
+    sample = contention_sample()
+    # spawn：子行程重新 setup Django，不共用父行程的連線
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, settings_dict in sqlite_profiles().items():
+            path = Path(directory) / f"{name}.sqlite3"
+            # 每個設定都從同一份 rollback journal 的複本開始
+            sync_sqlite_replica(path)
+            settings_dict = {**settings_dict, "NAME": str(path)}
+            with context.Pool(processes, initializer=django.setup) as pool:
+                runs = pool.starmap(
+                    contention_worker,
+                    [
+                        (settings_dict, seed, operations, sample)
+                        for seed in range(processes)
+                    ],
+                )
+            results[name] = summarize_contention(runs)
+    return {
+        "meta": report_meta(
+            sqlite=sqlite3.sqlite_version,
+            processes=processes,
+            operations=operations,
+            dataset=dataset_summary(),
+        ),
+        "profiles": results,
+    }
+
+
+def summarize_contention(runs):
+    latencies = sorted(ms for run in runs for ms in run["latencies"])
+    errors = {}
+    for run in runs:
+        for message, count in run["errors"].items():
+            errors[message] = errors.get(message, 0) + count
+    failed = sum(errors.values())
+    seconds = max(run["seconds"] for run in runs)
+    return {
+        "operations": len(latencies),
+        "failed": failed,
+        "error_rate": round(failed / len(latencies), 4),
+        "ops_per_s": round(len(latencies) / seconds, 1),
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "errors": errors,
+    }
@@ -0,0 +1,80 @@
+"""Rendering a page worth of board cards.
+
+Each card is rendered with and without the cached template loader, and
+each driver score with the old star loop and with ``{% star_rating %}``.
+"""
+import statistics
+import time
+
+from django.template import Context, Engine
+
+from ..card_cache import CARD_TEMPLATE
+from ..models import Carpool
+from ..templatetags.stars import EMPTY_STAR, FULL_STAR
+from . import report_meta
+
+# 改成 {% star_rating %} 之前每個評分都要跑的迴圈
+STAR_LOOP = (
+    '{% for _ in ""|rjust:5 %}{% if forloop.counter0 < score %}'
+    + FULL_STAR
+    + "{% else %}"
+    + EMPTY_STAR
+    + "{% endif %}{% endfor %}"
+)
+STAR_TAG = "{% load stars %}{% star_rating score %}"
+
+
+def uncached_engine(engine):
+    """``engine`` with the same template dirs but no cached loader."""
+    return Engine(
+        dirs=engine.dirs,
+        loaders=[
+            "django.template.loaders.filesystem.Loader",
+            "django.template.loaders.app_directories.Loader",
+        ],
+        string_if_invalid=engine.string_if_invalid,
+        libraries=engine.libraries,
+        debug=engine.debug,
+    )
+
+
+def time_renders(render, items, repeat):
+    """Median milliseconds to call ``render`` once per item."""
+    timings = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        for item in items:
+            render(item)
+        timings.append((time.perf_counter() - start) * 1000)
+    # 第一輪當暖身
+    return round(statistics.median(timings[1:]), 3)
+
+
+def run(cards=500, repeat=5):
+    """Render ``cards`` board cards: loader caching and star rendering, in ms."""
+    carpools = list(Carpool.objects.for_board()[:cards])
+    engine = Engine.get_default()
+    uncached = uncached_engine(engine)
+    loop, tag = engine.from_string(STAR_LOOP), engine.from_string(STAR_TAG)
+    scores = [carpool.driver_score or 0 for carpool in carpools]
+    return {
+        "meta": report_meta(cards=len(carpools), repeat=repeat),
+        "loader": {
+            name: time_renders(
+                lambda carpool: card_engine.get_template(CARD_TEMPLATE).render(
+                    Context({"carpool": carpool})
+                ),
+                carpools,
+                repeat,
+            )
+            for name, card_engine in (("uncached", uncached), ("cached", engine))
+        },
+        "stars": {
+            name: time_renders(
+                lambda score: template.render(Context({"score": score})),
+                scores,
+                repeat,
+            )
+            for name, template in (("loop", loop), ("tag", tag))
+        },
+    }
@@ -0,0 +1,303 @@
+"""View-level benchmark over every route in ``urls.py``.
+
+Each request runs inside a transaction that is rolled back afterwards, so
+views that write (status changes, comment deletion, logout) can be measured
+repeatedly against the same dataset.  Wall time, SQL query count/time and
+the number of rows fetched from the database are recorded per route and
+role, and written as a JSON report that ``compare_reports`` can diff.
+The report also counts the queries and writes of the comment flow under
+each session engine, and the 304 hit rate of clients revalidating the
+board and the price table while carpools keep changing, and what
+``MetricsMiddleware`` adds to the async read views.
+"""
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+
+from .. import conditional, metrics
+from ..models import Carpool
+from ..signals import carpool_changed
+from . import (
+    ROLES,
+    async_view_paths,
+    capture_sql,
+    collect_cases,
+    dataset_summary,
+    host_name,
+    report_meta,
+    sample_objects,
+)
+
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+METRICS_MIDDLEWARE = "app.metrics.MetricsMiddleware"
+# 開/關 metrics 交替量測的輪數
+OVERHEAD_ROUNDS = 20
+METRICS_CALLS = 10000
+# 重新驗證時每隔幾次請求改動一次共乘團
+REVALIDATE_ROUNDS = 50
+CHANGE_EVERY = 10
+
+
+def measure(client, path, user):
+    with transaction.atomic():
+        if user is not None:
+            client.force_login(user)
+        with capture_sql() as sql:
+            start = time.perf_counter()
+            response = client.get(path)
+            wall_ms = (time.perf_counter() - start) * 1000
+        transaction.set_rollback(True)
+    return response.status_code, wall_ms, sql
+
+
+def run_case(client, case, user, repeat):
+    measure(client, case["path"], user)  # 暖身：填滿各種快取
+    walls, sql_times = [], []
+    for _ in range(repeat):
+        status, wall_ms, sql = measure(client, case["path"], user)
+        walls.append(wall_ms)
+        sql_times.append(sql["sql_ms"])
+    return {
+        "path": case["path"],
+        "role": case["role"],
+        "status": status,
+        "wall_ms": {
+            "min": round(min(walls), 3),
+            "median": round(statistics.median(walls), 3),
+            "max": round(max(walls), 3),
+        },
+        "sql_ms": round(statistics.median(sql_times), 3),
+        "queries": sql["queries"],
+        "rows": sql["rows"],
+    }
+
+
+def comment_flow(carpool, student, engine):
+    """Open the comment form of an arrived carpool and post it, rolled back.
+
+    Returns the queries and writes of both steps under the session ``engine``.
+    """
+    with override_settings(SESSION_ENGINE=engine), transaction.atomic():
+        client = Client(HTTP_HOST=host_name())
+        client.force_login(student)
+        with capture_sql() as opening:
+            response = client.get(
+                reverse("app:carpool_update_status", kwargs={"pk": carpool.pk})
+            )
+        token = re.search(rb'name="token" value="([^"]+)"', response.content)
+        with capture_sql() as posting:
+            response = client.post(
+                reverse("app:comment_create"),
+                {"content": "benchmark", "score": 5, "token": token.group(1).decode()},
+            )
+        transaction.set_rollback(True)
+    return {
+        "status": response.status_code,
+        "queries": opening["queries"] + posting["queries"],
+        "writes": opening["writes"] + posting["writes"],
+        "form_writes": opening["writes"],
+    }
+
+
+def run_flows(samples):
+    arrived, student = samples["arrived"], samples["student"]
+    if arrived is None or student is None:
+        return {}
+    return {
+        f"comment[{name}]": comment_flow(arrived, student, engine)
+        for name, engine in SESSION_ENGINES.items()
+    }
+
+
+def revalidate(page, path, user, carpool_id, rounds, change_every):
+    """A client re-requesting ``path`` with its last ETag, rolled back.
+
+    Every ``change_every`` requests a carpool changes, like a join on the
+    board would.  Returns the 304 hit rate and the cost of both answers.
+    """
+    client = Client(HTTP_HOST=host_name())
+    timings = {200: [], 304: []}
+    queries = {}
+    with transaction.atomic():
+        if user is not None:
+            client.force_login(user)
+        etag = client.get(path)["ETag"]
+        conditional.stats[page].reset()
+        for i in range(1, rounds + 1):
+            if i % change_every == 0:
+                carpool_changed.send(
+                    sender=Carpool, carpool_id=carpool_id, kind="updated"
+                )
+            with capture_sql() as sql:
+                start = time.perf_counter()
+                response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+                wall_ms = (time.perf_counter() - start) * 1000
+            etag = response["ETag"]
+            timings.setdefault(response.status_code, []).append(wall_ms)
+            queries[response.status_code] = sql["queries"]
+        transaction.set_rollback(True)
+    result = conditional.stats[page].snapshot()
+    for status, name in ((304, "not_modified"), (200, "ok")):
+        if timings[status]:
+            result[f"{name}_ms"] = round(statistics.median(timings[status]), 3)
+            result[f"{name}_queries"] = queries[status]
+    return result
+
+
+def run_revalidation(samples, rounds=REVALIDATE_ROUNDS, change_every=CHANGE_EVERY):
+    carpool = samples["carpool"]
+    carpool_id = carpool.pk if carpool else 0
+    return {
+        f"{page}[{role}]": revalidate(
+            page,
+            reverse(f"app:{name}"),
+            samples[role] if role != "anonymous" else None,
+            carpool_id,
+            rounds,
+            change_every,
+        )
+        for page, name, role in (
+            ("board", "carpools_region", "student"),
+            ("price", "price", "anonymous"),
+        )
+    }
+
+
+def per_call_us(func, calls=METRICS_CALLS):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 10**6
+
+
+def instrumentation_cost():
+    """Microseconds the middleware adds per request and the wrapper per query."""
+    request = RequestFactory().get("/")
+    request.resolver_match = None
+    response = HttpResponse()
+    middleware = metrics.MetricsMiddleware(lambda request: response)
+    metrics.registry.reset()
+    request_us = per_call_us(lambda: middleware(request)) - per_call_us(
+        lambda: response
+    )
+    metrics.registry.reset()
+
+    def execute(sql, params, many, context):
+        return None
+
+    token = metrics._current.set(metrics.RequestMetrics())
+    try:
+        query_us = per_call_us(
+            lambda: metrics.record_query(execute, "", (), False, {})
+        ) - per_call_us(lambda: execute("", (), False, {}))
+    finally:
+        metrics._current.reset(token)
+    return max(request_us, 0), max(query_us, 0)
+
+
+def run_metrics_overhead(samples, rounds=OVERHEAD_ROUNDS):
+    """Cost of ``MetricsMiddleware`` on one pass over the async read views.
+
+    Whole requests with and without the middleware differ by less than their
+    noise, so the overhead is also estimated from the measured cost per
+    request and per query against the uninstrumented pass.
+    """
+    paths = async_view_paths(samples)
+    clients = {}
+    for name, middleware in (
+        ("with", settings.MIDDLEWARE),
+        ("without", [m for m in settings.MIDDLEWARE if m != METRICS_MIDDLEWARE]),
+    ):
+        # middleware 在第一次請求時載入，之後離開 override 也不變
+        with override_settings(MIDDLEWARE=middleware):
+            clients[name] = Client(HTTP_HOST=host_name())
+            for path in paths:
+                clients[name].get(path)
+    timings = {(name, path): [] for name in clients for path in paths}
+    queries = 0
+    for i in range(rounds):
+        for path in paths:
+            # 交替先後順序，抵銷快取與系統雜訊
+            for name in ("with", "without") if i % 2 else ("without", "with"):
+                with capture_sql() as sql:
+                    start = time.perf_counter()
+                    clients[name].get(path)
+                    wall_ms = (time.perf_counter() - start) * 1000
+                timings[name, path].append(wall_ms)
+                queries += sql["queries"]
+    with_ms, without_ms = (
+        sum(statistics.median(timings[name, path]) for path in paths)
+        for name in ("with", "without")
+    )
+    request_us, query_us = instrumentation_cost()
+    queries_per_pass = queries / (2 * rounds)
+    estimated_ms = (request_us * len(paths) + query_us * queries_per_pass) / 1000
+    return {
+        "paths": len(paths),
+        "rounds": rounds,
+        "with_ms": round(with_ms, 3),
+        "without_ms": round(without_ms, 3),
+        "measured_pct": round((with_ms - without_ms) / without_ms * 100, 2),
+        "request_us": round(request_us, 2),
+        "query_us": round(query_us, 2),
+        "queries_per_pass": queries_per_pass,
+        "estimated_pct": round(estimated_ms / without_ms * 100, 3),
+    }
+
+
+def run(repeat=5, roles=ROLES, only=None):
+    samples = sample_objects()
+    client = Client(HTTP_HOST=host_name(), raise_request_exception=False)
+    results = {}
+    for case in collect_cases(samples, roles):
+        if only and case["name"] not in only:
+            continue
+        key = case["name"] if "skipped" in case else f"{case['name']}[{case['role']}]"
+        if "skipped" in case:
+            results[key] = {"skipped": case["skipped"]}
+            continue
+        user = samples[case["role"]] if case["role"] != "anonymous" else None
+        results[key] = run_case(client, case, user, repeat)
+    return {
+        "meta": report_meta(
+            database=connection.vendor,
+            repeat=repeat,
+            dataset=dataset_summary(),
+        ),
+        "views": results,
+        "flows": run_flows(samples),
+        "conditional": run_revalidation(samples),
+        "metrics_overhead": run_metrics_overhead(samples),
+    }
+
+
+def compare_reports(old, new):
+    """Rows of (view, old median ms, new median ms, ratio, old queries, new queries)."""
+    rows = []
+    for key, result in new["views"].items():
+        before = old["views"].get(key)
+        if "skipped" in result or not before or "skipped" in before:
+            continue
+        old_ms = before["wall_ms"]["median"]
+        new_ms = result["wall_ms"]["median"]
+        rows.append(
+            (
+                key,
+                old_ms,
+                new_ms,
+                round(new_ms / old_ms, 2) if old_ms else None,
+                before["queries"],
+                result["queries"],
+            )
+        )
+    return rows
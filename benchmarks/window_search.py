@@ -0,0 +1,113 @@
+"""Multi-route time-window searches.
+
+The same searches are answered with one ORM query per route, one query over
+all routes, and the in-memory ``carpool_index`` cold and warm.
+"""
+import datetime
+import random
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .. import carpool_index
+from ..fare_matrix import get_fare_matrix
+from ..models import Carpool
+from . import dataset_summary, percentile, report_meta
+
+# 時段搜尋：幾個出發地到一個目的地，40 分鐘的時段
+WINDOW_DEPARTURES = 3
+WINDOW_MINUTES = 40
+
+
+def window_queries(count, seed=0):
+    """``(date, start, end, carfare_ids)`` over dates that have waiting carpools."""
+    rng = random.Random(seed)
+    days = list(
+        Carpool.objects.filter(status="w")
+        .order_by("date")
+        .values_list("date", flat=True)
+        .distinct()
+    )
+    places = [place.pk for place in get_fare_matrix().places]
+    if not days or len(places) < 2:
+        return []
+    queries = []
+    for _ in range(count):
+        arrival = rng.choice(places)
+        departures = rng.sample(
+            [pk for pk in places if pk != arrival],
+            min(WINDOW_DEPARTURES, len(places) - 1),
+        )
+        minute = rng.randrange(6 * 60, 22 * 60)
+        start = datetime.time(minute // 60, minute % 60)
+        minute += WINDOW_MINUTES
+        end = datetime.time(minute // 60, minute % 60)
+        routes = carpool_index.route_ids(departures, arrival)
+        queries.append((rng.choice(days), start, end, routes))
+    return queries
+
+
+def per_route_ids(day, start, end, carfare_ids):
+    ids = []
+    for carfare_id in carfare_ids:
+        ids += Carpool.objects.filter(
+            date=day, status="w", carfare_id=carfare_id, time__range=(start, end)
+        ).values_list("time", "id")
+    return [pk for _, pk in sorted(ids)]
+
+
+def single_query_ids(day, start, end, carfare_ids):
+    return list(
+        Carpool.objects.filter(
+            date=day, status="w", carfare_id__in=carfare_ids, time__range=(start, end)
+        )
+        .order_by("time", "id")
+        .values_list("id", flat=True)
+    )
+
+
+def run(queries=200):
+    """Multi-route time-window searches: ORM per route, one query, and the index."""
+    searches = window_queries(queries)
+    carpool_index.invalidate()
+    strategies = {
+        "per_route_orm": per_route_ids,
+        "single_query": single_query_ids,
+        # 第一次查某日期時載入該日期
+        "index_cold": carpool_index.search,
+        "index_warm": carpool_index.search,
+    }
+    results = {}
+    expected = None
+    for name, search in strategies.items():
+        timings, answers = [], []
+        with CaptureQueriesContext(connection) as ctx:
+            for search_args in searches:
+                start = time.perf_counter()
+                answers.append(search(*search_args))
+                timings.append((time.perf_counter() - start) * 1000)
+        if expected is None:
+            expected = answers
+        timings.sort()
+        results[name] = {
+            "p50_ms": percentile(timings, 0.5, digits=4),
+            "p95_ms": percentile(timings, 0.95, digits=4),
+            "total_ms": round(sum(timings), 3),
+            "queries": len(ctx.captured_queries),
+            "mismatches": sum(a != b for a, b in zip(answers, expected)),
+        }
+    return {
+        "meta": report_meta(
+            searches=len(searches),
+            mean_routes=round(
+                statistics.mean([len(s[3]) for s in searches]) if searches else 0, 2
+            ),
+            mean_results=round(
+                statistics.mean([len(a) for a in expected]) if searches else 0, 2
+            ),
+            dataset=dataset_summary(),
+        ),
+        "strategies": results,
+    }
@@ -0,0 +1,451 @@
+"""Streaming CSV/JSONL import and export of places, fares, carpools and comments.
+
+Rows are read and written one batch at a time, so memory stays flat however
+large the file is.  Foreign keys use natural keys (place name, departure and
+arrival names, username): places and fares are small and kept in lookup
+maps for the whole run, usernames are resolved with one query per batch.
+Imports use ``bulk_create``, so no per-row signals fire; the stored counters
+they would maintain (seats taken, driver ratings) are written directly.
+"""
+
+import csv
+import itertools
+import json
+from collections import Counter
+from datetime import date, time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from . import card_cache, carpool_index, conditional, fare_matrix, place_index
+from .models import (
+    Carfare,
+    Carpool,
+    Comment,
+    Place,
+    Profile,
+    User,
+    star_field,
+    update_trip_count,
+)
+from .signals import driver_rating_changed
+
+BATCH_SIZE = 2000
+# CSV 以分號分隔乘客帳號
+LIST_SEPARATOR = ";"
+
+
+class BulkImportError(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def read_records(f, fmt, list_fields=()):
+    """Yield ``(line number, record)`` from a CSV or JSONL file object."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            for field in list_fields:
+                value = record.get(field) or ""
+                record[field] = [item for item in value.split(LIST_SEPARATOR) if item]
+            yield reader.line_num, record
+    else:
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise BulkImportError(line, f"invalid JSON: {e.msg}")
+            if not isinstance(record, dict):
+                raise BulkImportError(line, "expected a JSON object")
+            yield line, record
+
+
+def write_records(f, fmt, fields, records, list_fields=()):
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for record in records:
+            for field in list_fields:
+                record[field] = LIST_SEPARATOR.join(record[field])
+            writer.writerow(record)
+            count += 1
+    else:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def chunked(queryset, chunk_size):
+    """Keyset-chunked iteration by primary key; each chunk is one query."""
+    last = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last).order_by("pk")[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]["id"]
+
+
+def resolve_usernames(usernames):
+    """Map every username of a batch to its id.
+
+    ``usernames`` yields ``(line, username)``; an unknown user is reported
+    at the first line that names one.
+    """
+    lines = {}
+    for line, name in usernames:
+        if name:
+            lines.setdefault(name, line)
+    ids = {}
+    # 分段查詢，避開 SQLite 的參數數量上限
+    for names in batched(sorted(lines), 500):
+        ids.update(
+            User.objects.filter(username__in=names).values_list("username", "id")
+        )
+    missing = lines.keys() - ids.keys()
+    if missing:
+        line = min(lines[name] for name in missing)
+        names = sorted(name for name in missing if lines[name] == line)
+        raise BulkImportError(line, f"unknown user(s): {', '.join(names)}")
+    return ids
+
+
+class BulkFormat:
+    """Column layout and import/export of one model."""
+
+    fields = ()
+    list_fields = ()
+
+    def export(self, chunk_size=BATCH_SIZE):
+        raise NotImplementedError
+
+    def import_batch(self, batch):
+        """Insert one batch of ``(line, record)``; return the number of rows."""
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def import_records(self, records, batch_size=BATCH_SIZE):
+        count = 0
+        with transaction.atomic():
+            for batch in batched(records, batch_size):
+                count += self.import_batch(batch)
+            self.finish()
+        return count
+
+    def places(self):
+        if not hasattr(self, "_places"):
+            self._places = {}
+            for pk, name in Place.objects.order_by("pk").values_list("pk", "name"):
+                self._places.setdefault(name, pk)
+        return self._places
+
+    def carfares(self):
+        if not hasattr(self, "_carfares"):
+            self._carfares = {
+                (departure, arrival): (pk, fare)
+                for pk, departure, arrival, fare in Carfare.objects.values_list(
+                    "pk", "departure__name", "arrival__name", "fare"
+                ).order_by("-pk")
+            }
+        return self._carfares
+
+
+def parse_coordinate(line, record, field, bound):
+    value = record.get(field)
+    if value in (None, ""):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise BulkImportError(line, f"invalid {field} {value!r}")
+    if not -bound <= value <= bound:
+        raise BulkImportError(line, f"{field} out of range: {value}")
+    return value
+
+
+class PlaceFormat(BulkFormat):
+    fields = ("name", "latitude", "longitude")
+
+    def export(self, chunk_size=BATCH_SIZE):
+        queryset = Place.objects.values("id", "name", "latitude", "longitude")
+        for chunk in chunked(queryset, chunk_size):
+            for row in chunk:
+                yield {
+                    "name": row["name"],
+                    "latitude": row["latitude"],
+                    "longitude": row["longitude"],
+                }
+
+    def import_batch(self, batch):
+        places = self.places()
+        new, located = {}, {}
+        for line, record in batch:
+            name = (record.get("name") or "").strip()
+            if not name:
+                raise BulkImportError(line, "empty place name")
+            latitude = parse_coordinate(line, record, "latitude", 90)
+            longitude = parse_coordinate(line, record, "longitude", 180)
+            if (latitude is None) != (longitude is None):
+                raise BulkImportError(line, "latitude and longitude go together")
+            if name in new:
+                if latitude is not None:
+                    new[name].latitude, new[name].longitude = latitude, longitude
+            elif name not in places:
+                new[name] = Place(name=name, latitude=latitude, longitude=longitude)
+            elif latitude is not None:
+                # 已有的地點只補上座標
+                located[places[name]] = Place(
+                    pk=places[name], latitude=latitude, longitude=longitude
+                )
+        for place in Place.objects.bulk_create(new.values()):
+            places[place.name] = place.pk
+        Place.objects.bulk_update(located.values(), ["latitude", "longitude"])
+        return len(new) + len(located)
+
+    def finish(self):
+        fare_matrix.invalidate()
+        place_index.invalidate()
+        card_cache.bump_version("fares")
+        conditional.bump("fares")
+
+
+class CarfareFormat(BulkFormat):
+    fields = ("departure", "arrival", "fare")
+
+    def export(self, chunk_size=BATCH_SIZE):
+        queryset = Carfare.objects.values(
+            "id", "departure__name", "arrival__name", "fare"
+        )
+        for chunk in chunked(queryset, chunk_size):
+            for row in chunk:
+                yield {
+                    "departure": row["departure__name"],
+                    "arrival": row["arrival__name"],
+                    "fare": row["fare"],
+                }
+
+    def import_batch(self, batch):
+        places, carfares = self.places(), self.carfares()
+        new, changed = {}, {}
+        for line, record in batch:
+            route = (record.get("departure"), record.get("arrival"))
+            for name in route:
+                if name not in places:
+                    raise BulkImportError(line, f"unknown place {name!r}")
+            try:
+                fare = int(record["fare"])
+            except (KeyError, TypeError, ValueError):
+                raise BulkImportError(line, f"invalid fare {record.get('fare')!r}")
+            if route in new:
+                new[route].fare = fare
+            elif route in carfares:
+                pk, old = carfares[route]
+                if old != fare:
+                    changed[pk] = Carfare(pk=pk, fare=fare)
+                    carfares[route] = (pk, fare)
+            else:
+                new[route] = Carfare(
+                    departure_id=places[route[0]],
+                    arrival_id=places[route[1]],
+                    fare=fare,
+                )
+        Carfare.objects.bulk_create(new.values())
+        for route, carfare in new.items():
+            carfares[route] = (carfare.pk, carfare.fare)
+        Carfare.objects.bulk_update(changed.values(), ["fare"])
+        return len(new) + len(changed)
+
+    def finish(self):
+        fare_matrix.invalidate()
+        card_cache.bump_version("fares")
+        conditional.bump("fares")
+
+
+class CarpoolFormat(BulkFormat):
+    fields = (
+        "date",
+        "time",
+        "departure",
+        "arrival",
+        "lower_passengers",
+        "driver",
+        "status",
+        "passengers",
+    )
+    list_fields = ("passengers",)
+
+    def __init__(self):
+        # 每位司機新增的完成趟數，匯入結束時一次寫回
+        self.trips = {}
+
+    def export(self, chunk_size=BATCH_SIZE):
+        Passenger = Carpool.passengers.through
+        queryset = Carpool.objects.values(
+            "id",
+            "date",
+            "time",
+            "carfare__departure__name",
+            "carfare__arrival__name",
+            "lower_passengers",
+            "driver__username",
+            "status",
+        )
+        for chunk in chunked(queryset, chunk_size):
+            passengers = {row["id"]: [] for row in chunk}
+            for carpool_id, username in (
+                Passenger.objects.filter(carpool_id__in=passengers)
+                .order_by("id")
+                .values_list("carpool_id", "student__username")
+            ):
+                passengers[carpool_id].append(username)
+            for row in chunk:
+                yield {
+                    "date": row["date"].isoformat(),
+                    "time": row["time"].strftime("%H:%M"),
+                    "departure": row["carfare__departure__name"],
+                    "arrival": row["carfare__arrival__name"],
+                    "lower_passengers": row["lower_passengers"],
+                    "driver": row["driver__username"] or "",
+                    "status": row["status"],
+                    "passengers": passengers[row["id"]],
+                }
+
+    def import_batch(self, batch):
+        Passenger = Carpool.passengers.through
+        carfares = self.carfares()
+        users = resolve_usernames(
+            (line, name)
+            for line, record in batch
+            for name in [record.get("driver"), *(record.get("passengers") or [])]
+        )
+        statuses = {status for status, _ in Carpool.STATUS_CHOICES}
+
+        carpools, seats = [], []
+        for line, record in batch:
+            route = (record.get("departure"), record.get("arrival"))
+            if route not in carfares:
+                raise BulkImportError(line, f"unknown carfare {route[0]} -> {route[1]}")
+            status = record.get("status") or "w"
+            if status not in statuses:
+                raise BulkImportError(line, f"invalid status {status!r}")
+            passengers = list(dict.fromkeys(record.get("passengers") or []))
+            try:
+                carpool = Carpool(
+                    date=date.fromisoformat(record["date"]),
+                    time=time.fromisoformat(record["time"]),
+                    carfare_id=carfares[route][0],
+                    lower_passengers=int(record.get("lower_passengers") or 1),
+                    driver_id=users.get(record.get("driver")),
+                    status=status,
+                    seats_taken=len(passengers),
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                raise BulkImportError(line, str(e))
+            carpools.append(carpool)
+            seats.append(passengers)
+
+        Carpool.objects.bulk_create(carpools)
+        for carpool in carpools:
+            if carpool.status == "a" and carpool.driver_id is not None:
+                self.trips[carpool.driver_id] = self.trips.get(carpool.driver_id, 0) + 1
+        Passenger.objects.bulk_create(
+            Passenger(carpool_id=carpool.pk, student_id=users[username])
+            for carpool, passengers in zip(carpools, seats)
+            for username in passengers
+        )
+        return len(carpools)
+
+    def finish(self):
+        for driver_id, count in self.trips.items():
+            update_trip_count(driver_id, count)
+        carpool_index.invalidate()
+        conditional.bump("board")
+
+
+class CommentFormat(BulkFormat):
+    fields = ("time", "critic", "criticed", "score", "content")
+
+    def __init__(self):
+        # 每位司機各星等的筆數，匯入結束時一次寫回
+        self.ratings = {}
+
+    def export(self, chunk_size=BATCH_SIZE):
+        queryset = Comment.objects.values(
+            "id", "time", "critic__username", "criticed__username", "score", "content"
+        )
+        for chunk in chunked(queryset, chunk_size):
+            for row in chunk:
+                yield {
+                    "time": row["time"].isoformat(),
+                    "critic": row["critic__username"] or "",
+                    "criticed": row["criticed__username"] or "",
+                    "score": row["score"],
+                    "content": row["content"],
+                }
+
+    def import_batch(self, batch):
+        users = resolve_usernames(
+            (line, name)
+            for line, record in batch
+            for name in (record.get("critic"), record.get("criticed"))
+        )
+        comments = []
+        for line, record in batch:
+            try:
+                score = int(record["score"])
+                when = parse_datetime(record["time"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise BulkImportError(line, str(e))
+            if when is None or not 1 <= score <= 5:
+                raise BulkImportError(line, "invalid time or score")
+            if is_naive(when):
+                when = make_aware(when)
+            comment = Comment(
+                time=when,
+                content=record.get("content") or "",
+                score=score,
+                critic_id=users.get(record.get("critic")),
+                criticed_id=users.get(record.get("criticed")),
+            )
+            comments.append(comment)
+            if comment.criticed_id is not None:
+                self.ratings.setdefault(comment.criticed_id, Counter())[score] += 1
+        Comment.objects.bulk_create(comments)
+        return len(comments)
+
+    def finish(self):
+        for driver_id, scores in self.ratings.items():
+            total = sum(score * count for score, count in scores.items())
+            stars = {
+                star_field(score): F(star_field(score)) + count
+                for score, count in scores.items()
+            }
+            Profile.objects.filter(user_id=driver_id).update(
+                rating_sum=F("rating_sum") + total,
+                rating_count=F("rating_count") + scores.total(),
+                **stars,
+            )
+            driver_rating_changed.send(sender=Comment, driver_id=driver_id)
+
+
+FORMATS = {
+    "place": PlaceFormat,
+    "carfare": CarfareFormat,
+    "carpool": CarpoolFormat,
+    "comment": CommentFormat,
+}
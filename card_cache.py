@@ -0,0 +1,124 @@
+"""Versioned render cache for board cards.
+
+A card body is cached under two coarse versions: ``board``, moved by any
+change a card can show (the carpool, its passengers, its driver's car or
+rating), and ``fares``, moved by places and fares.  Signals bump a version
+instead of deleting entries, so stale fragments are simply never looked up
+again and expire on their own.  A change re-renders every card once per
+process; in exchange a page of cards costs one read of two keys from the
+shared cache instead of several per card.  The body holds no
+user-specific markup and is shared by every user.
+
+The versions live in the shared default cache (see ``versions``); the
+bodies go to the per-process ``cards`` cache, since their keys already
+name the versions they depend on.
+"""
+import threading
+
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from .models import Car, Carfare, Place
+from .signals import carpool_changed, driver_rating_changed
+from .versions import bump, get_versions
+
+CARD_TEMPLATE = "app/htmx/carpool_card_body.html"
+CARD_TIMEOUT = 60 * 60
+
+
+class CacheStats:
+    """Hit/miss counters of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+
+stats = CacheStats()
+
+
+def version_key(kind):
+    return f"carpool-card-version:{kind}"
+
+
+def bump_version(kind):
+    bump(version_key(kind))
+
+
+def render_cards(carpools):
+    """Attach the cached body HTML to each carpool as ``card_html``."""
+    carpools = [carpool for carpool in carpools if not hasattr(carpool, "card_html")]
+    # 固定班次尚未展開的日子沒有版本可追，直接渲染
+    for carpool in carpools:
+        if carpool.is_virtual:
+            carpool.card_html = render_to_string(CARD_TEMPLATE, {"carpool": carpool})
+    carpools = [carpool for carpool in carpools if not carpool.is_virtual]
+    if not carpools:
+        return
+
+    keys = [version_key("board"), version_key("fares")]
+    versions = get_versions(keys)
+    board, fares = (versions[key] for key in keys)
+    card_keys = {
+        carpool.pk: f"carpool-card:{carpool.pk}:{board}:{fares}" for carpool in carpools
+    }
+    cache = caches["cards"]
+    cached = cache.get_many(list(card_keys.values()))
+
+    rendered = {}
+    for carpool in carpools:
+        key = card_keys[carpool.pk]
+        if key in cached:
+            carpool.card_html = cached[key]
+        else:
+            carpool.card_html = render_to_string(CARD_TEMPLATE, {"carpool": carpool})
+            rendered[key] = carpool.card_html
+    if rendered:
+        cache.set_many(rendered, CARD_TIMEOUT)
+    stats.record(hits=len(carpools) - len(rendered), misses=len(rendered))
+
+
+def card_html(carpool):
+    render_cards([carpool])
+    return carpool.card_html
+
+
+@receiver(carpool_changed)
+@receiver(driver_rating_changed)
+def bump_card_version(sender, **kwargs):
+    bump_version("board")
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def bump_driver_car_version(sender, **kwargs):
+    bump_version("board")
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=Carfare)
+@receiver(post_delete, sender=Carfare)
+def bump_fares_version(sender, **kwargs):
+    bump_version("fares")
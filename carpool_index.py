@@ -0,0 +1,148 @@
+"""In-process index of waiting carpools by date, route and departure time.
+
+For each date that has been searched, the waiting carpools are loaded with
+one query into sorted ``(time, id)`` runs per carfare.  A time-window search
+over several routes bisects each run and merges the slices, so it costs
+O(log n + k) per route without touching the database.  The board starts
+the search behind its keyset cursor and takes about a page of ids, so the
+SQL ``IN`` list stays bounded however wide the window is.
+
+Each date has a version kept with the other shared versions (see
+``versions``; settings require a cache shared between processes).  Saving
+or deleting a carpool bumps the version of its date, now and again on
+commit like the fare matrix, and every process reloads that date on its
+next search.  A carpool moved to another date may linger under the old one
+until that date reloads; the board query re-checks date and status, so
+such an id is simply dropped.
+"""
+import bisect
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .fare_matrix import get_fare_matrix
+from .models import Carpool
+from .versions import bump as bump_key
+from .versions import get_versions
+
+GENERATION_KEY = "carpool-index-generation"
+# 同時留在記憶體的日期數
+MAX_DATES = 62
+
+
+def version_key(day):
+    return f"carpool-index-version:{day}"
+
+
+class DayIndex:
+    """Waiting carpools of one date: carfare_id -> (sorted times, ids)."""
+
+    def __init__(self, rows):
+        self.routes = {}
+        self.size = 0
+        # rows 需依 (carfare, time, id) 排序
+        for carfare_id, departure_time, pk in rows:
+            times, ids = self.routes.setdefault(carfare_id, ([], []))
+            times.append(departure_time)
+            ids.append(pk)
+            self.size += 1
+
+    @classmethod
+    def load(cls, day):
+        return cls(
+            Carpool.objects.filter(date=day, status="w", carfare__isnull=False)
+            .order_by("carfare_id", "time", "id")
+            .values_list("carfare_id", "time", "id")
+        )
+
+    def window(self, carfare_ids, start=None, end=None, after=None, limit=None):
+        """Ids leaving between ``start`` and ``end`` inclusive, by (time, id).
+
+        A missing bound leaves that end of the day open.  ``after`` is a
+        ``(time, id)`` keyset position to start behind, and ``limit`` the
+        most ids to return.
+        """
+        runs = []
+        for carfare_id in carfare_ids:
+            route = self.routes.get(carfare_id)
+            if route is None:
+                continue
+            times, ids = route
+            lo = 0 if start is None else bisect.bisect_left(times, start)
+            if after is not None:
+                after_time, after_id = after
+                lo = max(lo, bisect.bisect_left(times, after_time))
+                # 同一時間的 id 已排序，跳過游標以前的
+                same = bisect.bisect_right(times, after_time, lo)
+                lo = bisect.bisect_right(ids, after_id, lo, same)
+            hi = len(times) if end is None else bisect.bisect_right(times, end, lo)
+            if lo < hi:
+                runs.append(zip(times[lo:hi], ids[lo:hi]))
+        return [pk for _, pk in itertools.islice(heapq.merge(*runs), limit)]
+
+
+def route_ids(departures=(), arrival=None):
+    """Carfare ids from any of ``departures`` to ``arrival``; empty means any."""
+    departures = set(departures)
+    routes = get_fare_matrix().routes
+    return [
+        carfare_id
+        for carfare_id, (departure_id, arrival_id, _) in routes.items()
+        if (not departures or departure_id in departures)
+        and (arrival is None or arrival_id == arrival)
+    ]
+
+
+_lock = threading.Lock()
+_days = OrderedDict()
+
+
+def get_day_index(day):
+    key = str(day)
+    versions = get_versions([GENERATION_KEY, version_key(key)])
+    version = (versions[GENERATION_KEY], versions[version_key(key)])
+    with _lock:
+        entry = _days.get(key)
+        if entry is not None and entry[0] == version:
+            _days.move_to_end(key)
+            return entry[1]
+    # 在鎖外查詢，其他日期的搜尋不必等
+    index = DayIndex.load(day)
+    with _lock:
+        _days[key] = (version, index)
+        _days.move_to_end(key)
+        while len(_days) > MAX_DATES:
+            _days.popitem(last=False)
+    return index
+
+
+def search(day, start, end, carfare_ids, after=None, limit=None):
+    return get_day_index(day).window(carfare_ids, start, end, after, limit)
+
+
+def bump(day):
+    key = str(day)
+    with _lock:
+        _days.pop(key, None)
+    bump_key(version_key(key))
+
+
+def invalidate():
+    """Drop every date; for bulk writes that send no signals."""
+    with _lock:
+        _days.clear()
+    bump_key(GENERATION_KEY)
+
+
+@receiver(post_save, sender=Carpool)
+@receiver(post_delete, sender=Carpool)
+def bump_carpool_date(sender, instance, **kwargs):
+    day = instance.date
+    bump(day)
+    # commit 前被其他請求重新載入的日期可能是舊資料，commit 後再清一次
+    transaction.on_commit(lambda: bump(day))
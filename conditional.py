@@ -0,0 +1,138 @@
+"""Conditional GET for the board and the price table.
+
+Two versions are kept with the other shared versions (see ``versions``):
+``board``, moved by every change a board card can show (carpools,
+recurring carpools, passengers, drivers), and ``fares``, moved when places
+or fares change.  A version is the time of the last change in nanoseconds.
+The ETag combines the versions with the user in the session and the query
+string, which lets an unchanged page be answered with 304 before the view
+runs any query.  ``Last-Modified`` only has whole seconds, so it is sent
+once the second of the last change is over; until then a later change in
+the same second could not be told apart.
+"""
+import functools
+import hashlib
+import time
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .card_cache import CacheStats
+from .models import Car, Carfare, Place, RecurringCarpool
+from .signals import carpool_changed, driver_rating_changed
+from .versions import bump as bump_key
+from .versions import get_versions
+
+# 每種頁面依賴哪些版本
+PAGES = {
+    "board": ("board", "fares"),
+    "price": ("fares",),
+}
+
+stats = {page: CacheStats() for page in PAGES}
+
+
+def version_key(kind):
+    return f"page-version:{kind}"
+
+
+def bump(kind):
+    """Move ``kind`` now and once more on commit.
+
+    A request that renders between the change and its commit would otherwise
+    tag the old data with the new version.
+    """
+    touch(kind)
+    transaction.on_commit(lambda: touch(kind))
+
+
+def touch(kind):
+    bump_key(version_key(kind))
+
+
+def page_validators(request, page):
+    """``(etag, last_modified)`` of ``page`` for this request; no SQL.
+
+    ``last_modified`` is None while the second of the last change lasts.
+    """
+    keys = [version_key(kind) for kind in PAGES[page]]
+    versions = get_versions(keys)
+    versions = [versions[key] for key in keys]
+    parts = [
+        page,
+        *map(str, versions),
+        str(request.session.get(SESSION_KEY, "")),
+        request.GET.urlencode(),
+    ]
+    if page == "board":
+        # 預設列表只列今天以後的團
+        parts.append(date.today().isoformat())
+    etag = quote_etag(hashlib.md5("|".join(parts).encode()).hexdigest())
+    last_modified = max(versions) // 10**9
+    if time.time_ns() // 10**9 <= last_modified:
+        return etag, None
+    return etag, last_modified
+
+
+def conditional_page(page):
+    """Answer ``If-None-Match``/``If-Modified-Since`` for an async view."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, *args, **kwargs)
+            # session 與快取都在 thread 中讀取，不碰 ORM
+            etag, last_modified = await sync_to_async(page_validators)(request, page)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            stats[page].record(
+                hits=int(response is not None), misses=int(response is None)
+            )
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.headers.setdefault("ETag", etag)
+            if last_modified is not None:
+                response.headers.setdefault("Last-Modified", http_date(last_modified))
+            # 內容因人而異；瀏覽器每次都要帶 ETag 回來驗證
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@receiver(carpool_changed)
+@receiver(driver_rating_changed)
+def bump_board_version(sender, **kwargs):
+    bump("board")
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def bump_board_car_version(sender, **kwargs):
+    bump("board")
+
+
+@receiver(post_save, sender=RecurringCarpool)
+@receiver(post_delete, sender=RecurringCarpool)
+def bump_board_recurring_version(sender, **kwargs):
+    bump("board")
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=Carfare)
+@receiver(post_delete, sender=Carfare)
+def bump_fares_version(sender, **kwargs):
+    bump("fares")
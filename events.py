@@ -0,0 +1,288 @@
+"""Server-Sent Events stream of board card changes.
+
+Every change to a carpool is rendered once, right after its transaction
+commits, and the same fragment is pushed to every open board.  The card
+wrapper carries the date, time, route and seat data the board filters
+on; ``board_events.js`` compares it with the filter the tab's board was
+rendered with, then replaces, removes or inserts the card at its
+(date, time, id) position instead of re-running the board query.
+
+The stream is a plain ASGI app mounted by ``se_bubuchacha/asgi.py``.
+Changes may commit in any process (ASGI or WSGI workers, management
+commands), so every rendered event goes to ``EventLog``, a numbered log in
+the shared default cache (Redis or Memcached, see ``versions``).  Each
+process with open streams runs one thread that polls the log and hands new
+events to its own subscribers; a tab that missed events (the log was
+evicted or fell too far behind) is told to reload its board.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from .models import Carpool
+from .signals import carpool_changed
+
+KEEPALIVE_SECONDS = 15
+QUEUE_SIZE = 100
+POLL_SECONDS = 0.5
+# 計數已加、內容卻一直沒寫入（發送的行程中途結束）時，等多久就放棄
+GAP_SECONDS = 5
+EVENT_TIMEOUT = 60
+SEQUENCE_KEY = "board-events:last"
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """One open event stream."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message):
+        # 在 subscriber 的 event loop 中執行
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventLog:
+    """Board events in the shared cache, numbered by an atomic ``incr``."""
+
+    def event_key(self, number):
+        return f"board-events:{number}"
+
+    def position(self):
+        return cache.get(SEQUENCE_KEY, 0)
+
+    def append(self, message):
+        for _ in range(2):
+            cache.add(SEQUENCE_KEY, 0, None)
+            try:
+                number = cache.incr(SEQUENCE_KEY)
+                break
+            except ValueError:
+                # add 與 incr 之間計數被逐出，重來一次
+                continue
+        else:
+            return
+        cache.set(self.event_key(number), message, EVENT_TIMEOUT)
+
+    def read(self, after, limit=QUEUE_SIZE):
+        """``(messages, position, last)`` of the events after ``after``.
+
+        ``messages`` is None when some were lost: the counter went back (it
+        was evicted) or more than ``limit`` are waiting.  Reading stops
+        before an event that is numbered but not written yet.
+        """
+        last = self.position()
+        if last < after or last - after > limit:
+            return None, last, last
+        numbers = range(after + 1, last + 1)
+        found = cache.get_many([self.event_key(number) for number in numbers])
+        messages = []
+        for number in numbers:
+            message = found.get(self.event_key(number))
+            if message is None:
+                break
+            messages.append(message)
+            after = number
+        return messages, after, last
+
+
+event_log = EventLog()
+
+
+class BoardEventBroker:
+    """Publishes to the shared log; delivers it to this process's streams."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._poller = None
+        self._position = 0
+        self._gap_since = None
+
+    def subscribe(self, loop=None):
+        subscriber = Subscriber(loop or asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+            poller = None
+            if self._poller is None:
+                poller = self._poller = threading.Thread(
+                    target=self._poll_forever, name="board-events", daemon=True
+                )
+        if poller is not None:
+            # 從現在的位置開始，不重送訂閱前的事件
+            with self._poll_lock:
+                self._position = event_log.position()
+                self._gap_since = None
+            poller.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, message):
+        """Send ``message`` to the streams of every process."""
+        event_log.append(message)
+
+    def deliver(self, message):
+        """Thread-safe: hand ``message`` to the streams of this process."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.put, message)
+
+    def poll(self):
+        """Deliver what was appended to the log since the last poll."""
+        # 送出也在鎖內，測試與輪詢執行緒同時呼叫時順序不亂
+        with self._poll_lock:
+            messages, self._position, last = event_log.read(self._position)
+            if messages is None:
+                messages = [format_event("resync", "")]
+            elif self._position < last:
+                now = time.monotonic()
+                self._gap_since = self._gap_since or now
+                if now - self._gap_since > GAP_SECONDS:
+                    messages.append(format_event("resync", ""))
+                    self._position = last
+                    self._gap_since = None
+            else:
+                self._gap_since = None
+            for message in messages:
+                self.deliver(message)
+
+    def _poll_forever(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                # 快取暫時連不上時下一輪再試
+                logger.exception("polling board events failed")
+            time.sleep(POLL_SECONDS)
+
+
+broker = BoardEventBroker()
+
+
+def format_event(kind, data):
+    lines = [f"event: {kind}"]
+    lines += [f"data: {line}" for line in data.splitlines() or [""]]
+    return "\n".join(lines) + "\n\n"
+
+
+def render_card_event(carpool_id, kind):
+    """The SSE message for one carpool, carrying an out-of-band swap."""
+    carpool = Carpool.objects.for_board().filter(pk=carpool_id, status="w").first()
+    if carpool is None:
+        # 已刪除或不在看板上 (出發/抵達)
+        html = f'<div id="carpool-{carpool_id}" hx-swap-oob="delete"></div>'
+        return format_event("deleted" if kind == "deleted" else kind, html)
+
+    html = render_to_string(
+        "app/htmx/carpool_card.html", {"carpool": carpool, "swap_oob": True}
+    )
+    return format_event(kind, html)
+
+
+_pending = threading.local()
+
+
+def _flush_pending():
+    changes = _pending.__dict__.pop("changes", {})
+    for carpool_id, kind in changes.items():
+        broker.publish(render_card_event(carpool_id, kind))
+
+
+@receiver(carpool_changed)
+def publish_carpool_change(sender, carpool_id, kind, **kwargs):
+    # 看板可能開在其他行程，不論本行程有沒有訂閱者都要推播。
+    # 同一個 transaction 內的多次變更只推播一次；rollback 時 Django 會丟掉
+    # on_commit 的 callback，所以要確認 flush 仍在排程中
+    connection = transaction.get_connection()
+    changes = _pending.__dict__.get("changes")
+    scheduled = changes is not None and any(
+        entry[1] is _flush_pending for entry in connection.run_on_commit
+    )
+    if not scheduled:
+        changes = _pending.changes = {}
+    if changes.get(carpool_id) != "created" or kind == "deleted":
+        changes[carpool_id] = kind
+    if not scheduled:
+        transaction.on_commit(_flush_pending)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def board_events_app(scope, receive, send):
+    """ASGI app streaming board events as text/event-stream."""
+    subscriber = broker.subscribe()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while not disconnected.done():
+            if subscriber.overflowed:
+                # 跟不上就請瀏覽器整個重新載入看板
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.overflowed = False
+                message = format_event("resync", "")
+            else:
+                getter = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, disconnected},
+                    timeout=KEEPALIVE_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if getter in done:
+                    message = getter.result()
+                else:
+                    getter.cancel()
+                    if disconnected in done:
+                        break
+                    message = ": keepalive\n\n"
+
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": message.encode(),
+                    "more_body": True,
+                }
+            )
+    finally:
+        broker.unsubscribe(subscriber)
+        disconnected.cancel()
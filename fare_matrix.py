@@ -0,0 +1,129 @@
+"""In-process place x place fare matrix.
+
+The whole fare table is small and changes rarely, so it is loaded with a
+single query into a dense array and kept in module memory.  Place/Carfare
+signals drop the local copy and bump its version (see ``versions``); every
+lookup compares the local copy with that version, so other processes
+rebuild on their next lookup.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Carfare, Place
+from .versions import bump, get_version
+
+VERSION_KEY = "fare-matrix-version"
+
+
+class FareMatrix:
+    """Fares indexed by place; ``places`` is sorted by name like the price page."""
+
+    def __init__(self, places, routes):
+        self.places = sorted(places, key=lambda place: (place.name, place.pk))
+        self.index = {place.pk: i for i, place in enumerate(self.places)}
+        # routes: carfare_id -> (departure_id, arrival_id, fare)
+        self.routes = routes
+
+        size = len(self.places)
+        self.fares = [[None] * size for _ in range(size)]
+        for departure_id, arrival_id, fare in routes.values():
+            if departure_id in self.index and arrival_id in self.index:
+                self.fares[self.index[departure_id]][self.index[arrival_id]] = fare
+
+    @classmethod
+    def load(cls):
+        rows = Place.objects.values_list(
+            "id",
+            "name",
+            "departure_fares__id",
+            "departure_fares__arrival_id",
+            "departure_fares__fare",
+        ).order_by()
+        places = {}
+        routes = {}
+        for place_id, name, carfare_id, arrival_id, fare in rows:
+            if place_id not in places:
+                places[place_id] = Place(id=place_id, name=name)
+            if carfare_id is not None:
+                routes[carfare_id] = (place_id, arrival_id, fare)
+        routes = dict(sorted(routes.items(), key=lambda item: item[1][:2]))
+        return cls(list(places.values()), routes)
+
+    def fare(self, departure, arrival):
+        """Fare between two places (instances or pks), ``None`` if unknown."""
+        i = self.index.get(getattr(departure, "pk", departure))
+        j = self.index.get(getattr(arrival, "pk", arrival))
+        if i is None or j is None:
+            return None
+        return self.fares[i][j]
+
+    def route_fare(self, carfare_id):
+        route = self.routes.get(carfare_id)
+        return None if route is None else route[2]
+
+    def carfare(self, carfare_id):
+        """A fresh ``Carfare`` instance built from the matrix, no query."""
+        departure_id, arrival_id, fare = self.routes[carfare_id]
+        carfare = Carfare(id=carfare_id, fare=fare)
+        carfare.departure = self._place(departure_id)
+        carfare.arrival = self._place(arrival_id)
+        carfare._state.adding = False
+        carfare._state.db = "default"
+        return carfare
+
+    def carfares(self):
+        """Every route in ``Carfare.Meta.ordering`` order."""
+        return [self.carfare(carfare_id) for carfare_id in self.routes]
+
+    def rows(self):
+        """Lower triangle for the price table: each place against the ones before it."""
+        return [
+            (place, self.fares[i][:i]) for i, place in enumerate(self.places) if i > 0
+        ]
+
+    def _place(self, place_id):
+        if place_id is None:
+            return None
+        place = self.places[self.index[place_id]]
+        return Place(id=place.pk, name=place.name)
+
+
+_lock = threading.Lock()
+_matrix = None
+_version = None
+
+
+def get_fare_matrix():
+    global _matrix, _version
+    version = get_version(VERSION_KEY)
+    matrix = _matrix
+    if matrix is not None and version == _version:
+        return matrix
+    with _lock:
+        if _matrix is None or version != _version:
+            _matrix = FareMatrix.load()
+            _version = version
+        return _matrix
+
+
+def fare(departure, arrival):
+    return get_fare_matrix().fare(departure, arrival)
+
+
+def invalidate():
+    global _matrix
+    _matrix = None
+    bump(VERSION_KEY)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=Carfare)
+@receiver(post_delete, sender=Carfare)
+def invalidate_fare_matrix(sender, **kwargs):
+    invalidate()
+    # 交易中途被其他請求重建的矩陣可能讀到舊資料，commit 後再清一次
+    transaction.on_commit(invalidate)
@@ -1,9 +1,15 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth import get_user_model
+from django.core import signing
 from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.lookups import GreaterThanOrEqual
 from django.utils.translation import gettext_lazy as _
+from django.forms.models import ModelChoiceIterator
+from .fare_matrix import get_fare_matrix
 from .models import Carfare, Profile, Carpool, Comment, Car, User, Profile
+from .models import RecurringCarpool
 from datetime import date, timedelta
 
 User = get_user_model()
@@ -11,6 +17,46 @@ User = get_user_model()
 profile_common_fields = ["name", "sex", "phone_num"]
 
 
+class FareMatrixIterator(ModelChoiceIterator):
+    """Carfare choices served from the in-process fare matrix."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for carfare in get_fare_matrix().carfares():
+            yield self.choice(carfare)
+
+    def __len__(self):
+        return len(get_fare_matrix().routes) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(get_fare_matrix().routes)
+
+
+def place_choices():
+    return [(place.pk, place.name) for place in get_fare_matrix().places]
+
+
+class CarfareChoiceField(forms.ModelChoiceField):
+    iterator = FareMatrixIterator
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("queryset", Carfare.objects.all())
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return get_fare_matrix().carfare(int(value))
+        except (KeyError, ValueError, TypeError):
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+
+
 class SignUpForm(UserCreationForm):
     class Meta:
         model = User
@@ -72,6 +118,9 @@ class CarpoolForm(forms.ModelForm):
             attrs={"type": "time", "class": "form-control"},
         ),
     )
+    carfare = CarfareChoiceField(
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
 
     class Meta:
         model = Carpool
@@ -83,16 +132,88 @@ class CarpoolForm(forms.ModelForm):
                     "max": "5",
                 }
             ),
-            "carfare": forms.Select(attrs={"class": "form-control"}),
         }
 
 
+class RecurringCarpoolForm(forms.ModelForm):
+    time = forms.TimeField(
+        widget=forms.TimeInput(
+            format=("%H:%M"),
+            attrs={"type": "time", "class": "form-control"},
+        ),
+    )
+    carfare = CarfareChoiceField(
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+    weekdays = forms.TypedMultipleChoiceField(
+        coerce=int,
+        choices=RecurringCarpool.WEEKDAY_CHOICES,
+        initial=[0, 1, 2, 3, 4],
+        widget=forms.CheckboxSelectMultiple,
+    )
+    start_date = forms.DateField(
+        initial=date.today,
+        widget=forms.DateInput(
+            format=("%Y-%m-%d"),
+            attrs={"type": "date", "class": "form-control", "min": date.today()},
+        ),
+    )
+    end_date = forms.DateField(
+        required=False,
+        widget=forms.DateInput(
+            format=("%Y-%m-%d"),
+            attrs={"type": "date", "class": "form-control", "min": date.today()},
+        ),
+    )
+
+    class Meta:
+        model = RecurringCarpool
+        fields = [
+            "time",
+            "carfare",
+            "lower_passengers",
+            "weekdays",
+            "start_date",
+            "end_date",
+        ]
+        widgets = {
+            "lower_passengers": forms.NumberInput(
+                attrs={
+                    "min": "1",
+                    "max": "5",
+                }
+            ),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            # 資料庫存的是 bitmask，表單用星期清單
+            self.initial["weekdays"] = [
+                day
+                for day, _ in RecurringCarpool.WEEKDAY_CHOICES
+                if self.instance.weekdays >> day & 1
+            ]
+
+    def clean_weekdays(self):
+        return sum(1 << day for day in set(self.cleaned_data["weekdays"]))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get("start_date"), cleaned_data.get(
+            "end_date"
+        )
+        if start_date and end_date and end_date < start_date:
+            self.add_error("end_date", "結束日期不能早於開始日期")
+        return cleaned_data
+
+
 class CarpoolFilterForm(forms.Form):
-    class MyModelChoiceField(forms.ModelChoiceField):
+    class MyModelChoiceField(CarfareChoiceField):
         def label_from_instance(self, obj):
             return f"{str(obj.departure):　>7} → {str(obj.arrival):　<7}"
 
-    carfare = MyModelChoiceField(queryset=Carfare.objects, required=False)
+    carfare = MyModelChoiceField(required=False)
     date = forms.DateField(
         widget=forms.DateInput(
             format=("%Y-%m-%d"),
@@ -117,6 +238,107 @@ class CarpoolFilterForm(forms.Form):
     )
     has_driver = forms.BooleanField(required=False)
     has_vacancy = forms.BooleanField(initial=True, required=False)
+    # 由瀏覽器定位填入；兩者都有才做附近搜尋
+    latitude = forms.FloatField(
+        min_value=-90, max_value=90, required=False, widget=forms.HiddenInput
+    )
+    longitude = forms.FloatField(
+        min_value=-180, max_value=180, required=False, widget=forms.HiddenInput
+    )
+    radius = forms.FloatField(
+        min_value=0.1,
+        max_value=50,
+        required=False,
+        widget=forms.NumberInput(attrs={"min": "0.5", "max": "50", "step": "0.5"}),
+    )
+
+    # 時段搜尋：time ~ time_until 之間，從任一出發地到目的地
+    time_until = forms.TimeField(
+        widget=forms.TimeInput(format=("%H:%M"), attrs={"type": "time"}),
+        required=False,
+    )
+    departures = forms.TypedMultipleChoiceField(
+        coerce=int, choices=place_choices, required=False
+    )
+    arrival = forms.TypedChoiceField(
+        coerce=int,
+        choices=lambda: [("", "不限"), *place_choices()],
+        empty_value=None,
+        required=False,
+    )
+
+    DEFAULT_RADIUS = 3
+
+    def clean(self):
+        cleaned_data = super().clean()
+        time_from, time_until = cleaned_data.get("time"), cleaned_data.get("time_until")
+        if time_from and time_until and time_until < time_from:
+            self.add_error("time_until", "結束時間不能早於開始時間")
+        cleaned_data["window"] = bool(
+            time_until or cleaned_data.get("departures") or cleaned_data.get("arrival")
+        )
+        if (
+            cleaned_data.get("latitude") is None
+            or cleaned_data.get("longitude") is None
+        ):
+            cleaned_data["latitude"] = cleaned_data["longitude"] = None
+        elif cleaned_data.get("radius") is None:
+            cleaned_data["radius"] = self.DEFAULT_RADIUS
+        return cleaned_data
+
+
+class DriverFilterForm(forms.Form):
+    SORT_CHOICES = (
+        ("rating", "評分最高"),
+        ("reviews", "評論最多"),
+        ("trips", "趟數最多"),
+    )
+    # 排序欄位最後都接 id，keyset 分頁的游標才唯一
+    ORDERINGS = {
+        "rating": ["-rating", "id"],
+        "reviews": ["-review_count", "id"],
+        "trips": ["-trip_count", "id"],
+    }
+
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False)
+    min_stars = forms.TypedChoiceField(
+        choices=[("", "不限星等")] + [(n, f"{n} 星以上") for n in range(1, 6)],
+        coerce=int,
+        empty_value=None,
+        required=False,
+    )
+    car_type = forms.ChoiceField(
+        choices=(("", "不限車種"),) + Car.UTILITY_CHOICES, required=False
+    )
+    capacity = forms.IntegerField(
+        min_value=3,
+        max_value=9,
+        required=False,
+        widget=forms.NumberInput(attrs={"min": "3", "max": "9"}),
+    )
+
+    def ordering(self):
+        sort = self.cleaned_data.get("sort") if self.is_valid() else None
+        return self.ORDERINGS[sort or "rating"]
+
+    def filter(self, queryset):
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data["min_stars"]:
+            # 比的是列表顯示的星等 (Driver.score)：平均 >= n - 0.5，用整數避免誤差
+            queryset = queryset.filter(
+                GreaterThanOrEqual(
+                    F("profile__rating_sum") * 2,
+                    F("profile__rating_count") * (2 * data["min_stars"] - 1),
+                ),
+                profile__rating_count__gt=0,
+            )
+        if data["car_type"]:
+            queryset = queryset.filter(car__type=data["car_type"])
+        if data["capacity"]:
+            queryset = queryset.filter(car__capacity__gte=data["capacity"])
+        return queryset
 
 
 class CommentForm(forms.ModelForm):
@@ -125,6 +347,41 @@ class CommentForm(forms.ModelForm):
         fields = ["score", "content"]
 
 
+class CommentCreateForm(forms.ModelForm):
+    """Comment on the driver of an arrived carpool.
+
+    The carpool, its driver and the student are carried in a signed token
+    rendered with the form, so posting needs no session state.
+    """
+
+    TOKEN_SALT = "app.comment"
+    # 行程結束後一天內可以評論
+    TOKEN_MAX_AGE = 24 * 60 * 60
+
+    token = forms.CharField(widget=forms.HiddenInput)
+
+    class Meta:
+        model = Comment
+        fields = ["content", "score"]
+
+    @classmethod
+    def make_token(cls, carpool, student):
+        return signing.dumps(
+            {"carpool": carpool.pk, "driver": carpool.driver_id, "student": student.pk},
+            salt=cls.TOKEN_SALT,
+        )
+
+    def clean_token(self):
+        try:
+            return signing.loads(
+                self.cleaned_data["token"],
+                salt=self.TOKEN_SALT,
+                max_age=self.TOKEN_MAX_AGE,
+            )
+        except signing.BadSignature:
+            raise ValidationError("評論連結已失效，請重新開啟", code="invalid_token")
+
+
 class CarForm(forms.ModelForm):
     class Meta:
         widgets = {
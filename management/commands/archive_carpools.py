@@ -0,0 +1,50 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.archive import ARCHIVE_BATCH_SIZE, archivable, archive_batch
+
+
+class Command(BaseCommand):
+    help = "Move arrived carpools and their passengers into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Archive carpools that arrived at least this many days ago.",
+        )
+        parser.add_argument(
+            "--before",
+            type=date.fromisoformat,
+            help="Archive carpools dated before this day (YYYY-MM-DD).",
+        )
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the carpools that would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["days"] < 0:
+            raise CommandError("--batch-size must be positive and --days non-negative")
+        before = options["before"] or date.today() - timedelta(days=options["days"])
+
+        if options["dry_run"]:
+            count = archivable(before).count()
+            self.stdout.write(f"{count} carpool(s) dated before {before} to archive")
+            return
+
+        total = 0
+        while True:
+            moved = archive_batch(before, options["batch_size"])
+            total += moved
+            if moved:
+                self.stdout.write(f"archived {total} carpool(s)")
+            if moved < options["batch_size"]:
+                break
+        self.stdout.write(
+            self.style.SUCCESS(f"{total} carpool(s) dated before {before} archived")
+        )
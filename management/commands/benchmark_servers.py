@@ -0,0 +1,30 @@
+from app.benchmarks import ASYNC_VIEWS, servers
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Compare WSGI and ASGI throughput of the async read views."
+    counts = {"concurrency": 64, "requests": 2000}
+
+    def add_benchmark_arguments(self, parser):
+        parser.add_argument(
+            "--view",
+            action="append",
+            choices=ASYNC_VIEWS,
+            help="Only request this URL name (repeatable).",
+        )
+
+    def benchmark(self, **options):
+        return servers.run(
+            concurrency=options["concurrency"],
+            requests=options["requests"],
+            only=options["view"],
+        )
+
+    def write_report(self, report, **options):
+        for name, result in report["servers"].items():
+            self.stdout.write(
+                f"{name:<5} {result['rps']:>9.1f} req/s "
+                f"p50 {result['p50_ms']:>8.2f} ms p95 {result['p95_ms']:>8.2f} ms "
+                f"status {result['statuses']}"
+            )
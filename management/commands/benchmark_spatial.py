@@ -0,0 +1,25 @@
+from app.benchmarks import spatial
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Radius queries over synthetic places, grid index vs linear scan."
+    counts = {"places": 100000, "queries": 200}
+
+    def benchmark(self, **options):
+        return spatial.run(places=options["places"], queries=options["queries"])
+
+    def write_report(self, report, **options):
+        meta = report["meta"]
+        self.stdout.write(
+            f"{meta['places']} places in {meta['cells']} cells, "
+            f"built in {meta['build_ms']} ms"
+        )
+        for radius, result in report["radii"].items():
+            self.stdout.write(
+                f"{radius:>4} km  grid p50 {result['grid_p50_ms']:>7.3f} ms "
+                f"p95 {result['grid_p95_ms']:>7.3f} ms  "
+                f"linear p50 {result['brute_force_p50_ms']:>8.3f} ms  "
+                f"{result['mean_results']:>7.1f} results  "
+                f"{result['mismatches']} mismatches"
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import CommandError
+from django.db import connection
+
+from app.benchmarks import sqlite
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Multi-process write/read contention, old vs current SQLite settings."
+    counts = {"processes": 8, "operations": 200}
+
+    def benchmark(self, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("the default database is not SQLite")
+        return sqlite.run(
+            processes=options["processes"], operations=options["operations"]
+        )
+
+    def write_report(self, report, **options):
+        for name, result in report["profiles"].items():
+            self.stdout.write(
+                f"{name:<10} {result['ops_per_s']:>8.1f} ops/s "
+                f"p50 {result['p50_ms']:>8.2f} ms p95 {result['p95_ms']:>8.2f} ms "
+                f"failed {result['failed']}/{result['operations']}"
+            )
+            for message, count in result["errors"].items():
+                self.stdout.write(f"    {count:>5} {message}")
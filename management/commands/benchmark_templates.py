@@ -0,0 +1,16 @@
+from app.benchmarks import templates
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Time rendering a page of board cards and their star ratings."
+    counts = {"cards": 500, "repeat": 5}
+
+    def benchmark(self, **options):
+        return templates.run(cards=options["cards"], repeat=options["repeat"])
+
+    def write_report(self, report, **options):
+        cards = report["meta"]["cards"]
+        for group in ("loader", "stars"):
+            for name, ms in report[group].items():
+                self.stdout.write(f"{group:<6} {name:<8} {ms:>9.3f} ms / {cards} cards")
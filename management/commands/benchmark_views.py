@@ -0,0 +1,79 @@
+import json
+
+from app.benchmarks import ROLES, views
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Time every view in urls.py and write a JSON report."
+    counts = {"repeat": 5}
+    default_output = "benchmark-report.json"
+
+    def add_benchmark_arguments(self, parser):
+        parser.add_argument(
+            "--role",
+            action="append",
+            choices=ROLES,
+            help="Only request as this role (repeatable).",
+        )
+        parser.add_argument(
+            "--view",
+            action="append",
+            help="Only benchmark this URL name (repeatable).",
+        )
+        parser.add_argument(
+            "--compare",
+            metavar="REPORT",
+            help="Print the median wall time and query count against an older report.",
+        )
+
+    def benchmark(self, **options):
+        return views.run(
+            repeat=options["repeat"],
+            roles=options["role"] or ROLES,
+            only=options["view"],
+        )
+
+    def write_report(self, report, **options):
+        for key, result in report["views"].items():
+            if "skipped" in result:
+                self.stdout.write(f"{key:<45} skipped: {result['skipped']}")
+            else:
+                self.stdout.write(
+                    f"{key:<45} {result['status']} "
+                    f"{result['wall_ms']['median']:>9.2f} ms "
+                    f"{result['queries']:>4} queries {result['rows']:>7} rows"
+                )
+
+        for key, result in report["flows"].items():
+            self.stdout.write(
+                f"{key:<45} {result['status']} "
+                f"{result['queries']:>4} queries {result['writes']:>3} writes"
+            )
+
+        for key, result in report["conditional"].items():
+            self.stdout.write(
+                f"{key:<45} 304 hit rate {result['hit_rate']:>6.1%} "
+                f"({result['hits']}/{result['hits'] + result['misses']})"
+            )
+
+        overhead = report["metrics_overhead"]
+        self.stdout.write(
+            f"{'metrics middleware':<45} {overhead['without_ms']:>9.2f} -> "
+            f"{overhead['with_ms']:>9.2f} ms ({overhead['measured_pct']:+.2f}%, "
+            f"estimated {overhead['estimated_pct']:.3f}%)"
+        )
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as f:
+                old = json.load(f)
+            self.stdout.write(
+                self.style.MIGRATE_HEADING("compared to " + options["compare"])
+            )
+            for key, old_ms, new_ms, ratio, old_q, new_q in views.compare_reports(
+                old, report
+            ):
+                self.stdout.write(
+                    f"{key:<45} {old_ms:>9.2f} -> {new_ms:>9.2f} ms (x{ratio}) "
+                    f"queries {old_q} -> {new_q}"
+                )
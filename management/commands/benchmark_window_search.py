@@ -0,0 +1,29 @@
+from django.core.management.base import CommandError
+
+from app.benchmarks import window_search
+from app.benchmarks.command import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = "Multi-route time-window searches: per-route ORM vs one query vs index."
+    counts = {"queries": 200}
+
+    def benchmark(self, **options):
+        report = window_search.run(queries=options["queries"])
+        if not report["meta"]["searches"]:
+            raise CommandError("no waiting carpools to search")
+        return report
+
+    def write_report(self, report, **options):
+        meta = report["meta"]
+        self.stdout.write(
+            f"{meta['searches']} searches, {meta['mean_routes']} routes and "
+            f"{meta['mean_results']} results on average"
+        )
+        for name, result in report["strategies"].items():
+            self.stdout.write(
+                f"{name:<14} p50 {result['p50_ms']:>8.3f} ms "
+                f"p95 {result['p95_ms']:>8.3f} ms "
+                f"{result['queries']:>5} queries "
+                f"{result['mismatches']} mismatches"
+            )
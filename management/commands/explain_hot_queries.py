@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.query_plans import full_scans, hot_queries
+
+
+class Command(BaseCommand):
+    help = "Print the query plan of each hot query and fail on full table scans."
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, queryset in hot_queries().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain())
+            tables = full_scans(queryset)
+            if tables:
+                failed.append(f"{name} ({', '.join(tables)})")
+
+        if failed:
+            raise CommandError("full table scan in: " + "; ".join(failed))
+        self.stdout.write(self.style.SUCCESS("all hot queries use an index"))
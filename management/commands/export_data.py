@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.bulk_io import BATCH_SIZE, FORMATS, write_records
+
+
+def file_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith(".jsonl"):
+        return "jsonl"
+    raise CommandError("cannot tell the format from the file name, use --format")
+
+
+class Command(BaseCommand):
+    help = "Stream places, carfares, carpools or comments out as CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=FORMATS)
+        parser.add_argument(
+            "-o", "--output", default="-", help="Output file, '-' for stdout."
+        )
+        parser.add_argument("--format", choices=("csv", "jsonl"))
+        parser.add_argument("--chunk-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        fmt = file_format(
+            output, options["format"] or ("jsonl" if output == "-" else None)
+        )
+        bulk_format = FORMATS[options["model"]]()
+        records = bulk_format.export(options["chunk_size"])
+
+        if output == "-":
+            count = write_records(
+                self.stdout, fmt, bulk_format.fields, records, bulk_format.list_fields
+            )
+        else:
+            with open(output, "w", encoding="utf-8", newline="") as f:
+                count = write_records(
+                    f, fmt, bulk_format.fields, records, bulk_format.list_fields
+                )
+        self.stderr.write(f"exported {count} {options['model']} row(s)")
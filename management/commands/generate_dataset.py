@@ -0,0 +1,257 @@
+import io
+import math
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import make_aware
+
+from app import card_cache, carpool_index, conditional, fare_matrix, place_index
+from app.models import Car, Carfare, Carpool, Comment, Place, Profile, User
+
+PLACE_NAMES = (
+    "桃園高鐵站",
+    "中壢火車站",
+    "中壢夜市",
+    "中原夜市",
+    "中央大學",
+    "元智大學",
+    "桃園火車站",
+    "桃園機場",
+    "青埔",
+    "內壢火車站",
+    "平鎮",
+    "楊梅火車站",
+    "大溪老街",
+    "龍潭",
+    "八德",
+    "藝文特區",
+)
+# 隨機地點分布在此點東北方 30 公里見方內
+ORIGIN = (24.85, 121.05)
+KM_PER_DEGREE = 111.32
+COMMENTS = ("準時又安全", "車內很乾淨", "司機很親切", "開太快了", "普普通通", "會再搭")
+
+
+class Command(BaseCommand):
+    help = "Bulk-insert a synthetic dataset of users, places, carfares, carpools and comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=1000)
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--places", type=int, default=40)
+        parser.add_argument("--carpools", type=int, default=10000)
+        parser.add_argument("--comments", type=int, default=5000)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Spread carpool dates this many days around today.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Run `flush` first; this wipes the whole database.",
+        )
+
+    def handle(self, *args, **options):
+        if options["students"] < 1 or options["drivers"] < 1 or options["places"] < 2:
+            raise CommandError("need at least 1 student, 1 driver and 2 places")
+        if options["flush"]:
+            call_command("flush", interactive=False, verbosity=0)
+
+        self.verbosity = options["verbosity"]
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.today = date.today()
+        # 使用者名稱以目前最大 id 起算，可重複執行累加資料
+        self.tag = (
+            User.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        ) + 1
+
+        students = self.create_users(User.Types.STUDENT, options["students"])
+        drivers = self.create_users(User.Types.DRIVER, options["drivers"])
+        capacities = self.create_cars(drivers)
+        carfares = self.create_carfares(options["places"])
+        self.create_carpools(
+            options["carpools"],
+            options["days"],
+            students,
+            drivers,
+            capacities,
+            carfares,
+        )
+        self.create_comments(options["comments"], students, drivers)
+
+        call_command("rebuild_driver_ratings", stdout=io.StringIO())
+        call_command("rebuild_driver_trips", stdout=io.StringIO())
+        # bulk_create 不會送出 signal，手動讓快取失效
+        fare_matrix.invalidate()
+        place_index.invalidate()
+        carpool_index.invalidate()
+        card_cache.bump_version("fares")
+        conditional.bump("fares")
+        conditional.bump("board")
+        self.stdout.write(self.style.SUCCESS("dataset generated"))
+
+    def log(self, message):
+        if self.verbosity:
+            self.stdout.write(message)
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield range(start, min(start + self.batch_size, total))
+
+    def create_users(self, user_type, count):
+        rng = self.rng
+        password = make_password("pass0000")
+        prefix = "s" if user_type == User.Types.STUDENT else "d"
+        ids = []
+        for batch in self.batches(count):
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(
+                        username=f"{prefix}{self.tag}-{i}",
+                        password=password,
+                        type=user_type,
+                        email=f"{prefix}{self.tag}-{i}@example.com",
+                    )
+                    for i in batch
+                )
+                profiles = []
+                for user in users:
+                    profile = Profile(
+                        user_id=user.pk,
+                        sex=rng.choice(Profile.SexTypes.values),
+                        name=f"{prefix}{user.pk}"[:8],
+                        phone_num=f"09{rng.randrange(10 ** 8):08}",
+                    )
+                    if user_type == User.Types.DRIVER:
+                        profile.company = "泡泡車隊"
+                        profile.cert_code = f"A{rng.randrange(10 ** 6):06}"
+                        profile.cert_expirydate = self.today + timedelta(
+                            days=rng.randint(30, 1000)
+                        )
+                    profiles.append(profile)
+                Profile.objects.bulk_create(profiles)
+            ids.extend(user.pk for user in users)
+        self.log(f"{len(ids)} {user_type.label.lower()}s")
+        return ids
+
+    def create_cars(self, drivers):
+        rng = self.rng
+        cars = [
+            Car(
+                driver_id=driver_id,
+                capacity=rng.choice((4, 4, 4, 5, 7, 9)),
+                plate=f"{''.join(rng.choices('ABCDEFGHJKLMNPQRSTUVWXYZ', k=3))}-{rng.randrange(10000):04}",
+                type=rng.choice("nnnela"),
+            )
+            for driver_id in drivers
+        ]
+        Car.objects.bulk_create(cars, batch_size=self.batch_size)
+        self.log(f"{len(cars)} cars")
+        return {car.driver_id: car.capacity for car in cars}
+
+    def create_carfares(self, count):
+        rng = self.rng
+        names = [
+            PLACE_NAMES[i % len(PLACE_NAMES)]
+            + (f" {i // len(PLACE_NAMES) + 1}" if i >= len(PLACE_NAMES) else "")
+            for i in range(count)
+        ]
+        # 以隨機座標（公里）的距離估車資
+        xy = [(rng.random() * 30, rng.random() * 30) for _ in names]
+        lon_scale = KM_PER_DEGREE * math.cos(math.radians(ORIGIN[0]))
+        places = Place.objects.bulk_create(
+            Place(
+                name=name,
+                latitude=ORIGIN[0] + y / KM_PER_DEGREE,
+                longitude=ORIGIN[1] + x / lon_scale,
+            )
+            for name, (x, y) in zip(names, xy)
+        )
+        points = {place.pk: point for place, point in zip(places, xy)}
+
+        carfares = []
+        for departure in places:
+            for arrival in places:
+                if departure.pk == arrival.pk:
+                    continue
+                (x1, y1), (x2, y2) = points[departure.pk], points[arrival.pk]
+                distance = ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
+                carfares.append(
+                    Carfare(
+                        departure_id=departure.pk,
+                        arrival_id=arrival.pk,
+                        fare=85 + round(distance * 20),
+                    )
+                )
+        Carfare.objects.bulk_create(carfares, batch_size=self.batch_size)
+        self.log(f"{len(places)} places, {len(carfares)} carfares")
+        return [carfare.pk for carfare in carfares]
+
+    def create_carpools(self, count, days, students, drivers, capacities, carfares):
+        rng = self.rng
+        Passenger = Carpool.passengers.through
+        for batch in self.batches(count):
+            carpools = []
+            seats = []
+            for _ in batch:
+                day = self.today + timedelta(days=rng.randint(-days, days))
+                driver_id = rng.choice(drivers) if rng.random() < 0.6 else None
+                if driver_id is None:
+                    status = "w"
+                elif day < self.today:
+                    status = "a"
+                elif day == self.today:
+                    status = rng.choice("wwd")
+                else:
+                    status = "w"
+                capacity = capacities[driver_id] if driver_id else 4
+                passengers = rng.sample(
+                    students, min(rng.randint(1, capacity), len(students))
+                )
+                carpools.append(
+                    Carpool(
+                        date=day,
+                        time=time(rng.randint(6, 23), rng.randrange(0, 60, 10)),
+                        carfare_id=rng.choice(carfares),
+                        lower_passengers=rng.randint(1, len(passengers)),
+                        driver_id=driver_id,
+                        status=status,
+                        seats_taken=len(passengers),
+                    )
+                )
+                seats.append(passengers)
+            with transaction.atomic():
+                Carpool.objects.bulk_create(carpools)
+                Passenger.objects.bulk_create(
+                    Passenger(carpool_id=carpool.pk, student_id=student_id)
+                    for carpool, passengers in zip(carpools, seats)
+                    for student_id in passengers
+                )
+            self.log(f"{batch.stop}/{count} carpools")
+
+    def create_comments(self, count, students, drivers):
+        rng = self.rng
+        now = datetime.combine(self.today, time())
+        for batch in self.batches(count):
+            Comment.objects.bulk_create(
+                Comment(
+                    time=make_aware(
+                        now - timedelta(minutes=rng.randrange(60 * 24 * 365))
+                    ),
+                    content=rng.choice(COMMENTS),
+                    score=rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 3, 6, 9))[0],
+                    critic_id=rng.choice(students),
+                    criticed_id=rng.choice(drivers),
+                )
+                for _ in batch
+            )
+        self.log(f"{count} comments")
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.bulk_io import BATCH_SIZE, FORMATS, BulkImportError, read_records
+
+from .export_data import file_format
+
+
+class Command(BaseCommand):
+    help = "Stream places, carfares, carpools or comments in from CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=FORMATS)
+        parser.add_argument("path", help="Input file, '-' for stdin.")
+        parser.add_argument("--format", choices=("csv", "jsonl"))
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = file_format(path, options["format"] or ("jsonl" if path == "-" else None))
+        bulk_format = FORMATS[options["model"]]()
+
+        f = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+        try:
+            records = read_records(f, fmt, bulk_format.list_fields)
+            count = bulk_format.import_records(records, options["batch_size"])
+        except BulkImportError as e:
+            raise CommandError(f"{path}: {e}; nothing was imported")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        self.stdout.write(
+            self.style.SUCCESS(f"imported {count} {options['model']} row(s)")
+        )
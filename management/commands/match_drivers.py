@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import matching
+
+
+class Command(BaseCommand):
+    help = "Assign drivers to waiting carpools without a driver in one batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="start",
+            type=date.fromisoformat,
+            help="First date to match (YYYY-MM-DD); defaults to today.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=1, help="Number of days in the window."
+        )
+        parser.add_argument(
+            "--gap",
+            type=int,
+            default=matching.DEFAULT_GAP,
+            help="Minimum minutes between two carpools of one driver.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the planned assignments.",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["gap"] < 0:
+            raise CommandError("--days must be positive and --gap non-negative")
+        start = options["start"] or date.today()
+        end = start + timedelta(days=options["days"] - 1)
+
+        result = matching.match_drivers(
+            start, end, gap=options["gap"], dry_run=options["dry_run"]
+        )
+        if options["verbosity"] > 1:
+            for carpool_id, driver_id in result.assignments.items():
+                self.stdout.write(f"carpool {carpool_id} -> driver {driver_id}")
+
+        planned = len(result.assignments)
+        total = planned + len(result.unmatched)
+        if options["dry_run"]:
+            self.stdout.write(f"{planned}/{total} carpool(s) can get a driver")
+            return
+        lost = planned - len(result.applied)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"assigned {len(result.applied)}/{total} carpool(s) "
+                f"from {start} to {end}"
+                + (f", {lost} changed meanwhile" if lost else "")
+            )
+        )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F
+
+from app.models import Carpool
+
+
+class Command(BaseCommand):
+    help = "Rebuild Carpool.seats_taken from the passenger links."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report carpools whose seat counter has drifted.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = []
+            carpools = (
+                Carpool.objects.select_for_update()
+                .annotate(actual=Count("passengers"))
+                .exclude(seats_taken=F("actual"))
+                .only("id", "seats_taken")
+            )
+            for carpool in carpools.iterator():
+                self.stdout.write(
+                    f"carpool {carpool.pk}: stored {carpool.seats_taken}, "
+                    f"expected {carpool.actual}"
+                )
+                carpool.seats_taken = carpool.actual
+                drifted.append(carpool)
+
+            if options["check"]:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} carpool seat count(s) drifted")
+                self.stdout.write(self.style.SUCCESS("carpool seats are in sync"))
+                return
+
+            Carpool.objects.bulk_update(drifted, ["seats_taken"], batch_size=500)
+            self.stdout.write(
+                self.style.SUCCESS(f"rebuilt {len(drifted)} carpool seat count(s)")
+            )
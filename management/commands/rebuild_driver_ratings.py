@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from app.models import Comment, Profile, star_field
+
+STAR_FIELDS = [star_field(stars) for stars in range(1, 6)]
+FIELDS = ["rating_sum", "rating_count"] + STAR_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored driver rating sum/count and star counts from comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drivers whose stored rating has drifted.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # 每位司機：[總和, 筆數, 1 星筆數, ..., 5 星筆數]
+            actual = {}
+            for row in (
+                Comment.objects.filter(criticed__isnull=False)
+                .values("criticed", "score")
+                .annotate(count=Count("id"))
+                .order_by()
+            ):
+                values = actual.setdefault(row["criticed"], [0] * len(FIELDS))
+                values[0] += row["score"] * row["count"]
+                values[1] += row["count"]
+                values[1 + row["score"]] += row["count"]
+
+            drifted = []
+            profiles = Profile.objects.select_for_update().only("user_id", *FIELDS)
+            for profile in profiles.iterator():
+                stored = [getattr(profile, field) for field in FIELDS]
+                expected = actual.get(profile.user_id, [0] * len(FIELDS))
+                if stored != expected:
+                    self.stdout.write(
+                        f"user {profile.user_id}: stored sum/count/stars {stored}, "
+                        f"expected {expected}"
+                    )
+                    for field, value in zip(FIELDS, expected):
+                        setattr(profile, field, value)
+                    drifted.append(profile)
+
+            if options["check"]:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} driver rating(s) drifted")
+                self.stdout.write(self.style.SUCCESS("driver ratings are in sync"))
+                return
+
+            Profile.objects.bulk_update(drifted, FIELDS, batch_size=500)
+            self.stdout.write(
+                self.style.SUCCESS(f"rebuilt {len(drifted)} driver rating(s)")
+            )
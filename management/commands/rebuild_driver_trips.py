@@ -0,0 +1,56 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from app.models import ArchivedCarpool, Carpool, Profile
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored driver trip count from live and archived carpools."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drivers whose stored trip count has drifted.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            actual = Counter()
+            for queryset in (
+                Carpool.objects.filter(status="a"),
+                ArchivedCarpool.objects.all(),
+            ):
+                for row in (
+                    queryset.filter(driver__isnull=False)
+                    .values("driver")
+                    .annotate(count=Count("id"))
+                    .order_by()
+                ):
+                    actual[row["driver"]] += row["count"]
+
+            drifted = []
+            profiles = Profile.objects.select_for_update().only("user_id", "trip_count")
+            for profile in profiles.iterator():
+                expected = actual.get(profile.user_id, 0)
+                if profile.trip_count != expected:
+                    self.stdout.write(
+                        f"user {profile.user_id}: stored {profile.trip_count}, "
+                        f"expected {expected}"
+                    )
+                    profile.trip_count = expected
+                    drifted.append(profile)
+
+            if options["check"]:
+                if drifted:
+                    raise CommandError(f"{len(drifted)} driver trip count(s) drifted")
+                self.stdout.write(self.style.SUCCESS("driver trip counts are in sync"))
+                return
+
+            Profile.objects.bulk_update(drifted, ["trip_count"], batch_size=500)
+            self.stdout.write(
+                self.style.SUCCESS(f"rebuilt {len(drifted)} driver trip count(s)")
+            )
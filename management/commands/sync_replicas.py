@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app.routers import sync_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = "Refresh the file-based SQLite read replicas from the primary database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "aliases",
+            nargs="*",
+            help="Replica aliases to refresh (default: settings.READ_REPLICAS).",
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("sync_replicas only copies SQLite databases")
+
+        aliases = options["aliases"] or settings.READ_REPLICAS
+        if not aliases:
+            raise CommandError("no replica aliases given and READ_REPLICAS is empty")
+        source = Path(primary.settings_dict["NAME"]).resolve()
+        for alias in aliases:
+            if alias not in settings.DATABASES:
+                raise CommandError(f"unknown database alias {alias!r}")
+            replica = connections[alias]
+            if replica.vendor != "sqlite":
+                raise CommandError(f"{alias} is not an SQLite database")
+            path = Path(replica.settings_dict["NAME"]).resolve()
+            if path == source:
+                raise CommandError(f"{alias} points at the primary database file")
+            replica.close()
+            sync_sqlite_replica(path)
+            self.stdout.write(f"{alias}: copied to {path}")
+        self.stdout.write(self.style.SUCCESS(f"refreshed {len(aliases)} replica(s)"))
@@ -0,0 +1,195 @@
+"""Batch assignment of drivers to waiting carpools.
+
+Every waiting carpool without a driver in a date window is matched in one
+pass.  A carpool only fits a car with more seats than it has passengers
+(the same rule as ``seats.assign_driver``), and a driver cannot hold two
+carpools that start within ``gap`` minutes of each other, counting the
+carpools already assigned to them.
+
+Carpools are taken in start-time order, larger groups first, and each one
+gets the least loaded free driver from the smallest car class that fits.
+For trips of equal length this chronological greedy is optimal in the
+number of carpools served, and best fit keeps large cars for large groups.
+Drivers sit in per-capacity heaps keyed by the time they are next free, a
+driver whose earlier commitments clash is parked until they end instead of
+being rescanned, so the whole batch costs O((C + D + K) log D) for K
+existing commitments instead of one query per carpool.
+"""
+import bisect
+import heapq
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Car, Carpool, Driver
+from .seats import MAX_PASSENGERS
+from .signals import carpool_changed
+
+# 同一司機兩團出發時間至少間隔幾分鐘
+DEFAULT_GAP = 90
+# 車種車資倍率，同樣空閒時優先派較便宜的車
+TYPE_COST = {"e": 0.9, "n": 1, "a": 1, "l": 1.5}
+UPDATE_CHUNK = 500
+
+Demand = namedtuple("Demand", "carpool_id start seats")
+Supply = namedtuple("Supply", "driver_id capacity type rating commitments")
+MatchResult = namedtuple("MatchResult", "assignments unmatched applied")
+
+
+def minutes(start, day, time):
+    return (day - start).days * 24 * 60 + time.hour * 60 + time.minute
+
+
+def load(start, end, carpools=None):
+    """Demand and supply for ``start``..``end`` as plain tuples, in three queries."""
+    if carpools is None:
+        carpools = Carpool.objects.all()
+    rows = (
+        carpools.filter(
+            date__range=(start, end), status="w", driver__isnull=True, seats_taken__gt=0
+        )
+        .order_by()
+        .values_list("id", "date", "time", "seats_taken")
+    )
+    demands = [
+        Demand(pk, minutes(start, day, time), seats) for pk, day, time, seats in rows
+    ]
+
+    # 視窗前後一天的既有行程也會造成衝突
+    commitments = defaultdict(list)
+    for driver_id, day, time in (
+        Carpool.objects.filter(
+            date__range=(start - timedelta(days=1), end + timedelta(days=1)),
+            status__in=("w", "d"),
+            driver__isnull=False,
+        )
+        .order_by()
+        .values_list("driver_id", "date", "time")
+    ):
+        commitments[driver_id].append(minutes(start, day, time))
+
+    supplies = [
+        Supply(
+            driver_id,
+            min(capacity, MAX_PASSENGERS),
+            car_type,
+            rating,
+            sorted(commitments.get(driver_id, ())),
+        )
+        for driver_id, capacity, car_type, rating in Driver.objects.with_rating()
+        .filter(car__isnull=False, is_active=True)
+        .order_by()
+        .values_list("id", "car__capacity", "car__type", "rating")
+    ]
+    return demands, supplies
+
+
+def conflicts(commitments, start, gap):
+    i = bisect.bisect_right(commitments, start - gap)
+    return i < len(commitments) and commitments[i] < start + gap
+
+
+def next_free(commitments, start, gap):
+    """The first time from ``start`` on that clashes with no commitment."""
+    i = bisect.bisect_right(commitments, start - gap)
+    while i < len(commitments) and commitments[i] < start + gap:
+        start = commitments[i] + gap
+        i += 1
+    return start
+
+
+def solve(demands, supplies, gap=DEFAULT_GAP):
+    """Return ``{carpool_id: driver_id}``; pure function over the loaded tuples."""
+    capacities = sorted({supply.capacity for supply in supplies})
+    # 每種座位數一組：waiting 依可用時間排序，ready 依負載排序
+    waiting = {capacity: [] for capacity in capacities}
+    ready = {capacity: [] for capacity in capacities}
+    drivers = {}
+    for supply in supplies:
+        drivers[supply.driver_id] = supply
+        ready[supply.capacity].append(
+            (0, TYPE_COST.get(supply.type, 1), -supply.rating, supply.driver_id)
+        )
+    for heap in ready.values():
+        heapq.heapify(heap)
+
+    assignments = {}
+    for demand in sorted(demands, key=lambda d: (d.start, -d.seats, d.carpool_id)):
+        fitting = capacities[bisect.bisect_right(capacities, demand.seats) :]
+        for capacity in fitting:
+            pending, ready_heap = waiting[capacity], ready[capacity]
+            while pending and pending[0][0] <= demand.start:
+                heapq.heappush(ready_heap, heapq.heappop(pending)[1])
+
+            chosen = None
+            while ready_heap:
+                entry = heapq.heappop(ready_heap)
+                commitments = drivers[entry[3]].commitments
+                if conflicts(commitments, demand.start, gap):
+                    # 衝突到既有行程結束為止，之後的團才重新考慮
+                    free = next_free(commitments, demand.start, gap)
+                    heapq.heappush(pending, (free, entry))
+                else:
+                    chosen = entry
+                    break
+
+            if chosen is not None:
+                trips, cost, rating, driver_id = chosen
+                assignments[demand.carpool_id] = driver_id
+                heapq.heappush(
+                    pending, (demand.start + gap, (trips + 1, cost, rating, driver_id))
+                )
+                break
+    return assignments
+
+
+def apply(assignments):
+    """Write the assignments with guarded UPDATEs; return the ones that stuck.
+
+    A carpool that got a driver, left the waiting state or outgrew the car
+    since it was loaded is left alone, like a lost race in ``assign_driver``.
+    """
+    capacity = dict(
+        Car.objects.filter(driver_id__in=set(assignments.values())).values_list(
+            "driver_id", "capacity"
+        )
+    )
+    pairs = list(assignments.items())
+    applied = {}
+    with transaction.atomic():
+        for i in range(0, len(pairs), UPDATE_CHUNK):
+            chunk = dict(pairs[i : i + UPDATE_CHUNK])
+            Carpool.objects.filter(
+                pk__in=chunk, status="w", driver__isnull=True
+            ).update(
+                driver=Case(
+                    *(
+                        When(
+                            pk=pk,
+                            seats_taken__lt=capacity[driver_id],
+                            then=Value(driver_id),
+                        )
+                        for pk, driver_id in chunk.items()
+                    ),
+                    default=F("driver"),
+                    output_field=IntegerField(),
+                )
+            )
+            for pk, driver_id in Carpool.objects.filter(pk__in=chunk).values_list(
+                "pk", "driver_id"
+            ):
+                if chunk[pk] == driver_id:
+                    applied[pk] = driver_id
+        for pk in applied:
+            carpool_changed.send(sender=Carpool, carpool_id=pk, kind="driver")
+    return applied
+
+
+def match_drivers(start, end=None, carpools=None, gap=DEFAULT_GAP, dry_run=False):
+    demands, supplies = load(start, end or start, carpools)
+    assignments = solve(demands, supplies, gap)
+    applied = {} if dry_run else apply(assignments)
+    unmatched = [d.carpool_id for d in demands if d.carpool_id not in assignments]
+    return MatchResult(assignments, unmatched, applied)
@@ -0,0 +1,253 @@
+"""Per-view latency, SQL and template metrics.
+
+``MetricsMiddleware`` times every request and files it under the resolved
+URL name, so memory is bounded by the routes in ``urls.py``.  While a
+request runs, its counters sit in a context variable, which follows the
+request into ``sync_to_async`` threads; a wrapper installed on every
+database connection adds the queries, and the ``DjangoTemplates`` backend
+below adds the render time.  Django only sends ``template_rendered`` under
+the test runner, hence the backend instead of the signal.
+
+``prometheus_text`` and ``snapshot`` export the totals of this process.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends import django as django_backend
+
+# 延遲分桶上限（秒），同 Prometheus client 預設值
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UNRESOLVED = "<unresolved>"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """Counters of the request in progress."""
+
+    __slots__ = ("queries", "sql_seconds", "template_seconds", "rendering")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rendering = False
+
+
+class ViewMetrics:
+    """Totals of one URL name."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def add(self, seconds, status, request_metrics):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.requests += 1
+        self.errors += status >= 500
+        self.seconds += seconds
+        self.queries += request_metrics.queries
+        self.sql_seconds += request_metrics.sql_seconds
+        self.template_seconds += request_metrics.template_seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+COUNTERS = (
+    ("app_request_errors_total", "counter", "Responses with a 5xx status.", "errors"),
+    ("app_sql_queries_total", "counter", "SQL statements executed.", "queries"),
+    ("app_sql_duration_seconds_total", "counter", "Time in SQL.", "sql_seconds"),
+    (
+        "app_template_render_seconds_total",
+        "counter",
+        "Time rendering templates.",
+        "template_seconds",
+    ),
+)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views = {}
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+
+    def record(self, view, seconds, status, request_metrics):
+        with self._lock:
+            if view not in self.views:
+                self.views[view] = ViewMetrics()
+            self.views[view].add(seconds, status, request_metrics)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {
+                    "requests": m.requests,
+                    "errors": m.errors,
+                    "latency_ms": {
+                        "mean": round(m.seconds / m.requests * 1000, 3),
+                        "p50": _ms(m.quantile(0.5)),
+                        "p95": _ms(m.quantile(0.95)),
+                        "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], m.buckets)),
+                    },
+                    "queries": m.queries,
+                    "queries_per_request": round(m.queries / m.requests, 2),
+                    "sql_ms": round(m.sql_seconds * 1000, 3),
+                    "template_ms": round(m.template_seconds * 1000, 3),
+                }
+                for view, m in sorted(self.views.items())
+            }
+
+    def prometheus_text(self):
+        with self._lock:
+            views = sorted(self.views.items())
+            lines = [
+                "# HELP app_request_duration_seconds Request latency by URL name.",
+                "# TYPE app_request_duration_seconds histogram",
+            ]
+            for view, m in views:
+                cumulative = 0
+                for bound, count in zip([*map(str, BUCKETS), "+Inf"], m.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'app_request_duration_seconds_bucket{{view="{view}",'
+                        f'le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'app_request_duration_seconds_sum{{view="{view}"}} {m.seconds}'
+                )
+                lines.append(
+                    f'app_request_duration_seconds_count{{view="{view}"}} {m.requests}'
+                )
+            for name, kind, help_text, attr in COUNTERS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for view, m in views:
+                    lines.append(f'{name}{{view="{view}"}} {getattr(m, attr)}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def record_query(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.sql_seconds += time.perf_counter() - start
+
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    install_query_wrapper(connection)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # 排在最前面，同步的話 ASGI 下整條鏈都會被轉到 thread 上
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        # 此 thread 在模組載入前就開好的連線也要掛上
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - start
+            _current.reset(token)
+        self.record(request, response, seconds, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        # ORM 在 sync_to_async 的 thread 中執行，那裡的連線由 connection_created 掛上
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - start
+            _current.reset(token)
+        self.record(request, response, seconds, request_metrics)
+        return response
+
+    def record(self, request, response, seconds, request_metrics):
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNRESOLVED
+        registry.record(view, seconds, response.status_code, request_metrics)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        request_metrics = _current.get()
+        # 巢狀渲染（例如卡片 tag）已算在外層的時間裡
+        if request_metrics is None or request_metrics.rendering:
+            return super().render(context, request)
+        request_metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            request_metrics.rendering = False
+            request_metrics.template_seconds += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock backend with render time counted into the request metrics."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
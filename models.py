@@ -1,13 +1,28 @@
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
+import copy
 import datetime
+from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.core.exceptions import ObjectDoesNotExist
+from .signals import carpool_changed, driver_rating_changed
 
 
 class User(AbstractUser):
@@ -30,29 +45,38 @@ class User(AbstractUser):
     def is_driver(self):
         return self.type == self.Types.DRIVER
 
+    def as_role(self, role_model):
+        """This user as the ``role_model`` proxy, without another query.
+
+        The copy keeps the already loaded relations (profile, car).
+        """
+        if type(self) is role_model:
+            return self
+        role = copy.copy(self)
+        role.__class__ = role_model
+        return role
+
     def to_student(self):
-        try:
-            return Student.objects.get(pk=self.pk)
-        except ObjectDoesNotExist:
+        if not self.is_student():
             return None
+        return self.as_role(Student)
 
     def to_driver(self):
-        try:
-            return Driver.objects.get(pk=self.pk)
-        except ObjectDoesNotExist:
+        if not self.is_driver():
             return None
+        return self.as_role(Driver)
 
-    @property
+    @cached_property
     def current_carpool(self):
+        # request.user 每個 request 重新載入，所以一個 request 只查一次
         if self.is_student():
             return (
-                self.to_student()
-                .student_carpools.filter(status="w")
+                Carpool.objects.filter(passengers=self.pk, status="w")
                 .order_by("date")
                 .first()
             )
         elif self.is_driver():
-            return self.to_driver().driver_carpools.filter(status="w").last()
+            return Carpool.objects.filter(driver=self.pk, status="w").last()
 
     def get_absolute_url(self):
         return reverse("users:detail", kwargs={"username": self.username})
@@ -67,6 +91,32 @@ class DriverManager(UserManager):
     def get_queryset(self, *args, **kwargs):
         return super().get_queryset(*args, **kwargs).filter(type=User.Types.DRIVER)
 
+    def with_stats(self):
+        """``with_rating`` plus the stored review and trip counts, car loaded."""
+        return (
+            self.with_rating()
+            .select_related("car")
+            .annotate(
+                review_count=F("profile__rating_count"),
+                trip_count=F("profile__trip_count"),
+            )
+        )
+
+    def with_rating(self):
+        """Drivers annotated with their average rating (0 when unrated)."""
+        return (
+            self.get_queryset()
+            .select_related("profile")
+            .annotate(
+                rating=Case(
+                    When(profile__rating_count=0, then=Value(0.0)),
+                    default=Cast("profile__rating_sum", models.FloatField())
+                    / F("profile__rating_count"),
+                    output_field=models.FloatField(),
+                )
+            )
+        )
+
 
 class Student(User):
     objects = StudentManager()
@@ -87,16 +137,20 @@ class Driver(User):
 
     @property
     def score(self):
-        # from Comment model "related_name"
-        score = self.driver_comments.aggregate(models.Avg("score")).get("score__avg")
-        if score:
-            return round(score)
+        # 評分總和與筆數存在 profile，select_related("profile") 後不需再查詢
+        # 四捨五入（.5 進位），與 DriverFilterForm 的星等篩選同一規則
+        profile = self.profile
+        if profile.rating_count:
+            return (2 * profile.rating_sum + profile.rating_count) // (
+                2 * profile.rating_count
+            )
         else:
             return None
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+
     # 性別，預設為男性
     class SexTypes(models.TextChoices):
         MALE = "MALE", "生理男"
@@ -133,9 +187,48 @@ class Profile(models.Model):
     cert_expirydate = models.DateField(
         null=True, blank=True, verbose_name="certificate expiration date"
     )
+    # 評論分數總和與筆數，由 Comment 存檔/刪除時維護
+    rating_sum = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="rating sum"
+    )
+    rating_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="rating count"
+    )
+    # 各星等的評論筆數，評論頁的分布圖不必掃過全部評論
+    star1_count = models.PositiveIntegerField(default=0, editable=False)
+    star2_count = models.PositiveIntegerField(default=0, editable=False)
+    star3_count = models.PositiveIntegerField(default=0, editable=False)
+    star4_count = models.PositiveIntegerField(default=0, editable=False)
+    star5_count = models.PositiveIntegerField(default=0, editable=False)
+    # 完成的趟數（含已封存），由 Carpool 存檔/刪除時維護
+    trip_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="trip count"
+    )
+
+    class Meta:
+        indexes = [
+            # 司機列表依評論數、趟數排序
+            models.Index(fields=["rating_count"], name="profile_rating_count_idx"),
+            models.Index(fields=["trip_count"], name="profile_trip_count_idx"),
+        ]
+
+    def star_histogram(self):
+        """``(stars, count, percent)`` from 5 stars down to 1."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, star_field(stars))
+            percent = round(count * 100 / self.rating_count) if self.rating_count else 0
+            histogram.append((stars, count, percent))
+        return histogram
+
+
+def star_field(stars):
+    return f"star{stars}_count"
 
 
 @receiver(post_save, sender=User)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Driver)
 def update_user_profile(sender, instance, created, **kwargs):
     if created and not hasattr(instance, "profile"):
         Profile.objects.create(user=instance)
@@ -183,6 +276,9 @@ class Place(models.Model):
         max_length=50,
         verbose_name="place name",
     )
+    # WGS84 座標，沒有座標的地點不會出現在附近搜尋
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         """String for representing the Place object."""
@@ -206,10 +302,60 @@ class Comment(models.Model):
         Driver, on_delete=models.SET_NULL, null=True, related_name="driver_comments"
     )
 
+    class Meta:
+        indexes = [
+            # 司機評論頁依時間排序
+            models.Index(fields=["criticed", "time"], name="comment_criticed_time_idx"),
+        ]
+
     def __str__(self):
         """String for representing the Comment object."""
         return self.content
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.pk is not None:
+                old = (
+                    Comment.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("criticed_id", "score")
+                    .first()
+                )
+            else:
+                old = None
+            super().save(*args, **kwargs)
+
+            if old is None:
+                self.update_driver_rating(self.criticed_id, self.score, 1)
+            elif old != (self.criticed_id, self.score):
+                self.update_driver_rating(old[0], old[1], -1)
+                self.update_driver_rating(self.criticed_id, self.score, 1)
+
+    def update_driver_rating(self, driver_id, score, count):
+        """Add (or with ``count=-1`` remove) one ``score`` to the driver's rating."""
+        if driver_id is None:
+            return
+        field = star_field(score)
+        Profile.objects.filter(user_id=driver_id).update(
+            rating_sum=F("rating_sum") + score * count,
+            rating_count=F("rating_count") + count,
+            **{field: F(field) + count},
+        )
+        driver_rating_changed.send(sender=Comment, driver_id=driver_id)
+        # 同步已載入的 profile，避免讀到舊的分數
+        driver = Comment.criticed.field.get_cached_value(self, default=None)
+        if driver is not None and driver.pk == driver_id:
+            profile = User.profile.related.get_cached_value(driver, default=None)
+            if profile is not None:
+                profile.rating_sum += score * count
+                profile.rating_count += count
+                setattr(profile, field, getattr(profile, field) + count)
+
+
+@receiver(post_delete, sender=Comment)
+def remove_driver_rating(sender, instance, **kwargs):
+    instance.update_driver_rating(instance.criticed_id, instance.score, -1)
+
 
 class Carfare(models.Model):
     """Model representing a carfare"""
@@ -237,45 +383,105 @@ class Carfare(models.Model):
 
     class Meta:
         ordering = ["departure", "arrival"]
+        indexes = [
+            # PriceView / 車資查詢以 (出發地, 目的地) 取車資
+            models.Index(fields=["departure", "arrival"], name="carfare_route_idx"),
+        ]
 
     def __str__(self):
         """String for representing the Place object."""
         return f"{self.departure} -> {self.arrival}: {self.fare}"
 
 
-class Carpool(models.Model):
-    """Model representing a carpool."""
+class RecurringCarpool(models.Model):
+    """A carpool repeated every week on some weekdays, e.g. weekdays at 07:50.
 
-    date = models.DateField(default="2022-12-21")
-    time = models.TimeField(default="21:24")
+    Its days are not stored: a ``Carpool`` row for a day is created only
+    when someone joins or a driver takes it (see ``recurrence.py``).
+    """
 
-    carfare = models.ForeignKey(Carfare, on_delete=models.SET_NULL, null=True)
-    lower_passengers = models.IntegerField()
+    WEEKDAY_CHOICES = (
+        (0, "一"),
+        (1, "二"),
+        (2, "三"),
+        (3, "四"),
+        (4, "五"),
+        (5, "六"),
+        (6, "日"),
+    )
 
-    # relations many to one
-    driver = models.ForeignKey(
-        Driver,
+    time = models.TimeField()
+    carfare = models.ForeignKey(
+        Carfare, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    lower_passengers = models.IntegerField(default=1)
+    # 星期一為 bit 0，週一到週五為 0b0011111
+    weekdays = models.PositiveSmallIntegerField(default=0b0011111)
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)
+    creator = models.ForeignKey(
+        Student,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
-        related_name="driver_carpools",
+        related_name="recurring_carpools",
     )
+    active = models.BooleanField(default=True)
 
-    # relations many to many
-    passengers = models.ManyToManyField(
-        Student, related_name="student_carpools", blank=True
-    )
+    class Meta:
+        ordering = ["time", "id"]
+
+    def occurs_on(self, day):
+        return (
+            self.active
+            and self.carfare_id is not None
+            and self.start_date <= day
+            and (self.end_date is None or day <= self.end_date)
+            and bool(self.weekdays >> day.weekday() & 1)
+        )
+
+    def weekday_names(self):
+        return "".join(
+            name for bit, name in self.WEEKDAY_CHOICES if self.weekdays >> bit & 1
+        )
 
-    STATUS_CHOICES = (
-        ("w", "Waiting"),
-        ("d", "Driving"),
-        ("a", "Arrived"),
-    )
+    def __str__(self):
+        return f"every {self.weekday_names()} {self.time}, carfare {self.carfare_id}"
+
+
+class CarpoolQuerySet(models.QuerySet):
+    def for_board(self, user=None):
+        """Carpools with everything a board card needs, in a single query."""
+        queryset = self.select_related(
+            "carfare__departure",
+            "carfare__arrival",
+            "driver__car",
+            "driver__profile",
+        )
+
+        # 使用者是否已加入，避免每張卡片各查一次
+        if user is None or not user.is_authenticated:
+            return queryset.annotate(user_in=Value(False))
+        if user.is_student():
+            return queryset.annotate(
+                user_in=Exists(
+                    Carpool.passengers.through.objects.filter(
+                        carpool=OuterRef("pk"), student=user.pk
+                    )
+                )
+            )
+        return queryset.annotate(
+            user_in=ExpressionWrapper(
+                Q(driver=user.pk), output_field=models.BooleanField()
+            )
+        )
 
-    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="w")
 
-    class Meta:
-        ordering = ["date", "time"]
+class CarpoolDisplayMixin:
+    """Display helpers shared by live and archived carpools."""
+
+    # 尚未建立資料列的固定班次（recurrence.Occurrence）為 True
+    is_virtual = False
 
     @property
     def departure(self):
@@ -287,13 +493,26 @@ class Carpool(models.Model):
 
     @property
     def fare(self):
-        return self.carfare.fare
+        from .fare_matrix import get_fare_matrix
+
+        fare = get_fare_matrix().route_fare(self.carfare_id)
+        return self.carfare.fare if fare is None else fare
+
+    @property
+    def passenger_count(self):
+        return self.seats_taken
+
+    @property
+    def driver_score(self):
+        if not self.driver:
+            return None
+        return self.driver.score
 
     @property
     def has_vacancy(self):
         if not self.driver:
             return True
-        return self.driver.car.capacity > self.passengers.count()
+        return self.driver.car.capacity > self.passenger_count
 
     @property
     def has_driver(self):
@@ -309,10 +528,96 @@ class Carpool(models.Model):
 
     @property
     def avg_fare(self):
-        total_passengers = self.passengers.count()
+        total_passengers = self.passenger_count
         if total_passengers == 0:
             return None
-        return round(self.carfare.fare / self.passengers.count())
+        return round(self.fare / total_passengers)
+
+
+class Carpool(CarpoolDisplayMixin, models.Model):
+    """Model representing a carpool."""
+
+    date = models.DateField(default="2022-12-21")
+    time = models.TimeField(default="21:24")
+
+    carfare = models.ForeignKey(Carfare, on_delete=models.SET_NULL, null=True)
+    lower_passengers = models.IntegerField()
+
+    # relations many to one
+    driver = models.ForeignKey(
+        Driver,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="driver_carpools",
+    )
+
+    # relations many to many
+    passengers = models.ManyToManyField(
+        Student, related_name="student_carpools", blank=True
+    )
+    # 乘客人數，由 seats.py 以條件式 UPDATE 維護
+    seats_taken = models.PositiveSmallIntegerField(default=0, editable=False)
+    # 由固定班次展開的那一天；同一班次同一天只會有一筆
+    recurrence = models.ForeignKey(
+        RecurringCarpool,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="occurrences",
+    )
+
+    STATUS_CHOICES = (
+        ("w", "Waiting"),
+        ("d", "Driving"),
+        ("a", "Arrived"),
+    )
+
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default="w")
+
+    objects = CarpoolQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["date", "time"]
+        indexes = [
+            # 篩選：date = ? AND status = ? AND time >= ?
+            models.Index(
+                fields=["date", "status", "time"], name="carpool_date_status_idx"
+            ),
+            # 篩選：carfare = ? AND date = ?
+            models.Index(
+                fields=["carfare", "date", "time"], name="carpool_carfare_date_idx"
+            ),
+            # 首頁：date >= today AND status = 'w' ORDER BY date, time
+            models.Index(
+                fields=["date", "time", "id"],
+                condition=Q(status="w"),
+                name="carpool_open_date_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recurrence", "date"], name="carpool_recurrence_date_uniq"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old = None
+            if self.pk is not None and not self._state.adding:
+                old = (
+                    Carpool.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("status", "driver_id")
+                    .first()
+                )
+            super().save(*args, **kwargs)
+
+            if old != (self.status, self.driver_id):
+                if old is not None and old[0] == "a":
+                    update_trip_count(old[1], -1)
+                if self.status == "a":
+                    update_trip_count(self.driver_id, 1)
 
     def is_student_in(self, student):
         if student is None:
@@ -339,3 +644,115 @@ class Carpool(models.Model):
     def get_absolute_url(self):
         """Returns the url to access a detail record for this carpool."""
         return reverse("app:carpool-detail", args=[str(self.id)])
+
+
+@receiver(post_save, sender=Carpool)
+def send_carpool_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        kind = "created"
+    elif update_fields and set(update_fields) == {"status"}:
+        kind = "status"
+    else:
+        kind = "updated"
+    carpool_changed.send(sender=Carpool, carpool_id=instance.pk, kind=kind)
+
+
+@receiver(post_delete, sender=Carpool)
+def send_carpool_deleted(sender, instance, **kwargs):
+    carpool_changed.send(sender=Carpool, carpool_id=instance.pk, kind="deleted")
+
+
+@receiver(post_delete, sender=Carpool)
+def remove_trip_count(sender, instance, **kwargs):
+    if instance.status == "a":
+        update_trip_count(instance.driver_id, -1)
+
+
+def update_trip_count(driver_id, count):
+    """Add ``count`` finished trips to the driver's stored total."""
+    if driver_id is None:
+        return
+    Profile.objects.filter(user_id=driver_id).update(trip_count=F("trip_count") + count)
+
+
+@receiver(m2m_changed, sender=Carpool.passengers.through)
+def recount_seats_taken(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep seats_taken in sync when passengers change outside seats.py."""
+    if action == "pre_clear" and reverse:
+        instance._cleared_carpool_ids = set(
+            instance.student_carpools.values_list("pk", flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        carpool_ids = {instance.pk}
+    elif action == "post_clear":
+        carpool_ids = instance.__dict__.pop("_cleared_carpool_ids", set())
+    else:
+        carpool_ids = pk_set or set()
+
+    Carpool.objects.filter(pk__in=carpool_ids).update(
+        seats_taken=Coalesce(
+            Subquery(
+                sender.objects.filter(carpool=OuterRef("pk"))
+                .values("carpool")
+                .annotate(count=models.Count("id"))
+                .values("count"),
+            ),
+            0,
+        )
+    )
+    for carpool_id in carpool_ids:
+        carpool_changed.send(sender=Carpool, carpool_id=carpool_id, kind="updated")
+
+
+class ArchivedCarpoolQuerySet(models.QuerySet):
+    def for_history(self, user):
+        """Archived carpools of ``user`` with what the history rows show."""
+        queryset = self.select_related(
+            "carfare__departure", "carfare__arrival", "driver__profile"
+        )
+        if user.is_student():
+            return queryset.filter(passengers=user.pk)
+        return queryset.filter(driver=user.pk)
+
+
+class ArchivedCarpool(CarpoolDisplayMixin, models.Model):
+    """An arrived carpool moved out of the live table by ``archive_carpools``."""
+
+    # 沿用原本 Carpool 的 id，歷史紀錄的分頁游標才能跨兩張表
+    id = models.BigIntegerField(primary_key=True)
+    date = models.DateField()
+    time = models.TimeField()
+    carfare = models.ForeignKey(
+        Carfare, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    lower_passengers = models.IntegerField()
+    driver = models.ForeignKey(
+        Driver,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="archived_carpools",
+    )
+    passengers = models.ManyToManyField(
+        Student, related_name="archived_student_carpools", blank=True
+    )
+    seats_taken = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=1, choices=Carpool.STATUS_CHOICES, default="a")
+    archived_at = models.DateTimeField(default=now)
+
+    objects = ArchivedCarpoolQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["date", "time"]
+        indexes = [
+            models.Index(
+                fields=["driver", "date", "time"], name="archive_driver_date_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"archived {self.time}, {self.departure} to {self.arrival}"
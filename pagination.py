@@ -0,0 +1,261 @@
+import base64
+import datetime
+import json
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from django.http import Http404, QueryDict
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keep microseconds, which DjangoJSONEncoder rounds to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor, fields=None):
+    """Cursor values, converted with ``fields`` (one per ordering key) if given.
+
+    A cursor that is not ours, or whose values do not fit the fields, is a
+    404 rather than an error in the query.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise Http404("Invalid cursor")
+    if not isinstance(values, list):
+        raise Http404("Invalid cursor")
+    if fields is None:
+        return values
+    if len(fields) != len(values):
+        raise Http404("Invalid cursor")
+    try:
+        values = [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError, ValueError):
+        raise Http404("Invalid cursor")
+    # 排序欄位都不是 NULL
+    if None in values:
+        raise Http404("Invalid cursor")
+    return values
+
+
+def ordering_fields(queryset, ordering):
+    """Model field or annotation output field of each ordering key."""
+    fields = []
+    for key in ordering:
+        name = key.lstrip("-")
+        if name in queryset.query.annotations:
+            fields.append(queryset.query.annotations[name].output_field)
+        elif name == "pk":
+            fields.append(queryset.model._meta.pk)
+        else:
+            fields.append(queryset.model._meta.get_field(name))
+    return fields
+
+
+def cursor_values(queryset, ordering, cursor):
+    """Decoded ``cursor`` for ``queryset`` or a list of parts; None on page one.
+
+    Values are typed by the first queryset part; in-memory parts of the
+    same rows share its fields.
+    """
+    if not cursor:
+        return None
+    parts = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    for part in parts:
+        if isinstance(part, QuerySet):
+            return decode_cursor(cursor, ordering_fields(part, ordering))
+    values = decode_cursor(cursor)
+    if len(ordering) != len(values):
+        raise Http404("Invalid cursor")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """Q matching rows that come after ``values`` in ``ordering``.
+
+    (a, b, c) > (x, y, z) is expanded to
+    a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+    so every page is an index range scan instead of an OFFSET.
+    """
+    if len(ordering) != len(values):
+        raise Http404("Invalid cursor")
+
+    condition = Q()
+    equal = Q()
+    for key, value in zip(ordering, values):
+        field = key.lstrip("-")
+        lookup = "lt" if key.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{field}__{lookup}": value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+class KeysetPage:
+    """One page of a keyset paginated queryset."""
+
+    def __init__(self, object_list, next_cursor, request=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.request = request
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def next_query(self):
+        """Current query string with the cursor moved to the next page."""
+        params = self.request.GET.copy() if self.request else QueryDict(mutable=True)
+        params["cursor"] = self.next_cursor
+        return params.urlencode()
+
+
+def keyset_queryset(queryset, ordering, values):
+    queryset = queryset.order_by(*ordering)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    return queryset
+
+
+def after_cursor(row, ordering, values):
+    """Python counterpart of ``keyset_filter`` for an object already loaded."""
+    for key, value in zip(ordering, values):
+        mine = attrgetter(key.lstrip("-"))(row)
+        if mine != value:
+            try:
+                return mine < value if key.startswith("-") else mine > value
+            except TypeError:
+                # 沒有 queryset 可決定型別時，游標值可能與欄位型別不符
+                raise Http404("Invalid cursor")
+    return False
+
+
+def keyset_objects(objects, ordering, values, limit):
+    if values is not None:
+        objects = [row for row in objects if after_cursor(row, ordering, values)]
+    return sort_rows(list(objects), ordering)[:limit]
+
+
+def keyset_rows(queryset, ordering, values, limit):
+    if not isinstance(queryset, QuerySet):
+        return keyset_objects(queryset, ordering, values, limit)
+    return list(keyset_queryset(queryset, ordering, values)[:limit])
+
+
+async def akeyset_rows(queryset, ordering, values, limit):
+    if not isinstance(queryset, QuerySet):
+        return keyset_objects(queryset, ordering, values, limit)
+    return [row async for row in keyset_queryset(queryset, ordering, values)[:limit]]
+
+
+def sort_rows(rows, ordering):
+    # 由最後一個欄位往前做穩定排序，每個欄位可各自遞增或遞減
+    for key in reversed(ordering):
+        rows.sort(key=attrgetter(key.lstrip("-")), reverse=key.startswith("-"))
+    return rows
+
+
+def keyset_page(queryset, ordering, cursor=None, per_page=20, request=None):
+    """Return the page of ``queryset`` after ``cursor``.
+
+    ``ordering`` must end with a unique key (normally "id") so that the
+    cursor identifies exactly one position.  ``queryset`` may also be a list
+    of querysets over disjoint rows with the same ordering fields (e.g. live
+    and archived carpools); each is read from the cursor on and the pages
+    are merged.  A part may also be a list of objects already in memory
+    (e.g. recurring carpool occurrences), filtered and sorted in Python.
+    """
+    values = cursor_values(queryset, ordering, cursor)
+    # 多抓一筆判斷是否還有下一頁
+    if isinstance(queryset, (list, tuple)):
+        rows = [
+            row
+            for part in queryset
+            for row in keyset_rows(part, ordering, values, per_page + 1)
+        ]
+        rows = sort_rows(rows, ordering)
+    else:
+        rows = keyset_rows(queryset, ordering, values, per_page + 1)
+    return make_page(rows, ordering, per_page, request)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, per_page=20, request=None):
+    """``keyset_page`` on the async ORM API."""
+    values = cursor_values(queryset, ordering, cursor)
+    if isinstance(queryset, (list, tuple)):
+        rows = []
+        for part in queryset:
+            rows += await akeyset_rows(part, ordering, values, per_page + 1)
+        rows = sort_rows(rows, ordering)
+    else:
+        rows = await akeyset_rows(queryset, ordering, values, per_page + 1)
+    return make_page(rows, ordering, per_page, request)
+
+
+def make_page(rows, ordering, per_page, request):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [attrgetter(key.lstrip("-"))(last) for key in ordering]
+        )
+    return KeysetPage(rows, next_cursor, request)
+
+
+class KeysetPaginationMixin:
+    """ListView mixin that pages with a cursor instead of a page number.
+
+    HTMX "load more" requests only get ``fragment_template_name`` back.
+    Async views ``await self.aload_page(queryset)`` first, and the context
+    is then built from the loaded page without touching the database.
+    """
+
+    paginate_by = 20
+    keyset_ordering = ["id"]
+    fragment_template_name = None
+    page = None
+
+    async def aload_page(self, queryset):
+        self.page = await akeyset_page(
+            queryset,
+            self.keyset_ordering,
+            self.request.GET.get("cursor"),
+            self.get_paginate_by(queryset),
+            self.request,
+        )
+        return self.page
+
+    def paginate_queryset(self, queryset, page_size):
+        page = self.page
+        if page is None:
+            page = keyset_page(
+                queryset,
+                self.keyset_ordering,
+                self.request.GET.get("cursor"),
+                page_size,
+                self.request,
+            )
+        return (None, page, page.object_list, page.has_next)
+
+    def get_template_names(self):
+        if self.fragment_template_name and self.request.headers.get("HX-Request"):
+            return [self.fragment_template_name]
+        return super().get_template_names()
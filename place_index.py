@@ -0,0 +1,174 @@
+"""In-process spatial index of place coordinates for "near me" searches.
+
+Places are bucketed into a fixed latitude/longitude grid.  A radius query
+only visits the cells overlapping the circle's bounding box and keeps the
+points whose great-circle distance is within the radius, so it touches a
+few hundred points instead of every place.  Like the fare matrix, the
+index is loaded with one query, kept in module memory, and rebuilt after
+Place signals bump its version (see ``versions``).
+"""
+import bisect
+import math
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Place
+from .versions import bump, get_version
+
+VERSION_KEY = "place-index-version"
+EARTH_RADIUS_KM = 6371.0088
+# 格子邊長（度），約 5.5 公里
+CELL_DEGREES = 0.05
+LONGITUDE_CELLS = round(360 / CELL_DEGREES)
+
+
+def cell_of(latitude, longitude):
+    return (
+        math.floor(latitude / CELL_DEGREES),
+        math.floor(longitude / CELL_DEGREES) % LONGITUDE_CELLS,
+    )
+
+
+class PlaceIndex:
+    def __init__(self, points):
+        # cell -> [(緯度弧度, 經度弧度, cos 緯度, place_id)]
+        self.cells = {}
+        self.size = 0
+        for place_id, latitude, longitude in points:
+            phi = math.radians(latitude)
+            self.cells.setdefault(cell_of(latitude, longitude), []).append(
+                (phi, math.radians(longitude), math.cos(phi), place_id)
+            )
+            self.size += 1
+
+    @classmethod
+    def load(cls):
+        return cls(
+            Place.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .order_by()
+            .values_list("id", "latitude", "longitude")
+        )
+
+    def candidate_cells(self, latitude, longitude, radius_km):
+        angle = radius_km / EARTH_RADIUS_KM
+        if angle >= math.pi:
+            return list(self.cells)
+        lat_span = math.degrees(angle)
+        south = max(latitude - lat_span, -90)
+        north = min(latitude + lat_span, 90)
+        # 圓在球面上的經度範圍；碰到極點就是整圈
+        ratio = math.sin(angle) / math.cos(math.radians(latitude))
+        if south <= -90 or north >= 90 or ratio >= 1:
+            lon_cells = None
+        else:
+            lon_span = math.degrees(math.asin(ratio))
+            first = math.floor((longitude - lon_span) / CELL_DEGREES)
+            last = math.floor((longitude + lon_span) / CELL_DEGREES)
+            lon_cells = {i % LONGITUDE_CELLS for i in range(first, last + 1)}
+        rows = range(
+            math.floor(south / CELL_DEGREES), math.floor(north / CELL_DEGREES) + 1
+        )
+
+        count = len(rows) * (LONGITUDE_CELLS if lon_cells is None else len(lon_cells))
+        if count > len(self.cells):
+            # 範圍比有資料的格子還多時，直接掃有資料的格子
+            return [
+                cell
+                for cell in self.cells
+                if cell[0] in rows and (lon_cells is None or cell[1] in lon_cells)
+            ]
+        return [
+            (row, column)
+            for row in rows
+            for column in (range(LONGITUDE_CELLS) if lon_cells is None else lon_cells)
+            if (row, column) in self.cells
+        ]
+
+    def near(self, latitude, longitude, radius_km, limit=None):
+        """``[(distance_km, place_id)]`` within ``radius_km``, nearest first."""
+        phi = math.radians(latitude)
+        lam = math.radians(longitude)
+        cos_phi = math.cos(phi)
+        # 比較 haversine 的 a 值，省下每點的 asin/sqrt
+        threshold = math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi) / 2) ** 2
+        found = []
+        for cell in self.candidate_cells(latitude, longitude, radius_km):
+            for point_phi, point_lam, point_cos, place_id in self.cells[cell]:
+                a = (
+                    math.sin((point_phi - phi) / 2) ** 2
+                    + cos_phi * point_cos * math.sin((point_lam - lam) / 2) ** 2
+                )
+                if a <= threshold:
+                    found.append((a, place_id))
+        found.sort()
+        if limit is not None:
+            del found[limit:]
+        return [
+            (2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1))), place_id)
+            for a, place_id in found
+        ]
+
+
+def brute_force_near(points, latitude, longitude, radius_km):
+    """Reference linear scan over ``(place_id, latitude, longitude)``."""
+    phi, lam = math.radians(latitude), math.radians(longitude)
+    found = []
+    for place_id, point_latitude, point_longitude in points:
+        point_phi = math.radians(point_latitude)
+        a = (
+            math.sin((point_phi - phi) / 2) ** 2
+            + math.cos(phi)
+            * math.cos(point_phi)
+            * math.sin((math.radians(point_longitude) - lam) / 2) ** 2
+        )
+        distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1)))
+        if distance <= radius_km:
+            bisect.insort(found, (distance, place_id))
+    return found
+
+
+_lock = threading.Lock()
+_index = None
+_version = None
+
+
+def get_place_index():
+    global _index, _version
+    version = get_version(VERSION_KEY)
+    index = _index
+    if index is not None and version == _version:
+        return index
+    with _lock:
+        if _index is None or version != _version:
+            _index = PlaceIndex.load()
+            _version = version
+        return _index
+
+
+def near_place_ids(latitude, longitude, radius_km):
+    """Ids of every place within ``radius_km``, nearest first.
+
+    The cost is bounded by the grid cells the circle overlaps, not by
+    capping the answer.
+    """
+    return [
+        place_id
+        for _, place_id in get_place_index().near(latitude, longitude, radius_km)
+    ]
+
+
+def invalidate():
+    global _index
+    _index = None
+    bump(VERSION_KEY)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def invalidate_place_index(sender, **kwargs):
+    invalidate()
+    # 同 fare_matrix：commit 後再清一次，避免別的請求重建到舊資料
+    transaction.on_commit(invalidate)
@@ -0,0 +1,59 @@
+"""EXPLAIN QUERY PLAN checks for the hot board and review queries."""
+import re
+from datetime import date, time
+
+from .models import Carfare, Carpool, Comment
+
+# SQLite 的 SCAN 不論是否 USING (COVERING) INDEX 都是走完整張表或整個索引，
+# 有用到索引範圍的是 SEARCH；PostgreSQL: "Seq Scan on app_carpool"
+FULL_SCAN_PATTERNS = [
+    re.compile(r"\bSCAN (?:TABLE )?(?!CONSTANT ROW)(?P<table>\w+)"),
+    re.compile(r"\bSeq Scan on (?P<table>\w+)"),
+]
+
+
+def hot_queries(day=None):
+    """The hot queries keyed by name, with representative parameters."""
+    day = day or date.today()
+    carfare = Carfare.objects.order_by().first()
+    driver_id = (
+        Comment.objects.exclude(criticed=None)
+        .values_list("criticed_id", flat=True)
+        .first()
+    )
+    board = Carpool.objects.for_board()
+    ordering = ["date", "time", "id"]
+    return {
+        "board_filter": board.filter(
+            date=day, status="w", seats_taken__gte=0, time__gte=time(8)
+        ).order_by(*ordering)[:21],
+        "board_route": board.filter(date=day, status="w", carfare=carfare).order_by(
+            *ordering
+        )[:21],
+        "board_default": board.filter(
+            date__gte=day, status="w", seats_taken__gt=0
+        ).order_by(*ordering)[:21],
+        "driver_reviews": Comment.objects.filter(criticed=driver_id)
+        .select_related("critic")
+        .order_by("-time", "-id")[:21],
+        "carfare_route": Carfare.objects.filter(
+            departure_id=carfare.departure_id if carfare else None,
+            arrival_id=carfare.arrival_id if carfare else None,
+        ),
+    }
+
+
+def scanned_tables(plan):
+    """Tables an ``EXPLAIN`` text walks from end to end."""
+    tables = []
+    for line in plan.splitlines():
+        for pattern in FULL_SCAN_PATTERNS:
+            match = pattern.search(line.strip())
+            if match:
+                tables.append(match.group("table"))
+    return tables
+
+
+def full_scans(queryset):
+    """Tables the query plan reads without an index range."""
+    return scanned_tables(queryset.explain())
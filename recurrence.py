@@ -0,0 +1,160 @@
+"""Lazy expansion of recurring carpools.
+
+A ``RecurringCarpool`` stores only its weekly pattern.  The active patterns
+are kept in memory, and the board builds an ``Occurrence`` for each day
+that matches one and has no ``Carpool`` row yet.  The row is created by
+``join_occurrence`` when the first student joins or a driver takes that
+day, and from then on the day is an ordinary carpool.  ``Carpool.recurrence``
+is unique per date, so two first joins racing for the same day end up in
+the same row.
+
+Occurrences use negative ids, so with ``CARPOOL_KEYSET_ORDERING`` they come
+before the concrete carpools leaving at the same time and keyset cursors
+stay unambiguous.
+"""
+import threading
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .fare_matrix import get_fare_matrix
+from .models import Carpool, CarpoolDisplayMixin, RecurringCarpool
+from .seats import SeatResult, assign_driver, reserve_seat
+from .versions import bump, get_version
+
+VERSION_KEY = "recurring-carpool-version"
+# 與 CarpoolForm 相同，只展開到 30 天後
+HORIZON = timedelta(days=30)
+
+
+class Occurrence(CarpoolDisplayMixin):
+    """A day of a recurring carpool without a ``Carpool`` row."""
+
+    is_virtual = True
+    driver = None
+    driver_id = None
+    seats_taken = 0
+    status = "w"
+    user_in = False
+
+    def __init__(self, recurrence, day):
+        self.recurrence = recurrence
+        self.recurrence_id = recurrence.pk
+        self.id = self.pk = -recurrence.pk
+        self.date = day
+        self.time = recurrence.time
+        self.carfare_id = recurrence.carfare_id
+        self.carfare = get_fare_matrix().carfare(recurrence.carfare_id)
+        self.lower_passengers = recurrence.lower_passengers
+
+    def get_absolute_url(self):
+        return reverse(
+            "app:recurring_occurrence",
+            args=[self.recurrence_id, self.date.isoformat()],
+        )
+
+    def __str__(self):
+        return f"s: {self.status} {self.time}, {self.departure} to {self.arrival}"
+
+
+def in_horizon(day, today=None):
+    today = today or date.today()
+    return today <= day <= today + HORIZON
+
+
+def occurrences_on(day, carfare_ids=None, start=None, end=None):
+    """Occurrences on ``day`` that have no ``Carpool`` row yet.
+
+    Patterns are matched in memory; only when one matches is the database
+    asked which of them already have a row on ``day``.
+    """
+    if not in_horizon(day):
+        return []
+    routes = get_fare_matrix().routes
+    if carfare_ids is not None:
+        carfare_ids = set(carfare_ids)
+    candidates = [
+        recurring
+        for recurring in get_recurring_carpools()
+        if recurring.occurs_on(day)
+        and recurring.carfare_id in routes
+        and (carfare_ids is None or recurring.carfare_id in carfare_ids)
+        and (start is None or recurring.time >= start)
+        and (end is None or recurring.time <= end)
+    ]
+    if not candidates:
+        return []
+    materialized = set(
+        Carpool.objects.filter(
+            date=day, recurrence__in=[recurring.pk for recurring in candidates]
+        ).values_list("recurrence_id", flat=True)
+    )
+    return [
+        Occurrence(recurring, day)
+        for recurring in candidates
+        if recurring.pk not in materialized
+    ]
+
+
+def join_occurrence(recurrence, day, user):
+    """Join or take ``recurrence`` on ``day``; ``(carpool, SeatResult)``.
+
+    The day's ``Carpool`` is created if needed and rolled back again when
+    the join itself fails, so a failed first join leaves no empty row.
+    """
+    with transaction.atomic():
+        carpool, created = Carpool.objects.get_or_create(
+            recurrence=recurrence,
+            date=day,
+            defaults={
+                "time": recurrence.time,
+                "carfare_id": recurrence.carfare_id,
+                "lower_passengers": recurrence.lower_passengers,
+            },
+        )
+        if user.is_driver():
+            result = assign_driver(carpool, user.to_driver())
+        else:
+            result = reserve_seat(carpool, user.to_student())
+        if created and result != SeatResult.JOINED:
+            transaction.set_rollback(True)
+            return None, result
+    return carpool, result
+
+
+_lock = threading.Lock()
+_recurring = None
+_version = None
+
+
+def get_recurring_carpools():
+    """Active recurring carpools by time, kept in memory like the fare matrix."""
+    global _recurring, _version
+    version = get_version(VERSION_KEY)
+    recurring = _recurring
+    if recurring is not None and version == _version:
+        return recurring
+    with _lock:
+        if _recurring is None or version != _version:
+            _recurring = list(
+                RecurringCarpool.objects.filter(active=True, carfare__isnull=False)
+            )
+            _version = version
+        return _recurring
+
+
+def invalidate():
+    global _recurring
+    _recurring = None
+    bump(VERSION_KEY)
+
+
+@receiver(post_save, sender=RecurringCarpool)
+@receiver(post_delete, sender=RecurringCarpool)
+def invalidate_recurring_carpools(sender, **kwargs):
+    invalidate()
+    # 同 fare_matrix：commit 後再清一次
+    transaction.on_commit(invalidate)
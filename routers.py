@@ -0,0 +1,153 @@
+"""Read replica routing.
+
+Views marked with ``read_replica`` read from one of ``settings.READ_REPLICAS``;
+every other read and every write goes to ``default``.  A request that writes
+gets a short-lived cookie, and while the browser sends it back that user's
+reads stay on the primary, so a join, a new carpool or a comment shows up
+for its author before the replicas catch up.
+
+``sync_sqlite_replica`` renames a fresh copy over the replica file, and a
+persistent connection would keep reading the old file.  Before a read goes
+to a replica its connection is closed if the file was replaced, so every
+worker sees a sync on its next replica read, not when ``CONN_MAX_AGE`` ends.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import sqlite3
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = "primary_pin"
+
+_state = contextvars.ContextVar("replica_routing", default=None)
+
+
+class RoutingState:
+    """Per-request routing flags, shared with the threads the request uses."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = False
+        self.wrote = False
+
+
+def read_replica(view):
+    """Let a view function read from a replica; class-based views set the attribute."""
+    view.read_replica = True
+    return view
+
+
+def replica_aliases():
+    return [alias for alias in settings.READ_REPLICAS if alias in settings.DATABASES]
+
+
+def refresh_replica(connection):
+    """Close ``connection`` if its SQLite file was replaced by a sync."""
+    file_replaced = getattr(connection, "file_replaced", None)
+    # 交易中途不換檔，避免同一個交易讀到兩份資料
+    if file_replaced and not connection.in_atomic_block and file_replaced():
+        connection.close()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica or state.pinned or state.wrote:
+            return None
+        # session 隨時會被改寫，一律讀主資料庫
+        if model._meta.app_label == "sessions":
+            return None
+        aliases = replica_aliases()
+        if not aliases:
+            return None
+        alias = random.choice(aliases)
+        refresh_replica(connections[alias])
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本與主資料庫是同一份資料，跨別名的關聯沒有問題
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本由 sync_replicas 整份複製，不另外 migrate
+        return False if db in replica_aliases() else None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # 同 MiddlewareMixin：ASGI 下維持 async，async view 不必轉到 thread 上跑
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(state, response)
+
+    def pin(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None:
+            view = getattr(view_func, "view_class", view_func)
+            state.replica = getattr(view, "read_replica", False)
+
+
+def sync_sqlite_replica(path):
+    """Copy the primary SQLite database to ``path`` with the online backup API.
+
+    The copy is written next to the target and renamed over it, so readers
+    never open a half-written file.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    primary.ensure_connection()
+    path = Path(path)
+    partial = path.with_name(path.name + ".partial")
+    target = sqlite3.connect(partial)
+    try:
+        primary.connection.backup(target)
+        # 副本是整份換掉的，不能沿用舊檔留下的 -wal/-shm
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+    os.replace(partial, path)
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'se_bubuchacha.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 需在 Django 初始化之後才能載入 app
+from django.urls import reverse  # noqa: E402
+
+from app.events import board_events_app  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # 看板推播 (Server-Sent Events) 不經過 Django 的 request/response
+    if scope["type"] == "http" and scope["path"] == reverse("app:carpool_events"):
+        return await board_events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -7,6 +7,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,7 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放最前面，延遲才包含其他 middleware
+    "app.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "app.routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -60,9 +64,10 @@ ROOT_URLCONF = "se_bubuchacha.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # 內建 DjangoTemplates 加上每個請求的渲染計時
+        "BACKEND": "app.metrics.DjangoTemplates",
+        "NAME": "django",
         "DIRS": [],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
@@ -70,6 +75,16 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # 模板只編譯一次；runserver 偵測到模板變更時會自動清空快取
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
         },
     },
 ]
@@ -80,14 +95,98 @@ WSGI_APPLICATION = "se_bubuchacha.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# 每條連線建立時執行，見 app/sqlite/base.py
+SQLITE_PRAGMAS = {
+    # 讀取不會被寫入擋住，寫入也不必等讀取結束
+    "journal_mode": "WAL",
+    # WAL 下只在 checkpoint 時 fsync，斷電最多遺失最後幾筆交易，不會損毀
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "app.sqlite",
         "NAME": BASE_DIR / "db.sqlite3",
+        # 連線跨請求重用，使用前先確認還活著
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # busy timeout：等寫入鎖最多幾秒才回 "database is locked"
+            "timeout": 20,
+            # 交易一開始就取得寫入鎖，先讀後寫也能排隊等待
+            "transaction_mode": "IMMEDIATE",
+            "pragmas": SQLITE_PRAGMAS,
+        },
+        # 檔案型的測試資料庫才能讓多執行緒的測試各自連線
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+    },
+    # 本機的唯讀副本，`manage.py sync_replicas` 由主資料庫複製；檔案換掉後
+    # 各 worker 下一次讀副本時會重新連線（見 app/routers.py）
+    "replica": {
+        "ENGINE": "app.sqlite",
+        "NAME": BASE_DIR / "db_replica.sqlite3",
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "pragmas": {"mmap_size": SQLITE_PRAGMAS["mmap_size"], "query_only": "ON"},
+        },
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+DATABASE_ROUTERS = ["app.routers.ReplicaRouter"]
+
+# 看板、司機列表、車資表等唯讀頁面從這些別名讀取；空的就全部走 default
+READ_REPLICAS = []
+
+# 寫入後幾秒內該使用者的讀取固定走主資料庫
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+# "default" 存放車資矩陣、看板索引、卡片與 ETag 的版本號及看板推播，每個 worker 都靠它
+# 得知其他行程的寫入，必須是跨行程共用的 Redis 或 Memcached（見 app/versions.py）。
+# 兩者都沒設定時用行程內快取，只適合單一行程的開發環境，`check --deploy` 會報錯。
+# 不用檔案快取：每次寫入都要掃過整個快取目錄。Redis 需安裝 redis，Memcached 需安裝 pymemcache。
+if os.environ.get("REDIS_URL"):
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+elif os.environ.get("MEMCACHED_LOCATION"):
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+        "LOCATION": os.environ["MEMCACHED_LOCATION"].split(","),
+    }
+else:
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shared",
     }
+
+CACHES = {
+    "default": SHARED_CACHE,
+    # 渲染好的卡片；鍵已包含版本號，各行程各存一份即可
+    "cards": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cards",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
 }
 
 
+# Sessions
+# https://docs.djangoproject.com/en/4.1/topics/http/sessions/#configuring-the-session-engine
+
+# session 只存登入資訊，放在簽章 cookie 裡，請求不必讀寫 django_session。
+# 多台主機共用 Redis/Memcached 時也可改用 "django.contrib.sessions.backends.cache"，
+# 需要伺服器端登出所有裝置時改回 "django.contrib.sessions.backends.db"。
+SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -108,6 +207,8 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = "app.User"
 
+AUTHENTICATION_BACKENDS = ["app.backends.UserBackend"]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
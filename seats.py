@@ -0,0 +1,110 @@
+"""Seat reservation for carpools.
+
+Every change to ``Carpool.seats_taken`` is a single conditional UPDATE on
+the carpool row, so the capacity check and the write happen atomically on
+SQLite (one writer at a time) and on server databases (the row lock makes
+concurrent updates re-check the WHERE clause against the committed row).
+"""
+import enum
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Carpool
+from .signals import carpool_changed
+
+# 沒有司機時每團最多人數
+MAX_PASSENGERS = 9
+
+Passenger = Carpool.passengers.through
+
+
+class SeatResult(enum.Enum):
+    JOINED = "joined"
+    ALREADY_IN = "already_in"
+    FULL = "full"
+    CLOSED = "closed"
+    LEFT = "left"
+    DISBANDED = "disbanded"
+    NOT_IN = "not_in"
+    TAKEN = "taken"
+    NO_ROOM = "no_room"
+
+
+class _NoSeat(Exception):
+    pass
+
+
+def reserve_seat(carpool, student):
+    """Add ``student`` to ``carpool`` if a seat is still free."""
+    state = (
+        Carpool.objects.filter(pk=carpool.pk)
+        .values("status", "driver_id", "driver__car__capacity")
+        .first()
+    )
+    if state is None or state["status"] != "w":
+        return SeatResult.CLOSED
+
+    driver_id = state["driver_id"]
+    capacity = MAX_PASSENGERS
+    if driver_id is not None:
+        capacity = min(state["driver__car__capacity"] or 0, MAX_PASSENGERS)
+
+    try:
+        with transaction.atomic():
+            Passenger.objects.create(carpool_id=carpool.pk, student_id=student.pk)
+            # 司機沒換人且仍有空位才佔位
+            claimed = Carpool.objects.filter(
+                pk=carpool.pk,
+                status="w",
+                driver_id=driver_id,
+                seats_taken__lt=capacity,
+            ).update(seats_taken=F("seats_taken") + 1)
+            if not claimed:
+                raise _NoSeat
+    except IntegrityError:
+        return SeatResult.ALREADY_IN
+    except _NoSeat:
+        return SeatResult.FULL
+    carpool_changed.send(sender=Carpool, carpool_id=carpool.pk, kind="joined")
+    return SeatResult.JOINED
+
+
+def release_seat(carpool, student):
+    """Remove ``student``; the carpool is deleted when nobody is left."""
+    with transaction.atomic():
+        removed, _ = Passenger.objects.filter(
+            carpool_id=carpool.pk, student_id=student.pk
+        ).delete()
+        if not removed:
+            return SeatResult.NOT_IN
+
+        Carpool.objects.filter(pk=carpool.pk).update(
+            seats_taken=F("seats_taken") - removed
+        )
+        disbanded, _ = Carpool.objects.filter(pk=carpool.pk, seats_taken=0).delete()
+    if disbanded:
+        return SeatResult.DISBANDED
+    carpool_changed.send(sender=Carpool, carpool_id=carpool.pk, kind="left")
+    return SeatResult.LEFT
+
+
+def assign_driver(carpool, driver):
+    """Let ``driver`` take ``carpool`` if it has no driver and the car fits."""
+    claimed = Carpool.objects.filter(
+        pk=carpool.pk,
+        status="w",
+        driver__isnull=True,
+        seats_taken__lt=driver.car.capacity,
+    ).update(driver=driver)
+    if claimed:
+        carpool.driver = driver
+        carpool_changed.send(sender=Carpool, carpool_id=carpool.pk, kind="driver")
+        return SeatResult.JOINED
+
+    state = Carpool.objects.filter(pk=carpool.pk).values("status", "driver_id").first()
+    if state is None or state["status"] != "w":
+        return SeatResult.CLOSED
+    if state["driver_id"] is not None:
+        return SeatResult.TAKEN
+    return SeatResult.NO_ROOM
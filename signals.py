@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# 共乘團卡片內容改變時送出，參數：carpool_id, kind
+# kind: created / joined / left / driver / status / updated / deleted
+carpool_changed = Signal()
+
+# 司機評分總和/筆數改變時送出，參數：driver_id
+driver_rating_changed = Signal()
@@ -0,0 +1,66 @@
+"""SQLite backend with per-connection pragmas and a configurable BEGIN.
+
+The stock backend with two extra ``OPTIONS``:
+
+``pragmas``
+    ``{name: value}`` run on every new connection, e.g. WAL journaling.
+``transaction_mode``
+    ``DEFERRED`` (SQLite's default), ``IMMEDIATE`` or ``EXCLUSIVE`` for the
+    ``BEGIN`` of ``transaction.atomic``.  A deferred transaction that reads
+    first and then writes cannot wait for the write lock: SQLite fails it
+    with "database is locked" at once, busy timeout or not.  ``IMMEDIATE``
+    takes the lock up front, so it waits for the busy timeout instead.
+
+``file_replaced()`` tells whether the database file was swapped for another
+one (e.g. a replica refreshed by ``sync_replicas``) since the connection
+opened; the open connection keeps reading the old file until it is closed.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, settings_dict, alias=DEFAULT_DB_ALIAS):
+        super().__init__(settings_dict, alias)
+        options = settings_dict.get("OPTIONS", {})
+        self.pragmas = dict(options.get("pragmas", {}))
+        self.transaction_mode = options.get("transaction_mode", "DEFERRED").upper()
+        self.file_id = None
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}"
+            )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # sqlite3.connect() 不認得這兩個參數
+        params.pop("pragmas", None)
+        params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        self.file_id = self.stat_file()
+        return connection
+
+    def stat_file(self):
+        if self.is_in_memory_db():
+            return None
+        try:
+            stat = os.stat(self.settings_dict["NAME"])
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def file_replaced(self):
+        return self.connection is not None and self.file_id != self.stat_file()
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
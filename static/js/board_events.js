@@ -0,0 +1,121 @@
+// 看板推播：伺服器送來單張卡片的 out-of-band 片段，依此分頁的篩選條件替換、移除或插入，不重新查詢整個看板
+(function () {
+  const board = document.getElementById("filter-target")
+  if (!board || !window.EventSource) {
+    return
+  }
+
+  // 看板片段中由伺服器依篩選條件產生，見 carpool_list_region
+  function boardFilter() {
+    const script = document.getElementById("board-filter")
+    return script ? JSON.parse(script.textContent) : null
+  }
+
+  function matches(filter, card) {
+    const data = card.dataset
+    if (filter.user_in) {
+      // 推播的卡片不分使用者，無法判斷是否已加入；只更新已在畫面上的卡片
+      return null
+    }
+    if (filter.date && data.date != filter.date) {
+      return false
+    }
+    if (filter.date_from && data.date < filter.date_from) {
+      return false
+    }
+    if (filter.time_from && data.time < filter.time_from) {
+      return false
+    }
+    if (filter.time_until && data.time > filter.time_until) {
+      return false
+    }
+    if (filter.routes && !filter.routes.includes(Number(data.carfare))) {
+      return false
+    }
+    if (Number(data.seats) < filter.min_seats) {
+      return false
+    }
+    if (filter.has_driver && data.driver != "1") {
+      return false
+    }
+    if (filter.has_vacancy && data.vacancy != "1") {
+      return false
+    }
+    return true
+  }
+
+  // 與 CARPOOL_KEYSET_ORDERING 相同的 (date, time, id) 順序
+  function compare(a, b) {
+    const x = a.dataset
+    const y = b.dataset
+    if (x.date != y.date) {
+      return x.date < y.date ? -1 : 1
+    }
+    if (x.time != y.time) {
+      return x.time < y.time ? -1 : 1
+    }
+    return Number(x.pk) - Number(y.pk)
+  }
+
+  function insert(card) {
+    const cards = Array.from(board.querySelectorAll(":scope > [data-pk]"))
+    const next = cards.find((other) => compare(card, other) < 0)
+    if (next) {
+      next.before(card)
+    } else if (board.querySelector(":scope > [data-load-more]")) {
+      // 排在已載入的卡片之後，等「載入更多」時再出現
+      return
+    } else {
+      board.append(card)
+    }
+    htmx.process(card)
+  }
+
+  function applyOob(html) {
+    const filter = boardFilter()
+    const template = document.createElement("template")
+    template.innerHTML = html.trim()
+
+    template.content.querySelectorAll("[hx-swap-oob]").forEach((fragment) => {
+      const swap = fragment.getAttribute("hx-swap-oob")
+      fragment.removeAttribute("hx-swap-oob")
+
+      const current = document.getElementById(fragment.id)
+      if (swap == "delete") {
+        if (current) {
+          current.remove()
+        }
+        return
+      }
+      const match = filter ? matches(filter, fragment) : null
+      // 固定班次第一次有人加入時才建立共乘團，換掉原本的虛擬卡片
+      const occurrence = fragment.dataset.occurrence
+      if (!current && occurrence && document.getElementById(occurrence)) {
+        document.getElementById(occurrence).remove()
+      }
+      if (!current) {
+        if (match) {
+          insert(fragment)
+        }
+        return
+      }
+      if (match === false) {
+        // 人數或司機變了，已不符合這個分頁的篩選條件
+        current.remove()
+        return
+      }
+      // 已加入標籤因使用者而異，沿用原本卡片的設定
+      if (current.hasAttribute("data-user-in")) {
+        fragment.setAttribute("data-user-in", "")
+      }
+      current.replaceWith(fragment)
+      htmx.process(fragment)
+    })
+  }
+
+  const source = new EventSource(board.dataset.eventsUrl)
+  ;["created", "joined", "left", "driver", "status", "updated", "deleted"].forEach(
+    (kind) => source.addEventListener(kind, (e) => applyOob(e.data))
+  )
+  source.addEventListener("resync", () => htmx.trigger(document.body, "carpoolListChanged"))
+})()
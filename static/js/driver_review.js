@@ -5,7 +5,8 @@ $('#edit-comment-form').on('submit', (e) => {
   $('.edit-score').val(formData.get('rating'))
 })
 
-$('.edit-button, .delete-button').on('click', (e) => {
+// 委派到 document，HTMX 載入的評論也能使用
+$(document).on('click', '.edit-button, .delete-button', (e) => {
   console.log(e.target.getAttribute('data-form-action'))
   $('#edit-comment-form').attr('action', e.target.getAttribute('data-form-action'))
   $('#delete-comment-form').attr('action', e.target.getAttribute('data-form-action'))
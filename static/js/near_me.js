@@ -0,0 +1,36 @@
+// 附近出發：勾選時以瀏覽器定位填入隱藏的經緯度欄位，取消時清空
+(function () {
+  const toggle = document.getElementById("near-me")
+  const latitude = document.getElementById("id_latitude")
+  const longitude = document.getElementById("id_longitude")
+  if (!toggle || !latitude || !longitude) {
+    return
+  }
+
+  function clear() {
+    latitude.value = ""
+    longitude.value = ""
+  }
+
+  toggle.addEventListener("change", () => {
+    if (!toggle.checked) {
+      clear()
+      return
+    }
+    if (!navigator.geolocation) {
+      toggle.checked = false
+      return
+    }
+    navigator.geolocation.getCurrentPosition(
+      (position) => {
+        latitude.value = position.coords.latitude.toFixed(6)
+        longitude.value = position.coords.longitude.toFixed(6)
+      },
+      () => {
+        toggle.checked = false
+        clear()
+      },
+      { maximumAge: 300000, timeout: 10000 }
+    )
+  })
+})()
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from app.card_cache import card_html
+
+register = template.Library()
+
+
+@register.simple_tag
+def carpool_card_body(carpool):
+    """Board card body from the versioned render cache."""
+    return mark_safe(card_html(carpool))
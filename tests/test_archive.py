@@ -0,0 +1,95 @@
+from datetime import date, time, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from app.archive import archive_batch
+from app.models import (
+    ArchivedCarpool,
+    Car,
+    Carfare,
+    Carpool,
+    Driver,
+    Place,
+    Student,
+    User,
+)
+from app.views import CARPOOL_PAGE_SIZE
+
+
+class ArchiveCarpoolsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.s2 = Student.objects.create(username="s2", type=User.Types.STUDENT)
+        cls.d1 = Driver.objects.create(username="d1", type=User.Types.DRIVER)
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        place = Place.objects.create(name="Place 1")
+        cls.carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+
+    def create_carpool(self, days_ago, status="a", hour=9):
+        carpool = Carpool.objects.create(
+            date=date.today() - timedelta(days=days_ago),
+            time=time(hour),
+            carfare=self.carfare,
+            lower_passengers=1,
+            driver=self.d1,
+            status=status,
+        )
+        carpool.passengers.add(self.s1, self.s2)
+        return carpool
+
+    def test_archive_is_batched_and_idempotent(self):
+        old = [self.create_carpool(30 + i) for i in range(5)]
+        recent = self.create_carpool(1)
+        waiting = self.create_carpool(30, status="w")
+
+        out = StringIO()
+        call_command("archive_carpools", days=7, batch_size=2, stdout=out)
+        self.assertIn("5 carpool(s)", out.getvalue())
+        self.assertEqual(
+            set(Carpool.objects.values_list("pk", flat=True)), {recent.pk, waiting.pk}
+        )
+        self.assertEqual(
+            set(ArchivedCarpool.objects.values_list("pk", flat=True)),
+            {carpool.pk for carpool in old},
+        )
+        archived = ArchivedCarpool.objects.get(pk=old[0].pk)
+        self.assertEqual(archived.seats_taken, 2)
+        self.assertEqual(set(archived.passengers.all()), {self.s1, self.s2})
+        self.assertEqual(archived.avg_fare, 50)
+
+        self.assertEqual(archive_batch(date.today()), 1)
+        self.assertEqual(archive_batch(date.today()), 0)
+        self.assertEqual(ArchivedCarpool.objects.count(), 6)
+
+    def test_history_reads_live_and_archive(self):
+        carpools = [self.create_carpool(10 + i % 10, hour=6 + i) for i in range(15)]
+        carpools += [self.create_carpool(i % 3, hour=6 + i) for i in range(15)]
+        call_command("archive_carpools", days=7, stdout=StringIO())
+        self.assertEqual(ArchivedCarpool.objects.count(), 15)
+
+        self.client.force_login(self.s1)
+        response = self.client.get(reverse("app:carpool_history"))
+        first = list(response.context["object_list"])
+        self.assertEqual(len(first), CARPOOL_PAGE_SIZE)
+        response = self.client.get(
+            reverse("app:carpool_history"),
+            {"cursor": response.context["page_obj"].next_cursor},
+        )
+        second = list(response.context["object_list"])
+        self.assertFalse(response.context["page_obj"].has_next)
+
+        expected = sorted(carpools, key=lambda c: (c.date, c.time, c.pk))
+        self.assertEqual([c.pk for c in first + second], [c.pk for c in expected])
+
+    def test_driver_trip_count(self):
+        for i in range(3):
+            self.create_carpool(30 + i)
+        self.create_carpool(1)
+        self.create_carpool(1, status="w")
+        call_command("archive_carpools", days=7, stdout=StringIO())
+        self.assertEqual(Driver.objects.with_stats().get(pk=self.d1.pk).trip_count, 4)
+        call_command("rebuild_driver_trips", check=True, stdout=StringIO())
@@ -0,0 +1,216 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from app import urls
+from app.models import Carfare, Carpool, Comment, Driver, Place, Profile, Student
+
+
+class GenerateDatasetTestCase(TestCase):
+    def test_generate_dataset(self):
+        call_command(
+            "generate_dataset",
+            students=10,
+            drivers=3,
+            places=4,
+            carpools=50,
+            comments=20,
+            batch_size=16,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Student.objects.count(), 10)
+        self.assertEqual(Driver.objects.count(), 3)
+        self.assertEqual(Profile.objects.count(), 13)
+        self.assertEqual(Place.objects.count(), 4)
+        self.assertEqual(Carfare.objects.count(), 12)
+        self.assertEqual(Carpool.objects.count(), 50)
+        self.assertEqual(Comment.objects.count(), 20)
+        # 計數欄位與實際資料一致
+        call_command("rebuild_carpool_seats", check=True, stdout=StringIO())
+        call_command("rebuild_driver_ratings", check=True, stdout=StringIO())
+        call_command("rebuild_driver_trips", check=True, stdout=StringIO())
+
+
+class BenchmarkViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "generate_dataset",
+            students=10,
+            drivers=3,
+            places=4,
+            carpools=40,
+            comments=10,
+            days=3,
+            stdout=StringIO(),
+        )
+
+    def test_report_covers_every_view(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "report.json")
+            call_command("benchmark_views", repeat=1, output=output, stdout=StringIO())
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(report["meta"]["dataset"]["carpools"], 40)
+        names = {key.split("[")[0] for key in report["views"]}
+        self.assertEqual(names, {pattern.name for pattern in urls.urlpatterns})
+
+        board = report["views"]["carpools_region[student]"]
+        self.assertEqual(board["status"], 200)
+        self.assertGreater(board["queries"], 0)
+        self.assertGreater(board["rows"], 0)
+        # 每次請求都會回滾，資料不變
+        self.assertEqual(Comment.objects.count(), 10)
+
+        flows = report["flows"]
+        for result in flows.values():
+            self.assertEqual(result["status"], 302)
+            # 開啟評論表單不再寫入 session
+            self.assertEqual(result["form_writes"], 0)
+        self.assertLess(
+            flows["comment[signed_cookies]"]["queries"],
+            flows["comment[db]"]["queries"],
+        )
+
+        # 每 10 次請求改動一次共乘團，只有看板要重新產生
+        conditional = report["conditional"]
+        self.assertEqual(conditional["board[student]"]["hit_rate"], 0.9)
+        self.assertEqual(conditional["board[student]"]["not_modified_queries"], 0)
+        self.assertEqual(conditional["price[anonymous]"]["hit_rate"], 1)
+
+        overhead = report["metrics_overhead"]
+        self.assertEqual(overhead["paths"], 6)
+        self.assertGreater(overhead["request_us"], 0)
+
+    def test_template_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "templates.json")
+            call_command(
+                "benchmark_templates",
+                cards=20,
+                repeat=1,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(report["meta"]["cards"], 20)
+        self.assertEqual(set(report["loader"]), {"uncached", "cached"})
+        self.assertEqual(set(report["stars"]), {"loop", "tag"})
+
+    def test_spatial_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "spatial.json")
+            call_command(
+                "benchmark_spatial",
+                places=2000,
+                queries=10,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(report["meta"]["places"], 2000)
+        self.assertEqual(set(report["radii"]), {"1", "3", "10"})
+        for result in report["radii"].values():
+            self.assertEqual(result["mismatches"], 0)
+
+    def test_window_search_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "window.json")
+            call_command(
+                "benchmark_window_search",
+                queries=20,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(report["meta"]["searches"], 20)
+        strategies = report["strategies"]
+        self.assertEqual(strategies["index_warm"]["queries"], 0)
+        for result in strategies.values():
+            self.assertEqual(result["mismatches"], 0)
+
+    def test_counts_must_be_positive(self):
+        with self.assertRaisesMessage(
+            CommandError, "--places and --queries must be at least 1"
+        ):
+            call_command("benchmark_spatial", places=0, stdout=StringIO())
+
+    def test_window_search_needs_waiting_carpools(self):
+        Carpool.objects.update(status="a")
+        with self.assertRaisesMessage(CommandError, "no waiting carpools to search"):
+            call_command("benchmark_window_search", queries=5, stdout=StringIO())
+
+
+class BenchmarkServersTestCase(TransactionTestCase):
+    # 請求在其他 thread 的連線執行，資料必須先 commit
+
+    def test_wsgi_and_asgi_serve_the_same_load(self):
+        call_command(
+            "generate_dataset",
+            students=5,
+            drivers=2,
+            places=3,
+            carpools=20,
+            comments=5,
+            days=2,
+            stdout=StringIO(),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "servers.json")
+            call_command(
+                "benchmark_servers",
+                concurrency=4,
+                requests=24,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(len(report["meta"]["paths"]), 6)
+        for name in ("wsgi", "asgi"):
+            self.assertEqual(report["servers"][name]["statuses"], {"200": 24})
+
+
+class BenchmarkSqliteTestCase(TransactionTestCase):
+    # 子行程從 commit 後的資料庫複製
+
+    def test_contention_report(self):
+        call_command(
+            "generate_dataset",
+            students=5,
+            drivers=2,
+            places=3,
+            carpools=20,
+            comments=5,
+            days=2,
+            stdout=StringIO(),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "sqlite.json")
+            call_command(
+                "benchmark_sqlite",
+                processes=2,
+                operations=10,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output, encoding="utf-8") as f:
+                report = json.load(f)
+
+        self.assertEqual(set(report["profiles"]), {"legacy", "production"})
+        production = report["profiles"]["production"]
+        self.assertEqual(production["operations"], 20)
+        self.assertEqual(production["failed"], 0)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+from datetime import date, time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from app.models import Car, Carfare, Carpool, Comment, Driver, Place, Student, User
+
+MODELS = ("place", "carfare", "carpool", "comment")
+
+
+class BulkImportExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.s2 = Student.objects.create(username="s2", type=User.Types.STUDENT)
+        cls.d1 = Driver.objects.create(username="d1", type=User.Types.DRIVER)
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        p1 = Place.objects.create(name="中央大學")
+        p2 = Place.objects.create(name="中壢火車站")
+        cf = Carfare.objects.create(departure=p1, arrival=p2, fare=120)
+        Carfare.objects.create(departure=p2, arrival=p1, fare=130)
+        carpool = Carpool.objects.create(
+            date=date(2030, 1, 1),
+            time=time(9, 30),
+            carfare=cf,
+            lower_passengers=2,
+            driver=cls.d1,
+        )
+        carpool.passengers.add(cls.s1, cls.s2)
+        Carpool.objects.create(
+            date=date(2030, 1, 2), time=time(18), carfare=cf, lower_passengers=1
+        ).passengers.add(cls.s2)
+        Comment.objects.create(
+            content="好, 很準時", score=5, critic=cls.s1, criticed=cls.d1
+        )
+        Comment.objects.create(content="還可以", score=3, critic=cls.s2, criticed=cls.d1)
+
+    def export(self, directory, fmt):
+        paths = {}
+        for model in MODELS:
+            paths[model] = os.path.join(directory, f"{model}.{fmt}")
+            call_command("export_data", model, output=paths[model], stderr=StringIO())
+        return paths
+
+    def snapshot(self):
+        return {
+            "places": sorted(Place.objects.values_list("name", flat=True)),
+            "carfares": sorted(
+                Carfare.objects.values_list("departure__name", "arrival__name", "fare")
+            ),
+            "carpools": sorted(
+                (c.date, c.time, c.driver_id, c.seats_taken, c.status, c.carfare.fare)
+                for c in Carpool.objects.all()
+            ),
+            "passengers": sorted(
+                Carpool.passengers.through.objects.values_list(
+                    "carpool__date", "student_id"
+                )
+            ),
+            "comments": sorted(
+                Comment.objects.values_list("content", "score", "critic", "criticed")
+            ),
+        }
+
+    def round_trip(self, fmt):
+        before = self.snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.export(directory, fmt)
+            Comment.objects.all().delete()
+            Carpool.objects.all().delete()
+            Place.objects.all().delete()
+            Carfare.objects.all().delete()
+            for model in MODELS:
+                call_command("import_data", model, paths[model], stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(Driver.objects.get(pk=self.d1.pk).score, 4)
+        call_command("rebuild_carpool_seats", check=True, stdout=StringIO())
+        call_command("rebuild_driver_ratings", check=True, stdout=StringIO())
+        call_command("rebuild_driver_trips", check=True, stdout=StringIO())
+
+    def test_csv_round_trip(self):
+        self.round_trip("csv")
+
+    def test_jsonl_round_trip(self):
+        self.round_trip("jsonl")
+
+    def test_carfare_import_updates_fare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "carfare.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("departure,arrival,fare\n中央大學,中壢火車站,150\n")
+            call_command("import_data", "carfare", path, stdout=StringIO())
+        self.assertEqual(Carfare.objects.count(), 2)
+        self.assertEqual(
+            Carfare.objects.get(departure__name="中央大學").fare,
+            150,
+        )
+
+    def import_jsonl(self, model, *lines):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"{model}.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+            call_command("import_data", model, path, stdout=StringIO())
+
+    def test_unknown_user_rolls_back(self):
+        carpool = (
+            '{"date": "2030-01-03", "time": "08:00", "departure": "中央大學",'
+            ' "arrival": "中壢火車站", "passengers": [%s]}'
+        )
+        # 錯誤回報在出問題的那一行，不是批次的第一行
+        with self.assertRaisesMessage(CommandError, "line 3: unknown user(s): nobody"):
+            self.import_jsonl(
+                "carpool",
+                carpool % '"s1"',
+                "",
+                carpool % '"s1", "nobody"',
+                carpool % '"nobody", "ghost"',
+            )
+        self.assertEqual(Carpool.objects.count(), 2)
+
+    def test_invalid_jsonl_line(self):
+        comment = (
+            '{"time": "2030-01-01T08:00", "critic": "s1", "criticed": "d1", "score": 4}'
+        )
+        with self.assertRaisesMessage(CommandError, "line 2: invalid JSON"):
+            self.import_jsonl("comment", comment, '{"time": ')
+        with self.assertRaisesMessage(CommandError, "line 1: expected a JSON object"):
+            self.import_jsonl("comment", "[1, 2]")
+        self.assertEqual(Comment.objects.count(), 2)
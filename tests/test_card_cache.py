@@ -0,0 +1,84 @@
+from datetime import date
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.test import TestCase
+from django.urls import reverse
+
+from app import card_cache
+from app.models import Car, Carfare, Carpool, Comment, Driver, Place, Student, User
+from app.seats import reserve_seat
+
+
+class CarpoolCardCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.s2 = Student.objects.create(
+            username="s2", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        place = Place.objects.create(name="Place 1")
+        cls.cf1 = Carfare.objects.create(departure=place, arrival=place, fare=100)
+
+    def setUp(self):
+        cache.clear()
+        caches["cards"].clear()
+        self.carpools = []
+        for driver in (self.d1, None):
+            carpool = Carpool.objects.create(
+                date=date.today(), carfare=self.cf1, lower_passengers=1, driver=driver
+            )
+            reserve_seat(carpool, self.s1)
+            self.carpools.append(carpool)
+        card_cache.stats.reset()
+
+    def get_board(self):
+        return self.client.get(reverse("app:carpools_region"))
+
+    def test_cards_are_cached_until_changed(self):
+        self.get_board()
+        self.assertEqual(card_cache.stats.snapshot()["misses"], 2)
+        self.get_board()
+        self.assertEqual(card_cache.stats.snapshot()["hits"], 2)
+
+        # 版本是整個看板共用的，任何變更都會重新渲染所有卡片
+        reserve_seat(self.carpools[1], self.s2)
+        response = self.get_board()
+        self.assertEqual(card_cache.stats.snapshot()["misses"], 4)
+        self.assertContains(response, "100</span>", count=1)
+
+    def test_page_reads_two_versions(self):
+        with mock.patch.object(
+            card_cache, "get_versions", wraps=card_cache.get_versions
+        ) as get_versions:
+            self.get_board()
+        get_versions.assert_called_once_with(
+            [card_cache.version_key("board"), card_cache.version_key("fares")]
+        )
+
+    def test_driver_changes_bump_cards(self):
+        self.get_board()
+        Comment.objects.create(content="ok", score=4, critic=self.s1, criticed=self.d1)
+        self.get_board()
+        self.assertEqual(card_cache.stats.snapshot()["misses"], 4)
+
+        car = self.d1.car
+        car.plate = "XYZ-9999"
+        car.save()
+        self.assertContains(self.get_board(), "XYZ-9999")
+
+    def test_cached_card_is_shared_across_users(self):
+        self.client.force_login(self.s1)
+        self.assertContains(self.get_board(), "data-user-in", count=2)
+        self.client.force_login(self.s2)
+        response = self.get_board()
+        self.assertNotContains(response, "data-user-in")
+        self.assertEqual(
+            card_cache.stats.snapshot(), {"hits": 2, "misses": 2, "hit_rate": 0.5}
+        )
@@ -0,0 +1,198 @@
+import re
+from datetime import date, time, timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app import carpool_index, versions
+from app.carpool_index import DayIndex
+from app.fare_matrix import get_fare_matrix
+from app.forms import CarpoolFilterForm
+from app.models import Car, Carfare, Carpool, Driver, Place, User
+from app.recurrence import get_recurring_carpools
+
+
+class DayIndexTestCase(TestCase):
+    def test_window(self):
+        index = DayIndex(
+            [
+                (1, time(7, 50), 10),
+                (1, time(8, 0), 3),
+                (1, time(8, 40), 4),
+                (1, time(9, 0), 5),
+                (2, time(8, 0), 1),
+                (2, time(8, 20), 2),
+            ]
+        )
+        self.assertEqual(index.window([1, 2], time(8), time(8, 40)), [1, 3, 2, 4])
+        self.assertEqual(index.window([2, 9], time(8, 1), time(8, 40)), [2])
+        self.assertEqual(index.window([1], None, time(8)), [10, 3])
+        self.assertEqual(index.window([1], time(8, 41)), [5])
+        self.assertEqual(index.window([], time(8), time(9)), [])
+        # 從 keyset 游標之後開始，最多 limit 筆
+        self.assertEqual(
+            index.window([1, 2], time(8), time(9), after=(time(8), 1), limit=2), [3, 2]
+        )
+        self.assertEqual(
+            index.window([1, 2], None, None, after=(time(8, 20), 2)), [4, 5]
+        )
+
+
+class CarpoolIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.a, cls.b, cls.c, cls.d = Place.objects.bulk_create(
+            Place(name=name) for name in ("A", "B", "C", "D")
+        )
+        cls.ac = Carfare.objects.create(departure=cls.a, arrival=cls.c, fare=100)
+        cls.bc = Carfare.objects.create(departure=cls.b, arrival=cls.c, fare=100)
+        cls.ad = Carfare.objects.create(departure=cls.a, arrival=cls.d, fare=100)
+        cls.today = date.today()
+
+    def create(self, carfare, hour, minute, **kwargs):
+        return Carpool.objects.create(
+            date=kwargs.pop("date", self.today),
+            time=time(hour, minute),
+            carfare=carfare,
+            lower_passengers=1,
+            **kwargs,
+        )
+
+    def test_route_ids(self):
+        self.assertEqual(
+            sorted(carpool_index.route_ids([self.a.pk, self.b.pk], self.c.pk)),
+            sorted([self.ac.pk, self.bc.pk]),
+        )
+        self.assertEqual(carpool_index.route_ids([], self.d.pk), [self.ad.pk])
+        self.assertEqual(len(carpool_index.route_ids()), 3)
+
+    def test_kept_in_sync(self):
+        routes = carpool_index.route_ids([self.a.pk, self.b.pk], self.c.pk)
+        first = self.create(self.ac, 8, 10)
+        self.assertEqual(
+            carpool_index.search(self.today, time(8), time(8, 40), routes), [first.pk]
+        )
+        with self.assertNumQueries(0):
+            carpool_index.search(self.today, time(8), time(8, 40), routes)
+
+        second = self.create(self.bc, 8, 0)
+        self.create(self.ad, 8, 5)
+        self.create(self.bc, 8, 5, date=self.today + timedelta(days=1))
+        self.assertEqual(
+            carpool_index.search(self.today, time(8), time(8, 40), routes),
+            [second.pk, first.pk],
+        )
+
+        first.status = "d"
+        first.save(update_fields=["status"])
+        second.time = time(9)
+        second.save()
+        self.assertEqual(
+            carpool_index.search(self.today, time(8), time(8, 40), routes), []
+        )
+        second.delete()
+        self.assertEqual(carpool_index.search(self.today, None, None, routes), [])
+
+    def test_bump_from_another_process(self):
+        routes = carpool_index.route_ids([self.a.pk], self.c.pk)
+        first = self.create(self.ac, 8, 10)
+        self.assertEqual(
+            carpool_index.search(self.today, None, None, routes), [first.pk]
+        )
+        # 別的行程寫入：這裡沒有 signal，只看得到共用的版本號
+        Carpool.objects.filter(pk=first.pk).update(status="d")
+        self.assertEqual(
+            carpool_index.search(self.today, None, None, routes), [first.pk]
+        )
+        versions.bump(carpool_index.version_key(self.today))
+        self.assertEqual(carpool_index.search(self.today, None, None, routes), [])
+
+    def test_board_window_search(self):
+        expected = [
+            self.create(self.ac, 8, 0),
+            self.create(self.bc, 8, 30),
+            self.create(self.ac, 8, 40),
+        ]
+        self.create(self.ac, 7, 59)
+        self.create(self.bc, 8, 41)
+        self.create(self.ad, 8, 20)
+        data = {
+            "date": self.today,
+            "already_in": 0,
+            "time": "08:00",
+            "time_until": "08:40",
+            "departures": [self.a.pk, self.b.pk],
+            "arrival": self.c.pk,
+        }
+        url = reverse("app:carpools_region")
+        get_fare_matrix()
+        get_recurring_carpools()
+        carpool_index.get_day_index(self.today)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, data)
+        self.assertEqual(list(response.context["page"]), expected)
+        # 路線數不影響查詢次數
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        data.pop("departures")
+        response = self.client.get(url, data)
+        self.assertEqual(list(response.context["page"]), expected)
+
+        data["time_until"] = "07:00"
+        form = CarpoolFilterForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn("time_until", form.errors)
+
+    def test_window_pages_send_bounded_ids(self):
+        driver = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=driver, capacity=4, plate="ABC-1234")
+        carpools = Carpool.objects.bulk_create(
+            Carpool(
+                date=self.today,
+                time=time(8, i % 40),
+                carfare=self.ac,
+                lower_passengers=1,
+                driver=driver if i % 5 == 0 else None,
+            )
+            for i in range(100)
+        )
+        carpool_index.invalidate()
+        data = {
+            "date": self.today,
+            "already_in": 0,
+            "time": "08:00",
+            "time_until": "08:40",
+            "arrival": self.c.pk,
+        }
+        url = reverse("app:carpools_region")
+
+        with CaptureQueriesContext(connection) as ctx:
+            page = self.client.get(url, data).context["page"]
+        self.assertEqual(len(page), 20)
+        in_lists = [
+            len(ids.split(","))
+            for query in ctx.captured_queries
+            for ids in re.findall(r"\bIN \(([^)]*)\)", query["sql"])
+        ]
+        self.assertEqual(max(in_lists), 21)
+
+        # 其他條件濾掉大部分時，分批補足整頁，翻頁後接續
+        data["has_driver"] = "on"
+        data["has_vacancy"] = ""
+        expected = sorted(
+            (c for c in carpools if c.driver_id), key=lambda c: (c.time, c.pk)
+        )
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {**data, "cursor": cursor or ""})
+            page = response.context["page"]
+            seen += list(page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
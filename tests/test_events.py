@@ -0,0 +1,174 @@
+import asyncio
+import json
+import re
+from datetime import date
+
+from django.test import TestCase
+from django.urls import reverse
+
+from app.events import QUEUE_SIZE, board_events_app, broker, event_log
+from app.models import Car, Carfare, Carpool, Driver, Place, Student, User
+from app.seats import assign_driver, reserve_seat
+
+
+class BoardEventsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        place = Place.objects.create(name="Place 1")
+        cls.cf1 = Carfare.objects.create(departure=place, arrival=place, fare=100)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.subscriber = broker.subscribe(self.loop)
+        # 輪詢執行緒若還在跑，會帶著前一個測試尚未讀取的事件
+        self.received()
+
+    def tearDown(self):
+        broker.unsubscribe(self.subscriber)
+        self.loop.close()
+
+    def received(self):
+        broker.poll()
+
+        async def drain():
+            await asyncio.sleep(0)
+            messages = []
+            while not self.subscriber.queue.empty():
+                messages.append(self.subscriber.queue.get_nowait())
+            return messages
+
+        return self.loop.run_until_complete(drain())
+
+    def test_create_and_join_push_single_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            carpool = Carpool.objects.create(
+                date=date.today(), carfare=self.cf1, lower_passengers=1
+            )
+            reserve_seat(carpool, self.s1)
+        (message,) = self.received()
+        self.assertTrue(message.startswith("event: created\n"))
+        self.assertIn(f'id="carpool-{carpool.pk}"', message)
+        # 放在哪裡、要不要顯示由各分頁依卡片上的資料決定
+        self.assertIn('hx-swap-oob="true"', message)
+        self.assertIn(f'data-date="{date.today().isoformat()}"', message)
+        self.assertIn(f'data-carfare="{self.cf1.pk}"', message)
+        self.assertIn('data-seats="1"', message)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_driver(carpool, self.d1)
+        (message,) = self.received()
+        self.assertTrue(message.startswith("event: driver\n"))
+        self.assertIn('hx-swap-oob="true"', message)
+        self.assertIn("ABC-1234", message)
+
+    def test_status_change_removes_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            carpool = Carpool.objects.create(
+                date=date.today(), carfare=self.cf1, lower_passengers=1
+            )
+        self.received()
+        carpool.status = "d"
+        with self.captureOnCommitCallbacks(execute=True):
+            carpool.save(update_fields=["status"])
+        (message,) = self.received()
+        self.assertTrue(message.startswith("event: status\n"))
+        self.assertIn('hx-swap-oob="delete"', message)
+
+    def test_events_from_other_processes_are_delivered(self):
+        # 其他行程只會把事件寫進共用快取
+        event_log.append("event: joined\ndata: <div></div>\n\n")
+        self.assertEqual(self.received(), ["event: joined\ndata: <div></div>\n\n"])
+
+    def test_changes_are_published_without_local_subscribers(self):
+        broker.unsubscribe(self.subscriber)
+        position = event_log.position()
+        with self.captureOnCommitCallbacks(execute=True):
+            Carpool.objects.create(
+                date=date.today(), carfare=self.cf1, lower_passengers=1
+            )
+        self.assertEqual(event_log.position(), position + 1)
+
+    def test_lost_events_ask_for_resync(self):
+        for _ in range(QUEUE_SIZE + 1):
+            event_log.append("event: updated\ndata: \n\n")
+        self.assertEqual(self.received(), ["event: resync\ndata: \n\n"])
+        self.assertEqual(self.received(), [])
+
+
+class BoardFilterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        place = Place.objects.create(name="Place 1")
+        cls.cf1 = Carfare.objects.create(departure=place, arrival=place, fare=100)
+
+    def board_filter(self, data):
+        response = self.client.get(reverse("app:carpools_region"), data)
+        match = re.search(
+            r'<script id="board-filter" type="application/json">(.*?)</script>',
+            response.content.decode(),
+        )
+        return match and json.loads(match[1])
+
+    def test_board_carries_its_filter(self):
+        today = date.today().isoformat()
+        self.assertEqual(self.board_filter({}), {"date_from": today, "min_seats": 1})
+        self.assertEqual(
+            self.board_filter(
+                {
+                    "date": today,
+                    "time": "08:00",
+                    "carfare": self.cf1.pk,
+                    "already_in": 2,
+                    "has_driver": "on",
+                    "has_vacancy": "on",
+                }
+            ),
+            {
+                "date": today,
+                "time_from": "08:00:00",
+                "time_until": None,
+                "routes": [self.cf1.pk],
+                "min_seats": 2,
+                "has_driver": True,
+                "has_vacancy": True,
+            },
+        )
+
+
+class BoardEventsAppTestCase(TestCase):
+    def test_stream_sends_published_events(self):
+        async def run():
+            sent = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if message.get("body"):
+                    disconnect.set()
+
+            task = asyncio.ensure_future(board_events_app({}, receive, send))
+            while not broker.has_subscribers():
+                await asyncio.sleep(0)
+            broker.publish("event: joined\ndata: <div></div>\n\n")
+            broker.poll()
+            await asyncio.wait_for(task, 1)
+            return sent
+
+        sent = asyncio.run(run())
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn(
+            (b"content-type", b"text/event-stream; charset=utf-8"), sent[0]["headers"]
+        )
+        self.assertEqual(sent[1]["body"], b"event: joined\ndata: <div></div>\n\n")
+        self.assertFalse(broker.has_subscribers())
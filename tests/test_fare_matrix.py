@@ -0,0 +1,91 @@
+from datetime import date
+
+from django.test import TestCase
+from django.urls import reverse
+
+from app import fare_matrix, versions
+from app.forms import CarpoolFilterForm, CarpoolForm
+from app.models import Carfare, Carpool, Place
+
+
+class FareMatrixTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.places = Place.objects.bulk_create(
+            Place(name=f"Place {i:02}") for i in range(30)
+        )
+        Carfare.objects.bulk_create(
+            Carfare(departure=departure, arrival=arrival, fare=10 * (i + j))
+            for i, departure in enumerate(cls.places)
+            for j, arrival in enumerate(cls.places)
+            if i != j
+        )
+
+    def setUp(self):
+        fare_matrix.invalidate()
+
+    def test_price_view_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("app:price"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["fare_rows"]), 29)
+        place, fares = response.context["fare_rows"][-1]
+        self.assertEqual(place.name, "Place 29")
+        self.assertEqual(fares, [10 * (29 + j) for j in range(29)])
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("app:price"))
+
+    def test_fare_lookup_and_invalidation(self):
+        first, second = self.places[:2]
+        self.assertEqual(fare_matrix.fare(first, second), 10)
+        self.assertIsNone(fare_matrix.fare(first, first))
+
+        Carfare.objects.filter(departure=first, arrival=second).get().delete()
+        self.assertIsNone(fare_matrix.fare(first, second))
+        Carfare.objects.create(departure=first, arrival=second, fare=55)
+        self.assertEqual(fare_matrix.fare(first.pk, second.pk), 55)
+
+    def test_version_bumped_elsewhere_rebuilds(self):
+        first, second = self.places[:2]
+        fare_matrix.get_fare_matrix()
+        # 模擬另一個行程：改資料並只留下共用的版本號
+        Carfare.objects.filter(departure=first, arrival=second).update(fare=77)
+        self.assertEqual(fare_matrix.fare(first, second), 10)
+        versions.bump(fare_matrix.VERSION_KEY)
+        self.assertEqual(fare_matrix.fare(first, second), 77)
+
+    def test_carpool_fare(self):
+        carfare = Carfare.objects.filter(departure=self.places[3]).first()
+        carpool = Carpool.objects.create(
+            date=date.today(), carfare=carfare, lower_passengers=1
+        )
+        carpool = Carpool.objects.get(pk=carpool.pk)
+        fare_matrix.get_fare_matrix()
+        with self.assertNumQueries(0):
+            self.assertEqual(carpool.fare, carfare.fare)
+
+    def test_form_choices(self):
+        fare_matrix.get_fare_matrix()
+        with self.assertNumQueries(0):
+            choices = list(CarpoolFilterForm().fields["carfare"].choices)
+            form_choices = list(CarpoolForm().fields["carfare"].choices)
+        self.assertEqual(len(choices), 30 * 29 + 1)
+        self.assertEqual(len(form_choices), len(choices))
+        self.assertEqual(str(form_choices[1][1]), str(Carfare.objects.first()))
+
+        carfare = Carfare.objects.first()
+        form = CarpoolFilterForm(
+            data={"carfare": carfare.pk, "date": date.today(), "already_in": 0}
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["carfare"], carfare)
+        self.assertEqual(
+            form.cleaned_data["carfare"].arrival.name, carfare.arrival.name
+        )
+
+        form = CarpoolFilterForm(
+            data={"carfare": 0, "date": date.today(), "already_in": 0}
+        )
+        self.assertFalse(form.is_valid())
@@ -0,0 +1,124 @@
+import random
+from datetime import date, time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.admin.sites import AdminSite
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from app.admin import CarpoolAdmin
+from app import matching
+from app.matching import DEFAULT_GAP, Demand, Supply, match_drivers, solve
+from app.models import Car, Carfare, Carpool, Driver, Place, Student, User
+
+
+class SolveTestCase(SimpleTestCase):
+    def test_constraints_on_large_batch(self):
+        rng = random.Random(1)
+        demands = [
+            Demand(i, rng.randrange(3 * 24 * 60), rng.randint(1, 6))
+            for i in range(10000)
+        ]
+        supplies = [
+            Supply(
+                10**6 + i,
+                rng.choice((4, 4, 5, 7, 9)),
+                rng.choice("nela"),
+                rng.random() * 5,
+                sorted(rng.randrange(3 * 24 * 60) for _ in range(rng.randint(0, 3))),
+            )
+            for i in range(2000)
+        ]
+        assignments = solve(demands, supplies)
+        self.assertGreater(len(assignments), 9000)
+
+        demands = {demand.carpool_id: demand for demand in demands}
+        supplies = {supply.driver_id: supply for supply in supplies}
+        trips = {}
+        for carpool_id, driver_id in assignments.items():
+            self.assertLess(demands[carpool_id].seats, supplies[driver_id].capacity)
+            trips.setdefault(driver_id, []).append(demands[carpool_id].start)
+        for driver_id, starts in trips.items():
+            starts.sort()
+            for previous, start in zip(starts, starts[1:]):
+                self.assertGreaterEqual(start - previous, DEFAULT_GAP)
+            for start in starts:
+                for committed in supplies[driver_id].commitments:
+                    self.assertGreaterEqual(abs(start - committed), DEFAULT_GAP)
+
+    def test_best_fit(self):
+        demands = [Demand(1, 600, 5), Demand(2, 600, 2)]
+        supplies = [Supply(10, 9, "n", 0, []), Supply(11, 4, "n", 0, [])]
+        self.assertEqual(solve(demands, supplies), {1: 10, 2: 11})
+
+    def test_busy_drivers_are_not_rescanned(self):
+        # 所有司機同一時間都有行程：衝突的團不能派，也不能每團都掃過全部司機
+        supplies = [Supply(10**6 + i, 5, "n", 0, [600]) for i in range(500)]
+        clashing = [Demand(i, 600 + i % DEFAULT_GAP, 2) for i in range(1000)]
+        later = [Demand(2000 + i, 600 + DEFAULT_GAP, 2) for i in range(500)]
+        with mock.patch.object(
+            matching, "conflicts", wraps=matching.conflicts
+        ) as conflicts:
+            assignments = solve(clashing + later, supplies)
+        self.assertEqual(sorted(assignments), [demand.carpool_id for demand in later])
+        self.assertEqual(len(set(assignments.values())), len(supplies))
+        self.assertLessEqual(conflicts.call_count, 2 * len(supplies))
+
+
+class MatchDriversTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.small = Driver.objects.create(username="d1", type=User.Types.DRIVER)
+        cls.large = Driver.objects.create(username="d2", type=User.Types.DRIVER)
+        Car.objects.create(driver=cls.small, capacity=4, plate="ABC-1234")
+        Car.objects.create(driver=cls.large, capacity=7, plate="ABC-5678")
+        place = Place.objects.create(name="Place 1")
+        cls.carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        cls.day = date(2030, 1, 1)
+
+    def create_carpool(self, hour, seats, driver=None):
+        carpool = Carpool.objects.create(
+            date=self.day,
+            time=time(hour),
+            carfare=self.carfare,
+            lower_passengers=1,
+            driver=driver,
+        )
+        Carpool.objects.filter(pk=carpool.pk).update(seats_taken=seats)
+        return carpool
+
+    def test_match_drivers(self):
+        # d1 已有 10 點的行程
+        self.create_carpool(10, 1, driver=self.small)
+        morning = self.create_carpool(10, 2)
+        big = self.create_carpool(14, 5)
+        too_big = self.create_carpool(14, 8)
+
+        result = match_drivers(self.day)
+        self.assertEqual(
+            result.applied, {morning.pk: self.large.pk, big.pk: self.large.pk}
+        )
+        self.assertEqual(result.unmatched, [too_big.pk])
+        self.assertEqual(Carpool.objects.get(pk=big.pk).driver_id, self.large.pk)
+
+    def test_command_dry_run(self):
+        carpool = self.create_carpool(9, 1)
+        out = StringIO()
+        call_command("match_drivers", "--from", "2030-01-01", "--dry-run", stdout=out)
+        self.assertIn("1/1", out.getvalue())
+        self.assertIsNone(Carpool.objects.get(pk=carpool.pk).driver_id)
+
+    def test_admin_action(self):
+        selected = self.create_carpool(9, 1)
+        other = self.create_carpool(18, 1)
+        request = RequestFactory().post("/")
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        CarpoolAdmin(Carpool, AdminSite()).match_drivers_action(
+            request, Carpool.objects.filter(pk=selected.pk)
+        )
+        self.assertIsNotNone(Carpool.objects.get(pk=selected.pk).driver_id)
+        self.assertIsNone(Carpool.objects.get(pk=other.pk).driver_id)
@@ -0,0 +1,71 @@
+from datetime import date
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from app import metrics
+from app.models import Carfare, Carpool, Place, Student, User
+
+
+class MetricsMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.staff = Student.objects.create(
+            username="staff", type=User.Types.STUDENT, is_staff=True
+        )
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        Carpool.objects.create(date=date.today(), carfare=carfare, lower_passengers=1)
+
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_board_request_is_recorded(self):
+        self.client.force_login(self.s1)
+        for _ in range(3):
+            self.client.get(reverse("app:carpools_region"))
+        self.client.get("/app/no-such-page")
+
+        snapshot = metrics.registry.snapshot()
+        board = snapshot["app:carpools_region"]
+        self.assertEqual(board["requests"], 3)
+        self.assertEqual(sum(board["latency_ms"]["buckets"].values()), 3)
+        # 查詢在 sync_to_async 的 thread 中執行，也要算進來
+        self.assertGreater(board["queries"], 0)
+        self.assertGreater(board["template_ms"], 0)
+        self.assertEqual(snapshot[metrics.UNRESOLVED]["requests"], 1)
+
+    def test_async_request_is_recorded(self):
+        async_to_sync(self.async_client.get)(reverse("app:carpools_region"))
+        board = metrics.registry.snapshot()["app:carpools_region"]
+        self.assertEqual(board["requests"], 1)
+        self.assertGreater(board["queries"], 0)
+
+    @override_settings(DEBUG=True)
+    def test_asgi_chain_stays_async(self):
+        # DEBUG 時 Django 會記錄每個被轉成 sync 的 middleware
+        with self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    def test_prometheus_text(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse("app:price"))
+        response = self.client.get(reverse("app:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn(
+            'app_request_duration_seconds_bucket{view="app:price",le="+Inf"} 1', text
+        )
+        self.assertIn('app_request_duration_seconds_count{view="app:price"} 1', text)
+        self.assertIn("# TYPE app_sql_queries_total counter", text)
+
+    def test_access(self):
+        self.client.force_login(self.s1)
+        self.assertEqual(self.client.get(reverse("app:metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("app:metrics_json")).status_code, 403)
+        with override_settings(INTERNAL_IPS=["127.0.0.1"]):
+            self.assertEqual(self.client.get(reverse("app:metrics")).status_code, 200)
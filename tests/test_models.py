@@ -1,8 +1,11 @@
+from io import StringIO
 from django.contrib.auth import get_user
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.urls import reverse
 from django.utils.timezone import now
-from app.models import Carfare, Comment, Driver, Place, Student, User, Carpool
+from app.models import Carfare, Comment, Driver, Place, Profile, Student, User, Carpool
 
 
 class UserTestCase(TestCase):
@@ -115,3 +118,58 @@ class CarpoolTestCase(TestCase):
         self.assertEqual(self.cp1.departure, self.p1.name)
         self.assertEqual(self.cp1.arrival, self.p2.name)
         self.assertEqual(self.cp1.fare, 100)
+
+
+class DriverRatingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        cls.d2 = Driver.objects.create(
+            username="d2", password="pass0000", type=User.Types.DRIVER
+        )
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+
+    def get_driver(self, driver):
+        return Driver.objects.select_related("profile").get(pk=driver.pk)
+
+    def test_score_costs_no_query(self):
+        Comment.objects.create(content="ok", score=3, critic=self.s1, criticed=self.d1)
+        driver = self.get_driver(self.d1)
+        with self.assertNumQueries(0):
+            self.assertEqual(driver.score, 3)
+
+    def test_edit_and_delete_comment(self):
+        comment = Comment.objects.create(
+            content="ok", score=3, critic=self.s1, criticed=self.d1
+        )
+        comment.score = 5
+        comment.save()
+        self.assertEqual(self.get_driver(self.d1).profile.rating_sum, 5)
+
+        comment.criticed = self.d2
+        comment.save()
+        self.assertIsNone(self.get_driver(self.d1).score)
+        self.assertEqual(self.get_driver(self.d2).score, 5)
+
+        self.assertEqual(self.get_driver(self.d2).profile.star5_count, 1)
+        self.assertEqual(self.get_driver(self.d1).profile.star5_count, 0)
+
+        comment.delete()
+        self.assertIsNone(self.get_driver(self.d2).score)
+        self.assertEqual(self.get_driver(self.d2).profile.rating_count, 0)
+        self.assertEqual(self.get_driver(self.d2).profile.star5_count, 0)
+
+    def test_rebuild_driver_ratings(self):
+        Comment.objects.create(content="ok", score=4, critic=self.s1, criticed=self.d1)
+        Profile.objects.filter(user=self.d1).update(rating_sum=0, rating_count=0)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_driver_ratings", check=True, stdout=StringIO())
+
+        call_command("rebuild_driver_ratings", stdout=StringIO())
+        self.assertEqual(self.get_driver(self.d1).score, 4)
+        self.assertEqual(self.get_driver(self.d1).profile.star4_count, 1)
+        call_command("rebuild_driver_ratings", check=True, stdout=StringIO())
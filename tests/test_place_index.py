@@ -0,0 +1,94 @@
+import random
+from datetime import date
+
+from django.test import TestCase
+from django.urls import reverse
+
+from app import place_index
+from app.models import Carfare, Carpool, Place
+from app.place_index import PlaceIndex, brute_force_near
+
+
+class PlaceIndexTestCase(TestCase):
+    def test_matches_linear_scan(self):
+        rng = random.Random(1)
+        points = [
+            (pk, rng.uniform(24.8, 25.1), rng.uniform(121.0, 121.4))
+            for pk in range(2000)
+        ]
+        # 換日線與極點附近的地點
+        points += [(2000, 10.0, 179.99), (2001, 10.0, -179.99), (2002, 89.99, 50.0)]
+        index = PlaceIndex(points)
+        queries = [
+            (rng.uniform(24.8, 25.1), rng.uniform(121.0, 121.4)) for _ in range(20)
+        ]
+        for latitude, longitude in queries + [(10.0, 180.0), (89.95, -130.0)]:
+            for radius in (0.5, 2, 8, 500):
+                near = index.near(latitude, longitude, radius)
+                expected = brute_force_near(points, latitude, longitude, radius)
+                self.assertEqual([pk for _, pk in near], [pk for _, pk in expected])
+                for (got, _), (want, _) in zip(near, expected):
+                    self.assertAlmostEqual(got, want, places=6)
+
+        self.assertEqual([pk for _, pk in index.near(10.0, 180.0, 5)], [2000, 2001])
+        self.assertEqual(len(index.near(24.95, 121.2, 50, limit=10)), 10)
+
+    def test_rebuilt_on_place_changes(self):
+        place = Place.objects.create(name="中央大學", latitude=24.968, longitude=121.192)
+        Place.objects.create(name="沒有座標")
+        self.assertEqual(place_index.near_place_ids(24.97, 121.19, 1), [place.pk])
+
+        place.latitude = 25.05
+        place.save()
+        self.assertEqual(place_index.near_place_ids(24.97, 121.19, 1), [])
+        self.assertEqual(place_index.get_place_index().size, 1)
+
+        place.delete()
+        self.assertEqual(place_index.get_place_index().size, 0)
+
+
+class NearMeBoardTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        ncu = Place.objects.create(name="中央大學", latitude=24.968, longitude=121.192)
+        station = Place.objects.create(name="中壢火車站", latitude=24.954, longitude=121.225)
+        airport = Place.objects.create(name="桃園機場", latitude=25.077, longitude=121.232)
+        for departure, arrival in ((ncu, airport), (station, airport), (airport, ncu)):
+            carfare = Carfare.objects.create(
+                departure=departure, arrival=arrival, fare=100
+            )
+            Carpool.objects.create(
+                date=date.today(), carfare=carfare, lower_passengers=1
+            )
+
+    def board(self, **params):
+        data = {"date": date.today(), "already_in": 0, **params}
+        response = self.client.get(reverse("app:carpools_region"), data)
+        self.assertEqual(response.status_code, 200)
+        return sorted(carpool.departure for carpool in response.context["page"])
+
+    def test_radius_filter(self):
+        self.assertEqual(len(self.board()), 3)
+        self.assertEqual(
+            self.board(latitude=24.967, longitude=121.19, radius=1), ["中央大學"]
+        )
+        # 預設半徑 3 公里內有中央大學與中壢火車站
+        self.assertEqual(
+            self.board(latitude=24.96, longitude=121.21),
+            sorted(["中央大學", "中壢火車站"]),
+        )
+        # 只有一個座標時不做附近搜尋
+        self.assertEqual(len(self.board(latitude=24.96, radius=1)), 3)
+
+    def test_every_place_in_radius_counts(self):
+        # 比中央大學更近的地點超過 500 個，中央大學仍在結果內
+        Place.objects.bulk_create(
+            Place(name=f"附近 {i}", latitude=24.967 + i * 1e-6, longitude=121.19)
+            for i in range(600)
+        )
+        place_index.invalidate()
+        nearby = place_index.near_place_ids(24.967, 121.19, 1)
+        self.assertEqual(len(nearby), 601)
+        self.assertEqual(
+            self.board(latitude=24.967, longitude=121.19, radius=1), ["中央大學"]
+        )
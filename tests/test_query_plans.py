@@ -0,0 +1,77 @@
+from datetime import date, time, timedelta
+
+from django.test import SimpleTestCase, TestCase
+
+from app.models import Carfare, Carpool, Comment, Driver, Place, Student, User
+from app.query_plans import full_scans, hot_queries, scanned_tables
+
+
+class HotQueryPlanTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        places = Place.objects.bulk_create(
+            [Place(name=f"Place {i}") for i in range(30)]
+        )
+        carfares = Carfare.objects.bulk_create(
+            [
+                Carfare(departure=departure, arrival=arrival, fare=100)
+                for departure in places
+                for arrival in places
+                if departure != arrival
+            ]
+        )
+        Carpool.objects.bulk_create(
+            [
+                Carpool(
+                    date=date.today() + timedelta(days=i % 60 - 30),
+                    time=time(i % 24, i % 60),
+                    carfare=carfares[i % len(carfares)],
+                    lower_passengers=1,
+                    status="wda"[i % 3],
+                    seats_taken=i % 4,
+                )
+                for i in range(10000)
+            ]
+        )
+
+        student = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        drivers = [
+            Driver.objects.create(
+                username=f"d{i}", password="pass0000", type=User.Types.DRIVER
+            )
+            for i in range(10)
+        ]
+        Comment.objects.bulk_create(
+            [
+                Comment(content="ok", score=3, critic=student, criticed=drivers[i % 10])
+                for i in range(5000)
+            ]
+        )
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries().items():
+            with self.subTest(query=name):
+                self.assertEqual(full_scans(queryset), [], queryset.explain())
+
+
+class ScannedTablesTestCase(SimpleTestCase):
+    def test_index_scans_count_as_full_scans(self):
+        plan = "\n".join(
+            [
+                "2 0 0 SCAN app_carpool USING INDEX carpool_board_idx",
+                "3 0 0 SCAN app_comment USING COVERING INDEX comment_idx",
+                "4 0 0 SCAN TABLE app_place",
+                "5 0 0 SCAN app_car",
+                "6 0 0 SEARCH app_user USING INTEGER PRIMARY KEY (rowid=?)",
+                "7 0 0 SEARCH app_carpool USING INDEX carpool_board_idx (date=?)",
+                "8 0 0 SCAN CONSTANT ROW",
+            ]
+        )
+        self.assertEqual(
+            scanned_tables(plan), ["app_carpool", "app_comment", "app_place", "app_car"]
+        )
+        self.assertEqual(
+            scanned_tables("Seq Scan on app_carpool  (cost=0.00)"), ["app_carpool"]
+        )
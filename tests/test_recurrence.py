@@ -0,0 +1,182 @@
+from datetime import date, time, timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+
+from app import recurrence
+from app.fare_matrix import get_fare_matrix
+from app.models import (
+    Car,
+    Carfare,
+    Carpool,
+    Driver,
+    Place,
+    RecurringCarpool,
+    Student,
+    User,
+)
+from app.seats import SeatResult
+from app.views import CARPOOL_PAGE_SIZE
+
+EVERY_DAY = 0b1111111
+
+
+class RecurrenceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.s2 = Student.objects.create(username="s2", type=User.Types.STUDENT)
+        cls.d1 = Driver.objects.create(username="d1", type=User.Types.DRIVER)
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        a, b = Place.objects.bulk_create(Place(name=name) for name in ("A", "B"))
+        cls.ab = Carfare.objects.create(departure=a, arrival=b, fare=100)
+        cls.today = date.today()
+        cls.tomorrow = cls.today + timedelta(days=1)
+        cls.daily = RecurringCarpool.objects.create(
+            time=time(7, 50),
+            carfare=cls.ab,
+            weekdays=EVERY_DAY,
+            start_date=cls.today,
+            creator=cls.s1,
+        )
+        # 只在明天那個星期幾
+        cls.weekly = RecurringCarpool.objects.create(
+            time=time(8, 30),
+            carfare=cls.ab,
+            weekdays=1 << cls.tomorrow.weekday(),
+            start_date=cls.today,
+            end_date=cls.today + timedelta(days=10),
+        )
+
+    def occurrence_ids(self, day, **kwargs):
+        return [o.recurrence_id for o in recurrence.occurrences_on(day, **kwargs)]
+
+    def test_occurrences_on(self):
+        self.assertEqual(self.occurrence_ids(self.today), [self.daily.pk])
+        self.assertEqual(
+            self.occurrence_ids(self.tomorrow), [self.daily.pk, self.weekly.pk]
+        )
+        # end_date 之後、展開範圍之外、過去的日子都沒有
+        self.assertEqual(
+            self.occurrence_ids(self.tomorrow + timedelta(days=14)), [self.daily.pk]
+        )
+        self.assertEqual(self.occurrence_ids(self.today + timedelta(days=31)), [])
+        self.assertEqual(self.occurrence_ids(self.today - timedelta(days=1)), [])
+        self.assertEqual(
+            self.occurrence_ids(self.tomorrow, start=time(8)), [self.weekly.pk]
+        )
+        self.assertEqual(self.occurrence_ids(self.tomorrow, carfare_ids=[]), [])
+
+        self.daily.active = False
+        self.daily.save()
+        self.assertEqual(self.occurrence_ids(self.today), [])
+
+    def test_join_materializes_once(self):
+        carpool, result = recurrence.join_occurrence(self.daily, self.today, self.s1)
+        self.assertEqual(result, SeatResult.JOINED)
+        self.assertEqual((carpool.date, carpool.time), (self.today, time(7, 50)))
+        self.assertEqual(self.occurrence_ids(self.today), [])
+
+        again, result = recurrence.join_occurrence(self.daily, self.today, self.s2)
+        self.assertEqual(result, SeatResult.JOINED)
+        self.assertEqual(again.pk, carpool.pk)
+        taken, result = recurrence.join_occurrence(self.daily, self.today, self.d1)
+        self.assertEqual(result, SeatResult.JOINED)
+        carpool.refresh_from_db()
+        self.assertEqual((carpool.seats_taken, carpool.driver_id), (2, self.d1.pk))
+        self.assertEqual(Carpool.objects.filter(recurrence=self.daily).count(), 1)
+
+    def test_failed_first_join_leaves_no_row(self):
+        self.d1.car.capacity = 0
+        self.d1.car.save()
+        carpool, result = recurrence.join_occurrence(self.daily, self.today, self.d1)
+        self.assertIsNone(carpool)
+        self.assertEqual(result, SeatResult.NO_ROOM)
+        self.assertFalse(Carpool.objects.exists())
+
+    def test_occurrence_view(self):
+        url = reverse("app:recurring_occurrence", args=[self.daily.pk, self.today])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        other_day = reverse(
+            "app:recurring_occurrence",
+            args=[self.weekly.pk, self.tomorrow + timedelta(days=1)],
+        )
+        self.assertEqual(self.client.get(other_day).status_code, 404)
+
+        self.client.force_login(self.s2)
+        response = self.client.post(url, {"join": ""})
+        carpool = Carpool.objects.get(recurrence=self.daily, date=self.today)
+        self.assertRedirects(
+            response, carpool.get_absolute_url(), fetch_redirect_response=False
+        )
+        self.assertRedirects(
+            self.client.get(url),
+            carpool.get_absolute_url(),
+            fetch_redirect_response=False,
+        )
+
+    def test_create_view(self):
+        self.client.force_login(self.s1)
+        response = self.client.post(
+            reverse("app:recurring_carpool_create"),
+            {
+                "carfare": self.ab.pk,
+                "time": "18:10",
+                "weekdays": [0, 2, 4],
+                "start_date": self.today,
+                "lower_passengers": 1,
+            },
+        )
+        self.assertEqual(response.status_code, 204)
+        created = RecurringCarpool.objects.get(time=time(18, 10))
+        self.assertEqual(created.weekdays, 0b10101)
+        self.assertEqual(created.creator_id, self.s1.pk)
+        self.assertFalse(Carpool.objects.exists())
+
+    def board(self, day, **params):
+        data = {"date": day, "already_in": 0, **params}
+        response = self.client.get(reverse("app:carpools_region"), data)
+        self.assertEqual(response.status_code, 200)
+        return response.context["page"]
+
+    def test_board_merges_occurrences(self):
+        concrete = Carpool.objects.create(
+            date=self.tomorrow, time=time(8), carfare=self.ab, lower_passengers=1
+        )
+        get_fare_matrix()
+        recurrence.get_recurring_carpools()
+        # 看板一次、已展開的日子一次
+        with self.assertNumQueries(2):
+            page = self.board(self.tomorrow)
+        self.assertEqual(
+            [(c.time, c.is_virtual) for c in page],
+            [(time(7, 50), True), (time(8), False), (time(8, 30), True)],
+        )
+        self.assertEqual(page.object_list[1].pk, concrete.pk)
+        self.assertIn(
+            reverse("app:recurring_occurrence", args=[self.daily.pk, self.tomorrow]),
+            page.object_list[0].card_html,
+        )
+
+        self.assertEqual(len(self.board(self.tomorrow, already_in=1)), 0)
+        self.assertEqual(len(self.board(self.tomorrow, has_driver=True)), 0)
+        self.assertEqual(
+            [c.time for c in self.board(self.tomorrow, time="08:10")], [time(8, 30)]
+        )
+        window = self.board(self.tomorrow, time="07:00", time_until="08:00")
+        self.assertEqual([c.time for c in window], [time(7, 50), time(8)])
+
+    def test_board_pages_across_occurrences(self):
+        Carpool.objects.bulk_create(
+            Carpool(
+                date=self.tomorrow, time=time(8), carfare=self.ab, lower_passengers=1
+            )
+            for _ in range(CARPOOL_PAGE_SIZE)
+        )
+        first = self.board(self.tomorrow)
+        self.assertEqual(len(first), CARPOOL_PAGE_SIZE)
+        second = self.board(self.tomorrow, cursor=first.next_cursor)
+        seen = [(c.is_virtual, c.pk) for c in [*first, *second]]
+        self.assertEqual(len(seen), CARPOOL_PAGE_SIZE + 2)
+        self.assertEqual(len(set(seen)), len(seen))
+        self.assertEqual(second.object_list[-1].recurrence_id, self.weekly.pk)
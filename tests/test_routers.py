@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import tempfile
+from datetime import date
+from io import StringIO
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app.models import Carfare, Carpool, Driver, Place, Student, User
+from app.routers import PIN_COOKIE, refresh_replica, sync_sqlite_replica
+from app.sqlite.base import DatabaseWrapper
+
+
+# 測試時 replica 是 default 的鏡像，資料要先 commit 另一個連線才看得到
+@override_settings(READ_REPLICAS=["replica"])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        self.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        self.carpool = Carpool.objects.create(
+            date=date.today(), carfare=carfare, lower_passengers=1
+        )
+
+    def get(self, url):
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(replica.captured_queries)
+
+    def test_read_only_views_use_replica(self):
+        self.assertGreater(self.get(reverse("app:drivers")), 0)
+        self.assertGreater(self.get(reverse("app:carpools_region")), 0)
+        self.assertEqual(self.get(reverse("app:driver_detail", args=[self.d1.pk])), 0)
+        self.assertNotIn(PIN_COOKIE, self.client.cookies)
+
+    def test_write_pins_reads_to_primary(self):
+        self.client.force_login(self.s1)
+        url = reverse("app:carpool-detail", args=[self.carpool.pk])
+        response = self.client.post(url, {"join": "1"})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.get(reverse("app:drivers")), 0)
+
+        del self.client.cookies[PIN_COOKIE]
+        self.assertGreater(self.get(reverse("app:drivers")), 0)
+
+    def test_async_requests_use_replica(self):
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            response = async_to_sync(self.async_client.get)(reverse("app:drivers"))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(replica.captured_queries), 0)
+
+
+class ReplicaRoutingMiddlewareTestCase(SimpleTestCase):
+    # 只有 DEBUG 時 Django 才記錄哪個 middleware 被轉換
+    @override_settings(DEBUG=True)
+    def test_asgi_chain_is_not_adapted(self):
+        with self.assertLogs("django.request", "DEBUG") as logs:
+            ASGIHandler()
+            logging.getLogger("django.request").debug("loaded")
+        adapted = [line for line in logs.output if "ReplicaRoutingMiddleware" in line]
+        self.assertEqual(adapted, [])
+
+
+class SyncReplicasTestCase(TransactionTestCase):
+    def test_backup_copies_committed_rows(self):
+        Place.objects.create(name="Place 1")
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "replica.sqlite3"
+            sync_sqlite_replica(path)
+            with sqlite3.connect(path) as replica:
+                (count,) = replica.execute("SELECT COUNT(*) FROM app_place").fetchone()
+            replica.close()
+        self.assertEqual(count, 1)
+
+    def test_open_connection_sees_the_next_sync(self):
+        Place.objects.create(name="Place 1")
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "replica.sqlite3"
+            sync_sqlite_replica(path)
+            replica = DatabaseWrapper(
+                {
+                    **connections["replica"].settings_dict,
+                    "NAME": str(path),
+                    "OPTIONS": {"pragmas": {"mmap_size": 2**20, "query_only": "ON"}},
+                },
+                alias="synced",
+            )
+            try:
+                count = "SELECT COUNT(*) FROM app_place"
+                with replica.cursor() as cursor:
+                    self.assertEqual(cursor.execute(count).fetchone(), (1,))
+                Place.objects.create(name="Place 2")
+                sync_sqlite_replica(path)
+                self.assertTrue(replica.file_replaced())
+                refresh_replica(replica)
+                with replica.cursor() as cursor:
+                    self.assertEqual(cursor.execute(count).fetchone(), (2,))
+                self.assertFalse(replica.file_replaced())
+            finally:
+                replica.close()
+
+    def test_refuses_to_overwrite_primary(self):
+        # 測試中 replica 鏡像 default，指向同一個檔案
+        with self.assertRaises(CommandError):
+            call_command("sync_replicas", "replica", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("sync_replicas", "missing", stdout=StringIO())
@@ -0,0 +1,120 @@
+import threading
+from datetime import date
+
+from django.db import OperationalError, close_old_connections, connection
+from django.test import TestCase, TransactionTestCase
+
+from app.models import Car, Carfare, Carpool, Driver, Place, Student, User
+from app.seats import SeatResult, assign_driver, release_seat, reserve_seat
+
+
+def create_students(n, prefix="s"):
+    return [
+        Student.objects.create(
+            username=f"{prefix}{i}", password="pass0000", type=User.Types.STUDENT
+        )
+        for i in range(n)
+    ]
+
+
+class SeatReservationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=3, plate="ABC-1234")
+        cls.s1, cls.s2, cls.s3, cls.s4 = create_students(4)
+        place = Place.objects.create(name="Place 1")
+        cls.cf1 = Carfare.objects.create(departure=place, arrival=place, fare=100)
+
+    def setUp(self):
+        self.carpool = Carpool.objects.create(
+            date=date.today(), carfare=self.cf1, lower_passengers=1
+        )
+
+    def test_join_and_leave(self):
+        self.assertEqual(reserve_seat(self.carpool, self.s1), SeatResult.JOINED)
+        self.assertEqual(reserve_seat(self.carpool, self.s1), SeatResult.ALREADY_IN)
+        self.assertEqual(reserve_seat(self.carpool, self.s2), SeatResult.JOINED)
+        self.carpool.refresh_from_db()
+        self.assertEqual(self.carpool.seats_taken, 2)
+
+        self.assertEqual(release_seat(self.carpool, self.s2), SeatResult.LEFT)
+        self.assertEqual(release_seat(self.carpool, self.s2), SeatResult.NOT_IN)
+        self.assertEqual(release_seat(self.carpool, self.s1), SeatResult.DISBANDED)
+        self.assertFalse(Carpool.objects.filter(pk=self.carpool.pk).exists())
+
+    def test_driver_capacity(self):
+        for student in (self.s1, self.s2):
+            reserve_seat(self.carpool, student)
+        self.assertEqual(assign_driver(self.carpool, self.d1), SeatResult.JOINED)
+        self.assertEqual(assign_driver(self.carpool, self.d1), SeatResult.TAKEN)
+        self.assertEqual(reserve_seat(self.carpool, self.s3), SeatResult.JOINED)
+        self.assertEqual(reserve_seat(self.carpool, self.s4), SeatResult.FULL)
+        self.assertEqual(self.carpool.passengers.count(), 3)
+
+    def test_m2m_changes_keep_counter(self):
+        self.carpool.passengers.add(self.s1, self.s2)
+        self.s3.student_carpools.add(self.carpool)
+        self.carpool.refresh_from_db()
+        self.assertEqual(self.carpool.seats_taken, 3)
+
+        self.s3.student_carpools.clear()
+        self.carpool.passengers.remove(self.s1)
+        self.carpool.refresh_from_db()
+        self.assertEqual(self.carpool.seats_taken, 1)
+
+
+class ConcurrentSeatReservationTestCase(TransactionTestCase):
+    joiners = 50
+
+    def setUp(self):
+        driver = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=driver, capacity=4, plate="ABC-1234")
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        self.carpool = Carpool.objects.create(
+            date=date.today(), carfare=carfare, lower_passengers=1, driver=driver
+        )
+        self.students = create_students(self.joiners)
+
+    def join(self, student, barrier, results):
+        barrier.wait()
+        try:
+            # SQLite 只允許一個寫入者，被鎖住就重試
+            for _ in range(200):
+                try:
+                    results.append(reserve_seat(self.carpool, student))
+                    break
+                except OperationalError:
+                    threading.Event().wait(0.01)
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def test_no_overbooking(self):
+        if connection.vendor == "sqlite" and connection.creation.is_in_memory_db(
+            connection.settings_dict["NAME"]
+        ):
+            self.skipTest("in-memory SQLite is shared by a single connection")
+
+        barrier = threading.Barrier(self.joiners)
+        results = []
+        threads = [
+            threading.Thread(target=self.join, args=(student, barrier, results))
+            for student in self.students
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.carpool.refresh_from_db()
+        self.assertEqual(len(results), self.joiners)
+        self.assertEqual(results.count(SeatResult.JOINED), 4)
+        self.assertEqual(results.count(SeatResult.FULL), self.joiners - 4)
+        self.assertEqual(self.carpool.seats_taken, 4)
+        self.assertEqual(self.carpool.passengers.count(), 4)
@@ -0,0 +1,39 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from app.models import Place
+from app.sqlite.base import DatabaseWrapper
+
+
+class SqliteBackendTestCase(TransactionTestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_on_connect(self):
+        connection.close()
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        # 1 = NORMAL
+        self.assertEqual(self.pragma("synchronous"), 1)
+        self.assertEqual(self.pragma("busy_timeout"), 20000)
+        self.assertEqual(self.pragma("mmap_size"), 256 * 1024 * 1024)
+
+    def test_write_transactions_begin_immediate(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with transaction.atomic():
+                Place.objects.create(name="Place 1")
+        self.assertEqual(ctx.captured_queries[0]["sql"], "BEGIN IMMEDIATE")
+
+
+class SqliteOptionsTestCase(SimpleTestCase):
+    def test_invalid_transaction_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DatabaseWrapper(
+                {
+                    "NAME": ":memory:",
+                    "OPTIONS": {"transaction_mode": "EVENTUALLY"},
+                }
+            )
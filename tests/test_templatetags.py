@@ -0,0 +1,18 @@
+from django.template import Context, Engine
+from django.test import SimpleTestCase
+
+from app.benchmarks.templates import STAR_LOOP, STAR_TAG
+
+
+class StarRatingTestCase(SimpleTestCase):
+    def test_tag_matches_the_old_loop(self):
+        engine = Engine.get_default()
+        loop, tag = engine.from_string(STAR_LOOP), engine.from_string(STAR_TAG)
+        for score in range(6):
+            context = Context({"score": score})
+            self.assertEqual(tag.render(context), loop.render(context))
+        # 平均分數四捨五入，超出範圍或沒有評分時夾到 0..5
+        for score, filled in ((3.6, 4), (4.4, 4), (7, 5), (-1, 0), (None, 0)):
+            html = tag.render(Context({"score": score}))
+            self.assertEqual(html.count("bi-star-fill"), filled)
+            self.assertEqual(html.count("<svg"), 5)
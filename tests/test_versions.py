@@ -0,0 +1,35 @@
+from django.core import checks
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from app import versions
+
+
+class VersionsTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.delete("test-version")
+
+    def test_bump_moves_an_evicted_version_forward(self):
+        version = versions.get_version("test-version")
+        self.assertEqual(versions.get_version("test-version"), version)
+        versions.bump("test-version")
+        bumped = versions.get_version("test-version")
+        self.assertNotEqual(bumped, version)
+
+        cache.delete("test-version")
+        self.assertGreater(versions.get_version("test-version"), bumped)
+
+    def test_unshared_default_cache_is_flagged(self):
+        redis = {"BACKEND": "django.core.cache.backends.redis.RedisCache"}
+        with override_settings(CACHES={"default": redis}):
+            self.assertEqual(versions.check_shared_cache(None), [])
+            self.assertEqual(versions.check_shared_cache_deploy(None), [])
+        for backend in ("locmem.LocMemCache", "filebased.FileBasedCache"):
+            default = {"BACKEND": f"django.core.cache.backends.{backend}"}
+            with self.subTest(backend), override_settings(CACHES={"default": default}):
+                (warning,) = versions.check_shared_cache(None)
+                (error,) = versions.check_shared_cache_deploy(None)
+            self.assertIsInstance(warning, checks.Warning)
+            self.assertEqual(warning.id, "app.W001")
+            self.assertIsInstance(error, checks.Error)
+            self.assertEqual(error.id, "app.E001")
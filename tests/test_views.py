@@ -1,6 +1,30 @@
+from datetime import date
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from app.models import Profile, User
+from app.models import (
+    Car,
+    Carfare,
+    Carpool,
+    Comment,
+    Driver,
+    Place,
+    Profile,
+    Student,
+    User,
+)
+from app import conditional
+from app.fare_matrix import get_fare_matrix
+from app.forms import CommentCreateForm
+from app.pagination import encode_cursor, keyset_page
+from app.recurrence import get_recurring_carpools
+from app.views import CARPOOL_PAGE_SIZE, REVIEW_PAGE_SIZE
 from django.contrib.auth import get_user
 
 
@@ -100,3 +124,535 @@ class MyPasswordChangeView(TestCase):
         # update user password changed
         user = get_user(self.client)
         self.assertTrue(user.check_password("pass1111"))
+
+
+class CarpoolListRegionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        Comment.objects.create(content="good", score=4, critic=cls.s1, criticed=cls.d1)
+
+        p1 = Place.objects.create(name="Place 1")
+        p2 = Place.objects.create(name="Place 2")
+        cls.cf1 = Carfare.objects.create(departure=p1, arrival=p2, fare=100)
+
+    def create_carpools(self, n):
+        for i in range(n):
+            carpool = Carpool.objects.create(
+                date=date.today(),
+                carfare=self.cf1,
+                lower_passengers=1,
+                driver=self.d1 if i % 2 else None,
+            )
+            carpool.passengers.add(self.s1)
+
+    def count_board_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("app:carpools_region"))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_board_query_count_is_constant(self):
+        self.client.force_login(self.s1)
+        self.create_carpools(2)
+        small = self.count_board_queries()
+        self.create_carpools(20)
+        self.assertEqual(self.count_board_queries(), small)
+
+    def test_board_card_fields(self):
+        self.create_carpools(2)
+        carpool = Carpool.objects.for_board(self.s1).get(driver=self.d1)
+        get_fare_matrix()
+        with self.assertNumQueries(0):
+            self.assertEqual(carpool.departure, "Place 1")
+            self.assertEqual(carpool.arrival, "Place 2")
+            self.assertEqual(carpool.passenger_count, 1)
+            self.assertEqual(carpool.avg_fare, 100)
+            self.assertTrue(carpool.has_vacancy)
+            self.assertEqual(carpool.driver.car.plate, "ABC-1234")
+            self.assertEqual(carpool.driver_score, 4)
+            self.assertTrue(carpool.user_in)
+
+    def test_board_keyset_pagination(self):
+        self.create_carpools(CARPOOL_PAGE_SIZE + 5)
+        response = self.client.get(reverse("app:carpools_region"))
+        first = response.context["page"]
+        self.assertEqual(len(first), CARPOOL_PAGE_SIZE)
+        self.assertTrue(first.has_next)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse("app:carpools_region"), {"cursor": first.next_cursor}
+            )
+        second = response.context["page"]
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next)
+        self.assertFalse({c.pk for c in first} & {c.pk for c in second})
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(username="s1", type=User.Types.STUDENT)
+        cls.s2 = Student.objects.create(username="s2", type=User.Types.STUDENT)
+        p1 = Place.objects.create(name="Place 1")
+        p2 = Place.objects.create(name="Place 2")
+        cls.cf1 = Carfare.objects.create(departure=p1, arrival=p2, fare=100)
+        cls.carpool = Carpool.objects.create(
+            date=date.today(), carfare=cls.cf1, lower_passengers=1
+        )
+        cls.carpool.passengers.add(cls.s2)
+
+    def test_board_revalidation(self):
+        url = reverse("app:carpools_region")
+        self.client.force_login(self.s1)
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # 換個篩選條件或換個人都是不同的頁面
+        self.assertEqual(
+            self.client.get(url, {"cursor": ""}, HTTP_IF_NONE_MATCH=etag).status_code,
+            200,
+        )
+        self.client.force_login(self.s2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.client.force_login(self.s1)
+        self.carpool.passengers.add(self.s1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def next_second(self, kind):
+        """A clock one second past the last change of ``kind``."""
+        version = conditional.get_versions([conditional.version_key(kind)])
+        return (max(version.values()) // 10**9 + 1) * 10**9
+
+    def test_price_revalidation(self):
+        url = reverse("app:price")
+        with mock.patch("app.conditional.time") as clock:
+            clock.time_ns.return_value = self.next_second("fares")
+            response = self.client.get(url)
+            self.assertIn("no-cache", response["Cache-Control"])
+
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+            self.assertEqual(response.status_code, 304)
+        etag = response["ETag"]
+        # 共乘團異動不影響車資表
+        self.carpool.passengers.add(self.s1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.cf1.fare = 120
+        self.cf1.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_last_modified_waits_for_its_second(self):
+        url = reverse("app:price")
+        conditional.touch("fares")
+        with mock.patch("app.conditional.time") as clock:
+            # 同一秒內還可能再有異動，不能只靠秒數判斷
+            clock.time_ns.return_value = self.next_second("fares") - 1
+            response = self.client.get(url)
+            self.assertNotIn("Last-Modified", response)
+            last_second = "Thu, 01 Jan 2099 00:00:00 GMT"
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_second)
+            self.assertEqual(response.status_code, 200)
+
+            clock.time_ns.return_value = self.next_second("fares")
+            response = self.client.get(url)
+            self.assertIn("Last-Modified", response)
+
+
+class DriverListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        for i in range(25):
+            driver = Driver.objects.create(
+                username=f"d{i}", password="pass0000", type=User.Types.DRIVER
+            )
+            Comment.objects.create(
+                content="ok", score=i % 5 + 1, critic=cls.s1, criticed=driver
+            )
+
+    def test_driver_list_ordered_by_rating(self):
+        response = self.client.get(reverse("app:drivers"))
+        drivers = list(response.context["driver_list"])
+        self.assertEqual(len(drivers), 20)
+        self.assertEqual(drivers[0].score, 5)
+
+        response = self.client.get(
+            reverse("app:drivers"),
+            {"cursor": response.context["page_obj"].next_cursor},
+            HTTP_HX_REQUEST="true",
+        )
+        self.assertTemplateUsed(response, "app/htmx/driver_list_rows.html")
+        self.assertTemplateNotUsed(response, "base.html")
+        rest = list(response.context["driver_list"])
+        self.assertEqual(len(rest), 5)
+        self.assertEqual(rest[-1].score, 1)
+
+    def test_sort_and_filter(self):
+        d0, d1, d2 = (Driver.objects.get(username=f"d{i}") for i in range(3))
+        Car.objects.create(driver=d0, capacity=4, type="e", plate="ABC-0000")
+        Car.objects.create(driver=d1, capacity=7, type="l", plate="ABC-0001")
+        Car.objects.create(driver=d2, capacity=9, type="l", plate="ABC-0002")
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        for driver, trips in ((d0, 3), (d1, 1)):
+            for _ in range(trips):
+                Carpool.objects.create(
+                    date=date.today(),
+                    carfare=carfare,
+                    lower_passengers=1,
+                    driver=driver,
+                    status="a",
+                )
+        Comment.objects.create(content="ok", score=3, critic=self.s1, criticed=d1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("app:drivers"), {"sort": "trips"})
+        drivers = list(response.context["driver_list"])
+        self.assertEqual([d.pk for d in drivers[:2]], [d0.pk, d1.pk])
+        self.assertEqual(drivers[0].trip_count, 3)
+        # 司機、profile、car 與統計在同一次查詢取回
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        response = self.client.get(reverse("app:drivers"), {"sort": "reviews"})
+        drivers = list(response.context["driver_list"])
+        self.assertEqual(drivers[0].pk, d1.pk)
+        self.assertEqual(drivers[0].review_count, 2)
+
+        response = self.client.get(
+            reverse("app:drivers"), {"car_type": "l", "capacity": 8}
+        )
+        self.assertEqual([d.pk for d in response.context["driver_list"]], [d2.pk])
+
+        response = self.client.get(reverse("app:drivers"), {"min_stars": 4})
+        scores = [d.score for d in response.context["driver_list"]]
+        self.assertEqual(len(scores), 10)
+        self.assertTrue(all(score >= 4 for score in scores))
+
+    def test_min_stars_matches_displayed_stars(self):
+        # 平均 3.6、3.5 顯示為 4 星，要算進「4 星以上」；3.4 顯示 3 星則不算
+        for name, scores in (
+            ("avg36", (4, 4, 4, 3, 3)),
+            ("avg35", (4, 3)),
+            ("avg34", (4, 4, 3, 3, 3)),
+        ):
+            driver = Driver.objects.create(username=name, type=User.Types.DRIVER)
+            for score in scores:
+                Comment.objects.create(
+                    content="ok", score=score, critic=self.s1, criticed=driver
+                )
+
+        response = self.client.get(reverse("app:drivers"), {"min_stars": 4})
+        drivers = {d.username: d.score for d in response.context["driver_list"]}
+        self.assertEqual(drivers["avg36"], 4)
+        self.assertEqual(drivers["avg35"], 4)
+        self.assertNotIn("avg34", drivers)
+        self.assertEqual(Driver.objects.get(username="avg34").score, 3)
+        self.assertEqual(len(drivers), 12)
+        self.assertTrue(all(score >= 4 for score in drivers.values()))
+
+
+class DriverReviewViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Comment.objects.bulk_create(
+            [
+                Comment(content=f"c{i}", score=5, critic=cls.s1, criticed=cls.d1)
+                for i in range(REVIEW_PAGE_SIZE + 5)
+            ]
+        )
+        Comment.objects.create(
+            content="newest", score=1, critic=cls.s1, criticed=cls.d1
+        )
+        call_command("rebuild_driver_ratings", stdout=StringIO())
+
+    def test_first_page_and_histogram(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("app:driver_detail", args=[self.d1.pk]))
+        # 司機（含 profile、統計）與第一頁評論（含 critic）
+        self.assertEqual(len(ctx.captured_queries), 2)
+        reviews = response.context["reviews"]
+        self.assertEqual(len(reviews), REVIEW_PAGE_SIZE)
+        self.assertEqual(reviews.object_list[0].content, "newest")
+        self.assertTrue(reviews.has_next)
+        self.assertContains(response, f"(共{REVIEW_PAGE_SIZE + 6}則評論)")
+        self.assertEqual(
+            response.context["object"].profile.star_histogram(),
+            [(5, 25, 96), (4, 0, 0), (3, 0, 0), (2, 0, 0), (1, 1, 4)],
+        )
+
+    def test_load_more_fragment(self):
+        url = reverse("app:driver_reviews", args=[self.d1.pk])
+        first = self.client.get(url).context["reviews"]
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, {"cursor": first.next_cursor}, HTTP_HX_REQUEST="true"
+            )
+        self.assertTemplateNotUsed(response, "base.html")
+        rest = response.context["reviews"]
+        self.assertEqual(len(rest), 6)
+        self.assertFalse(rest.has_next)
+        self.assertFalse({c.pk for c in first} & {c.pk for c in rest})
+
+
+class InvalidCursorTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+
+    def get(self, url, values):
+        return self.client.get(url, {"cursor": encode_cursor(values)})
+
+    def test_mistyped_cursor_is_not_found(self):
+        board = reverse("app:carpools_region")
+        self.assertEqual(self.get(board, ["nodate", "x", 1]).status_code, 404)
+        self.assertEqual(
+            self.get(board, ["2022-01-01", "08:00", None]).status_code, 404
+        )
+        drivers = reverse("app:drivers")
+        self.assertEqual(self.get(drivers, ["abc", 1]).status_code, 404)
+        self.assertEqual(self.get(drivers, [[1], 1]).status_code, 404)
+        reviews = reverse("app:driver_reviews", args=[self.d1.pk])
+        self.assertEqual(self.get(reviews, ["nodate", 1]).status_code, 404)
+        self.assertEqual(self.get(board, ["2022-01-01", "08:00", 1]).status_code, 200)
+
+    def test_in_memory_parts(self):
+        class Row:
+            def __init__(self, pk):
+                self.id = pk
+
+        rows = [Row(1), Row(2)]
+        page = keyset_page([rows], ["id"], encode_cursor([1]))
+        self.assertEqual([row.id for row in page], [2])
+        with self.assertRaises(Http404):
+            keyset_page([rows], ["id"], encode_cursor(["x"]))
+        # 與 queryset 一起分頁時，依 queryset 的欄位型別檢查
+        with self.assertRaises(Http404):
+            keyset_page(
+                [Carpool.objects.all(), rows],
+                ["date", "time", "id"],
+                encode_cursor(["nodate", "08:00", 1]),
+            )
+
+
+class CommentFlowTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.s2 = Student.objects.create(
+            username="s2", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        cls.carpool = Carpool.objects.create(
+            date=date.today(),
+            carfare=carfare,
+            lower_passengers=1,
+            driver=cls.d1,
+            status="a",
+        )
+        cls.carpool.passengers.add(cls.s1, cls.s2)
+
+    def open_form(self, student):
+        self.client.force_login(student)
+        response = self.client.get(
+            reverse("app:carpool_update_status", args=[self.carpool.pk])
+        )
+        return response.context["form"]["token"].value()
+
+    def test_comment_from_signed_token(self):
+        token = self.open_form(self.s1)
+        session = dict(self.client.session)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse("app:comment_create"),
+                {"content": "nice", "score": 4, "token": token},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(self.client.session), session)
+        # 新增評論與更新司機評分，沒有 session 或查司機的查詢
+        writes = [q for q in ctx.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(writes), 1)
+        comment = Comment.objects.get()
+        self.assertEqual(
+            (comment.critic_id, comment.criticed_id), (self.s1.pk, self.d1.pk)
+        )
+        self.assertEqual(Driver.objects.with_rating().get(pk=self.d1.pk).rating, 4)
+
+    def test_token_is_bound_to_student(self):
+        token = self.open_form(self.s1)
+        self.client.force_login(self.s2)
+        url = reverse("app:comment_create")
+        response = self.client.post(url, {"content": "x", "score": 1, "token": token})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            url, {"content": "x", "score": 1, "token": token + "x"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Comment.objects.exists())
+
+
+class AsyncReadViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        Comment.objects.create(content="good", score=4, critic=cls.s1, criticed=cls.d1)
+        place = Place.objects.create(name="Place 1")
+        carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        cls.carpool = Carpool.objects.create(
+            date=date.today(), carfare=carfare, lower_passengers=1, driver=cls.d1
+        )
+        s2 = Student.objects.create(username="s2", type=User.Types.STUDENT)
+        cls.carpool.passengers.add(cls.s1, s2)
+
+    async def test_views_on_async_client(self):
+        # 在 event loop 中直接查資料庫會丟 SynchronousOnlyOperation
+        await sync_to_async(self.async_client.force_login)(self.s1)
+        for url in (
+            reverse("app:carpools_region"),
+            reverse("app:carpool-detail", args=[self.carpool.pk]),
+            reverse("app:drivers"),
+            reverse("app:driver_detail", args=[self.d1.pk]),
+            reverse("app:driver_reviews", args=[self.d1.pk]),
+            reverse("app:price"),
+        ):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(
+            reverse("app:carpool-detail", args=[self.carpool.pk])
+        )
+        self.assertTrue(response.context["is_student_in"])
+
+    async def test_missing_objects(self):
+        for url in (
+            reverse("app:carpool-detail", args=[0]),
+            reverse("app:driver_detail", args=[0]),
+        ):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 404)
+
+    def test_sync_post_next_to_async_get(self):
+        self.client.force_login(self.s1)
+        url = reverse("app:carpool-detail", args=[self.carpool.pk])
+        response = self.client.post(url, {"leave": "1"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.client.get(url).context["is_student_in"])
+
+
+class RequestUserTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.s1 = Student.objects.create(
+            username="s1", password="pass0000", type=User.Types.STUDENT
+        )
+        cls.d1 = Driver.objects.create(
+            username="d1", password="pass0000", type=User.Types.DRIVER
+        )
+        Car.objects.create(driver=cls.d1, capacity=4, plate="ABC-1234")
+        place = Place.objects.create(name="Place 1")
+        cls.carfare = Carfare.objects.create(departure=place, arrival=place, fare=100)
+        cls.carpool = Carpool.objects.create(
+            date=date.today(), carfare=cls.carfare, lower_passengers=1, driver=cls.d1
+        )
+        cls.carpool.passengers.add(cls.s1)
+
+    def test_role_switch_without_queries(self):
+        user = User.objects.get(pk=self.s1.pk)
+        with self.assertNumQueries(0):
+            student = user.to_student()
+            self.assertIsInstance(student, Student)
+            self.assertEqual(student.pk, self.s1.pk)
+            self.assertIsNone(user.to_driver())
+
+    def test_profile_resolved_once_per_request(self):
+        # user（連同 profile 與 car）、current_carpool 各一次；session 在 cookie 裡
+        for user in (self.s1, self.d1):
+            self.client.force_login(user)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse("app:profile"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["user"].current_carpool, self.carpool)
+
+    def test_board_queries(self):
+        get_fare_matrix()
+        get_recurring_carpools()
+        self.client.force_login(self.s1)
+        url = reverse("app:carpools_region")
+        # user 與看板各一次，是否已加入在看板查詢裡一起算出
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        data = {"date": date.today(), "already_in": 0, "carfare": self.carfare.pk}
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, data).status_code, 200)
+
+    def test_change_status_queries(self):
+        self.client.force_login(self.d1)
+        url = reverse("app:carpool_change_status", args=[self.carpool.pk])
+        # 共乘團、user，加上 savepoint 內讀舊狀態與更新；不再另外載入司機
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(response.context["carpool"].status, "d")
+        self.client.force_login(self.s1)
+        with self.assertNumQueries(2):
+            self.assertContains(self.client.get(url), "you are not the driver")
+
+    def test_update_status_queries(self):
+        self.client.force_login(self.s1)
+        url = reverse("app:carpool_update_status", args=[self.carpool.pk])
+        # 共乘團（含司機）、user、是否為乘客
+        with self.assertNumQueries(3):
+            self.assertContains(self.client.get(url), "waiting or driving")
+        Carpool.objects.filter(pk=self.carpool.pk).update(status="a")
+        # 加上頁首的 current_carpool；評論表單的司機來自同一次查詢
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context["driver"], self.d1)
+
+    def test_comment_post_queries(self):
+        Carpool.objects.filter(pk=self.carpool.pk).update(status="a")
+        self.carpool.refresh_from_db()
+        self.client.force_login(self.s1)
+        token = CommentCreateForm.make_token(self.carpool, self.s1)
+        # user、新增評論、更新司機評分（savepoint 兩次）；司機與學生來自簽章
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                reverse("app:comment_create"),
+                {"content": "nice", "score": 4, "token": token},
+            )
+        self.assertEqual(response.status_code, 302)
@@ -25,12 +25,30 @@ urlpatterns = [
     path("aboutus/", views.aboutus_view, name="aboutus"),
     path("carpools/", views.CarpoolListView.as_view(), name="carpools"),
     path("carpool_list_region/", views.carpool_list_region, name="carpools_region"),
+    path("metrics/", views.metrics_view, name="metrics"),
+    path("metrics.json", views.metrics_json_view, name="metrics_json"),
+    path("carpool_events/", views.carpool_events_view, name="carpool_events"),
+    path(
+        "carpool_card_stats/",
+        views.carpool_card_stats_view,
+        name="carpool_card_stats",
+    ),
     path(
         "carpool/history/",
         views.CarpoolHistoryListView.as_view(),
         name="carpool_history",
     ),
     path("carpool/create/", views.carpool_create, name="carpool_create"),
+    path(
+        "carpool/recurring/create/",
+        views.recurring_carpool_create,
+        name="recurring_carpool_create",
+    ),
+    path(
+        "carpool/recurring/<int:pk>/<str:day>",
+        views.recurring_occurrence_view,
+        name="recurring_occurrence",
+    ),
     path("carpool/<int:pk>", views.CarpoolDetailView.as_view(), name="carpool-detail"),
     path(
         "carpool/change_status/<int:pk>",
@@ -45,6 +63,7 @@ urlpatterns = [
     path("price/", views.PriceView.as_view(), name="price"),
     path("drivers/", views.DriverListView.as_view(), name="drivers"),
     path("driver/<int:pk>", views.DriverReviewView.as_view(), name="driver_detail"),
+    path("driver/<int:pk>/reviews", views.driver_reviews_view, name="driver_reviews"),
     path("comment/delete/<int:pk>", views.delete_comment_view, name="delete_comment"),
     path("comment/edit/<int:pk>", views.edit_comment_view, name="edit_comment"),
     path("comment/create/", views.CommentCreateView.as_view(), name="comment_create"),
@@ -0,0 +1,76 @@
+"""Change versions shared by every process.
+
+In-process copies (the fare matrix, the board indexes, rendered cards,
+page ETags) remember the version they were built at and compare it with
+the one in the default cache, which must be Redis or Memcached so every
+process sees it.  Versions are coarse (a page, a date, the fare table),
+never one per row, so a request reads a handful of keys.  A version is the
+time in nanoseconds of the last change.  A bump simply writes a new time,
+so racing bumps on a backend without atomic ``incr`` still each leave a
+value nobody holds; a version evicted from the cache comes back as a later
+time for the same reason.
+"""
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+# 只在單一行程內有效的後端
+PER_PROCESS_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+# 跨行程但每次寫入都要掃整個目錄
+FILE_BACKENDS = ("django.core.cache.backends.filebased.FileBasedCache",)
+
+
+def bump(key):
+    cache.set(key, time.time_ns(), None)
+
+
+def get_versions(keys):
+    """``{key: version}``; keys that have none yet start at the current time."""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = time.time_ns()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+def get_version(key):
+    return get_versions([key])[key]
+
+
+def shared_cache_problem():
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in PER_PROCESS_BACKENDS:
+        return "The default cache is not shared between processes."
+    if backend in FILE_BACKENDS:
+        return "The default cache scans its whole directory on every write."
+    return None
+
+
+HINT = (
+    "Versions and board events must reach every worker; "
+    "set REDIS_URL or MEMCACHED_LOCATION."
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    problem = shared_cache_problem()
+    if problem is None:
+        return []
+    return [checks.Warning(problem, hint=HINT, id="app.W001")]
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache_deploy(app_configs, **kwargs):
+    problem = shared_cache_problem()
+    if problem is None:
+        return []
+    return [checks.Error(problem, hint=HINT, id="app.E001")]
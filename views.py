@@ -1,18 +1,24 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.views import PasswordChangeView
-from django.db.models import Q, F, Count
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Q, F
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils.timezone import now
 from django.views.generic import TemplateView
 from django.views.generic.edit import CreateView
-from django.contrib.auth import get_user, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .models import (
+    ArchivedCarpool,
     Carpool,
     Comment,
     Place,
+    RecurringCarpool,
     User,
     Driver,
 )
@@ -23,15 +29,40 @@ from .forms import (
     DriverForm,
     CarpoolForm,
     CommentForm,
+    CommentCreateForm,
     LoginForm,
     CarpoolFilterForm,
+    DriverFilterForm,
+    RecurringCarpoolForm,
 )
+from . import card_cache, carpool_index, metrics, place_index, recurrence
+from .conditional import conditional_page
+from .fare_matrix import get_fare_matrix
+from .pagination import KeysetPaginationMixin, akeyset_page, cursor_values
+from .routers import read_replica
+from .seats import SeatResult, assign_driver, release_seat, reserve_seat
 from django.views import generic
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
 from django.http import HttpResponseRedirect
 from datetime import date
 
+CARPOOL_KEYSET_ORDERING = ["date", "time", "id"]
+CARPOOL_PAGE_SIZE = 20
+REVIEW_KEYSET_ORDERING = ["-time", "-id"]
+REVIEW_PAGE_SIZE = 20
+
+
+async def aget_user(request):
+    """Resolve ``request.user`` in a thread, it reads the session and the DB.
+
+    Async views call this before using the user; afterwards the lazy object is
+    loaded and templates can read it freely.
+    """
+    user = request.user
+    await sync_to_async(lambda: user.is_authenticated)()
+    return user
+
 
 def index(request):
     context = {"test": "Hello world"}
@@ -152,8 +183,9 @@ def carpool_create(request):
     if request.method == "POST":
         form = CarpoolForm(request.POST)
         if form.is_valid():
-            cp_object = form.save()
-            cp_object.passengers.add(request.user.to_student())
+            with transaction.atomic():
+                cp_object = form.save()
+                reserve_seat(cp_object, request.user.to_student())
             return HttpResponse(
                 status=204, headers={"HX-Trigger": "carpoolListChanged"}
             )
@@ -163,34 +195,126 @@ def carpool_create(request):
     return render(request, "app/carpool_create.html", {"form": form})
 
 
+def recurring_carpool_create(request):
+    if request.method == "POST":
+        form = RecurringCarpoolForm(request.POST)
+        if form.is_valid():
+            # 只存規則，每天的共乘團等到有人加入才建立
+            recurring = form.save(commit=False)
+            recurring.creator = request.user.to_student()
+            recurring.save()
+            return HttpResponse(
+                status=204, headers={"HX-Trigger": "carpoolListChanged"}
+            )
+    else:
+        form = RecurringCarpoolForm()
+
+    return render(request, "app/recurring_carpool_create.html", {"form": form})
+
+
+def recurring_occurrence_view(request, pk, day):
+    recurring = get_object_or_404(RecurringCarpool, pk=pk)
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        raise Http404("Invalid date")
+    if not (
+        recurring.occurs_on(day)
+        and recurrence.in_horizon(day)
+        and recurring.carfare_id in get_fare_matrix().routes
+    ):
+        raise Http404("No carpool on this day")
+
+    # 已經有人加入過的日子就是一般的共乘團
+    carpool = Carpool.objects.filter(recurrence=recurring, date=day).first()
+    if carpool is not None:
+        return HttpResponseRedirect(carpool.get_absolute_url())
+
+    user = request.user
+    if request.method == "POST" and "join" in request.POST:
+        if not user.is_authenticated:
+            return HttpResponseRedirect(request.path_info)
+        if user.is_driver() and user.current_carpool:
+            messages.warning(request, "已接其他共乘團!")
+            return HttpResponseRedirect(request.path_info)
+
+        carpool, result = recurrence.join_occurrence(recurring, day, user)
+        if result == SeatResult.JOINED:
+            messages.warning(request, "成功承接共乘團!" if user.is_driver() else "加入共乘團!")
+            return HttpResponseRedirect(carpool.get_absolute_url())
+        if result == SeatResult.TAKEN:
+            messages.warning(request, "已有司機!")
+        elif user.is_driver():
+            messages.warning(request, "車輛空間不足!")
+        else:
+            messages.warning(request, "沒位置了!")
+        return HttpResponseRedirect(request.path_info)
+
+    return render(
+        request,
+        "app/recurring_occurrence.html",
+        {"carpool": recurrence.Occurrence(recurring, day)},
+    )
+
+
 class CarpoolListView(generic.ListView):
     model = Carpool
     template_name = "app/carpool_list.html"
 
+    def get_queryset(self):
+        # 共乘團卡片由 carpool_list_region 分頁載入
+        return Carpool.objects.none()
+
     def get_context_data(self, **kwargs):
         context = super(CarpoolListView, self).get_context_data(**kwargs)
         context["form"] = CarpoolFilterForm()
         return context
 
 
+async def window_filter(queryset, day, start, end, routes, cursor):
+    """``queryset`` limited to the window matches of the page after ``cursor``.
+
+    The in-memory index lists the matches by (time, id), the board's order
+    within a day, so only the ids behind the cursor are sent to SQL, one
+    page at a time; the batch grows only while the other filters drop too
+    many of them.
+    """
+    values = cursor_values(queryset, CARPOOL_KEYSET_ORDERING, cursor)
+    after = None
+    if values is not None:
+        if values[0] > day:
+            return queryset.none()
+        if values[0] == day:
+            after = (values[1], values[2])
+    limit = CARPOOL_PAGE_SIZE + 1
+    while True:
+        ids = await sync_to_async(carpool_index.search)(
+            day, start, end, routes, after, limit
+        )
+        window = queryset.filter(pk__in=ids)
+        if len(ids) < limit or await window.acount() > CARPOOL_PAGE_SIZE:
+            return window
+        limit *= 4
+
+
 # ajax 動態更新carpool_list
-def carpool_list_region(request):
+@read_replica
+@conditional_page("board")
+async def carpool_list_region(request):
     carpools = None
+    # 推播的卡片是否屬於這個分頁由 board_events.js 依此判斷
+    board_filter = None
+    user = await aget_user(request)
+    board = Carpool.objects.for_board(user)
 
     if request.GET.get("filter_is_user_in", False) == "True":
-        if request.user.is_authenticated:
-            if request.user.is_student():
-                queryset = request.user.to_student().student_carpools
-            else:
-                queryset = request.user.to_driver().driver_carpools
-            carpools = (
-                queryset.filter(date__gte=date.today(), status="w")
-                .order_by("date")
-                .all()
-            )
+        if user.is_authenticated:
+            carpools = board.filter(user_in=True, date__gte=date.today(), status="w")
+            board_filter = {"user_in": True}
     else:
         form = CarpoolFilterForm(request.GET)
-        if form.is_valid():
+        # 驗證 carfare 時可能要重新載入車資矩陣
+        if await sync_to_async(form.is_valid)():
             date_ = form.cleaned_data["date"]
             time = form.cleaned_data["time"]
             carfare = form.cleaned_data["carfare"]
@@ -198,62 +322,157 @@ def carpool_list_region(request):
             has_vacancy = form.cleaned_data["has_vacancy"]
             has_driver = form.cleaned_data["has_driver"]
 
-            f = Carpool.objects.filter(date=date_, status="w")
-            f = f.annotate(num_passengers=Count("passengers")).filter(
-                num_passengers__gte=already_in
-            )
+            f = board.filter(date=date_, status="w")
+            f = f.filter(seats_taken__gte=already_in)
             if has_driver:
                 f = f.filter(~Q(driver=None))
                 if has_vacancy:
-                    f = f.filter(num_passengers__lt=F("driver__car__capacity"))
-            if time is not None:
-                f = f.filter(time__gte=time)
-            if carfare is not None:
-                f = f.filter(carfare=carfare)
-            carpools = f.order_by("date").all()
+                    f = f.filter(seats_taken__lt=F("driver__car__capacity"))
+            routes, until = None, None
+            if form.cleaned_data["window"]:
+                # 多條路線的時段查詢由記憶體內的索引找出 id，不再逐條查詢
+                until = form.cleaned_data["time_until"]
+                routes = carpool_index.route_ids(
+                    form.cleaned_data["departures"], form.cleaned_data["arrival"]
+                )
+                if carfare is not None:
+                    routes = [pk for pk in routes if pk == carfare.pk]
+            else:
+                if time is not None:
+                    f = f.filter(time__gte=time)
+                if carfare is not None:
+                    f = f.filter(carfare=carfare)
+                    routes = [carfare.pk]
+            if form.cleaned_data["latitude"] is not None:
+                # 在記憶體內的格網索引找出半徑內所有出發地，再換成從這些地點出發的
+                # 路線；SQL 只帶有車資的路線，不帶每個地點
+                nearby = await sync_to_async(place_index.near_place_ids)(
+                    form.cleaned_data["latitude"],
+                    form.cleaned_data["longitude"],
+                    form.cleaned_data["radius"],
+                )
+                nearby_routes = (
+                    await sync_to_async(carpool_index.route_ids)(nearby)
+                    if nearby
+                    else []
+                )
+                if routes is not None:
+                    allowed = set(routes)
+                    nearby_routes = [pk for pk in nearby_routes if pk in allowed]
+                routes = nearby_routes
+                if not form.cleaned_data["window"]:
+                    f = f.filter(carfare_id__in=routes)
+            if form.cleaned_data["window"]:
+                f = await window_filter(
+                    f, date_, time, until, routes, request.GET.get("cursor")
+                )
+            carpools = f
+            board_filter = {
+                "date": date_.isoformat(),
+                "time_from": time and time.isoformat(),
+                "time_until": until and until.isoformat(),
+                "routes": routes,
+                "min_seats": already_in,
+                "has_driver": has_driver,
+                "has_vacancy": has_driver and has_vacancy,
+            }
+
+            # 固定班次還沒人加入的日子：沒有司機、沒有乘客
+            if not has_driver and already_in <= 0:
+                occurrences = await sync_to_async(recurrence.occurrences_on)(
+                    date_, routes, time, until
+                )
+                if occurrences:
+                    carpools = [f, occurrences]
 
     if carpools is None:
-        carpools = (
-            Carpool.objects.filter(date__gte=date.today(), status="w")
-            .annotate(num_passengers=Count("passengers"))
-            .filter(num_passengers__gt=0)
-            .order_by("date")
-            .all()
-        )
-
-    if request.user.is_authenticated:
-        for c in carpools:
-            c.is_user_in = c.is_user_in(request.user)
+        carpools = board.filter(date__gte=date.today(), status="w", seats_taken__gt=0)
+        board_filter = {"date_from": date.today().isoformat(), "min_seats": 1}
+
+    page = await akeyset_page(
+        carpools,
+        CARPOOL_KEYSET_ORDERING,
+        request.GET.get("cursor"),
+        CARPOOL_PAGE_SIZE,
+        request,
+    )
+    # 一次取出整頁的卡片快取，未命中的卡片在 thread 中渲染
+    await sync_to_async(card_cache.render_cards)(page.object_list)
 
-    return render(
+    return TemplateResponse(
         request,
         "app/carpool_list_region.html",
         {
-            "carpools": carpools,
+            "carpools": page,
+            "page": page,
+            # 載入更多的片段接在後面，不必再帶一次
+            "board_filter": None if request.GET.get("cursor") else board_filter,
         },
     )
 
 
+def carpool_card_stats_view(request):
+    if not (settings.DEBUG or request.user.is_staff):
+        return HttpResponse(status=403)
+    return JsonResponse(card_cache.stats.snapshot())
+
+
+def can_read_metrics(request):
+    # Prometheus 由 INTERNAL_IPS 內的主機抓取，不需登入
+    return (
+        settings.DEBUG
+        or request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+        or request.user.is_staff
+    )
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.registry.prometheus_text(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def metrics_json_view(request):
+    if not can_read_metrics(request):
+        return HttpResponse(status=403)
+    return JsonResponse(metrics.registry.snapshot())
+
+
+def carpool_events_view(request):
+    # 推播由 ASGI 的 board_events_app 處理；WSGI 下回 204 讓瀏覽器停止重連
+    return HttpResponse(status=204)
+
+
 class CarpoolDetailView(generic.DetailView):
     model = Carpool
     template_name = "app/carpool_detail.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context[
-            "is_student_in"
-        ] = self.request.user.is_authenticated and self.object.is_user_in(
-            self.request.user
+        # for_board 已標註使用者是否在團內
+        context["is_student_in"] = (
+            self.request.user.is_authenticated and self.object.user_in
         )
         return context
 
-    def get(self, request, pk, *args, **kwargs):
-        carpool_inst = get_object_or_404(Carpool, pk=pk)
-        if carpool_inst.status == "a":
+    async def get(self, request, pk, *args, **kwargs):
+        user = await aget_user(request)
+        try:
+            self.object = await Carpool.objects.for_board(user).aget(pk=pk)
+        except Carpool.DoesNotExist:
+            raise Http404("No carpool found matching the query")
+        if self.object.status == "a":
             return HttpResponse("你不能看")
-        return super().get(request, *args, **kwargs)
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+    async def post(self, request, pk):
+        # 寫入路徑維持同步，整段在 thread 中執行
+        return await sync_to_async(self.join_or_leave)(request, pk)
 
-    def post(self, request, pk):
+    def join_or_leave(self, request, pk):
         carpool_inst = get_object_or_404(Carpool, pk=pk)
         user = self.request.user
 
@@ -265,79 +484,118 @@ class CarpoolDetailView(generic.DetailView):
                     messages.warning(request, "已有司機!")
                 elif user.current_carpool:
                     messages.warning(request, "已接其他共乘團!")
-                elif user.car.capacity <= carpool_inst.passengers.count():
-                    messages.warning(request, "車輛空間不足!")
                 else:
-                    messages.warning(request, "成功承接共乘團!")
-                    carpool_inst.driver = user.to_driver()
-                    carpool_inst.save()
+                    result = assign_driver(carpool_inst, user.to_driver())
+                    if result == SeatResult.JOINED:
+                        messages.warning(request, "成功承接共乘團!")
+                    elif result == SeatResult.TAKEN:
+                        messages.warning(request, "已有司機!")
+                    else:
+                        messages.warning(request, "車輛空間不足!")
             # 乘客
             else:
-                all_passengers = carpool_inst.passengers.all()
-                is_embark = False
-                # 尋找所有乘客
-                for temp in all_passengers:
-                    if temp == user:
-                        is_embark = True
-                # 若還沒上車則允許上車
-                embark_user = user.to_student()
-                if is_embark:
+                result = reserve_seat(carpool_inst, user.to_student())
+                if result == SeatResult.ALREADY_IN:
                     messages.warning(request, "您已經加入共乘團!")
-                elif carpool_inst.passengers.count() >= 9 or (
-                    carpool_inst.driver
-                    and carpool_inst.passengers.count()
-                    >= carpool_inst.driver.car.capacity
-                ):
-                    messages.warning(request, "沒位置了!")
-                else:
-                    carpool_inst.passengers.add(embark_user)
+                elif result == SeatResult.JOINED:
                     messages.warning(request, "加入共乘團!")
+                else:
+                    messages.warning(request, "沒位置了!")
 
         # 退出按鈕
         if request.method == "POST" and "leave" in request.POST:
             if user.is_student():
-                if carpool_inst.passengers.count() == 1 and carpool_inst.is_student_in(
-                    user
-                ):
-                    carpool_inst.delete()
+                result = release_seat(carpool_inst, user)
+                if result == SeatResult.DISBANDED:
                     return HttpResponseRedirect(reverse("app:carpools"))
-                carpool_inst.passengers.remove(user.id)
-                messages.warning(request, "退出共乘團!")
+                if result == SeatResult.LEFT:
+                    messages.warning(request, "退出共乘團!")
 
         return HttpResponseRedirect(request.path_info)
 
 
-class CarpoolHistoryListView(generic.ListView, LoginRequiredMixin):
+class CarpoolHistoryListView(
+    KeysetPaginationMixin, generic.ListView, LoginRequiredMixin
+):
     template_name = "app/carpool_history.html"
+    fragment_template_name = "app/htmx/carpool_history_rows.html"
+    keyset_ordering = CARPOOL_KEYSET_ORDERING
 
     def get_queryset(self):
-        user = get_user(self.request)
+        user = self.request.user
         if user.is_anonymous:
-            return None
+            return Carpool.objects.none()
 
+        queryset = Carpool.objects.for_board(user).filter(user_in=True)
         if user.is_student():
-            user = user.to_student()
-            queryset = user.student_carpools.filter(status="a")
-        else:
-            queryset = user.driver_carpools
-        return queryset
+            queryset = queryset.filter(status="a")
+        # 已封存的行程在另一張表，分頁時兩邊合併
+        return [queryset, ArchivedCarpool.objects.for_history(user)]
 
 
-class DriverListView(generic.ListView):
+class DriverListView(KeysetPaginationMixin, generic.ListView):
     model = Driver
     template_name = "app/driver_list.html"
+    fragment_template_name = "app/htmx/driver_list_rows.html"
+    keyset_ordering = ["-rating", "id"]
+    read_replica = True
+
+    def get_queryset(self):
+        self.filter_form = DriverFilterForm(self.request.GET)
+        self.keyset_ordering = self.filter_form.ordering()
+        return self.filter_form.filter(Driver.objects.with_stats())
+
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        await self.aload_page(self.object_list)
+        return self.render_to_response(self.get_context_data())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["filter_form"] = self.filter_form
+        return context
 
 
 class DriverReviewView(generic.DetailView):
     model = Driver
+    queryset = Driver.objects.with_stats()
     template_name = "app/driver_review.html"
 
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            self.object = await self.get_queryset().aget(pk=pk)
+        except Driver.DoesNotExist:
+            raise Http404("No driver found matching the query")
+        self.reviews = await review_page(request, pk)
+        return self.render_to_response(self.get_context_data(object=self.object))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["comment_form"] = CommentForm(instance=context["object"])
+        context["reviews"] = self.reviews
         return context
 
 
+async def review_page(request, driver_pk):
+    """Newest reviews of a driver after the request's cursor, critic joined in."""
+    comments = Comment.objects.filter(criticed_id=driver_pk).select_related("critic")
+    return await akeyset_page(
+        comments,
+        REVIEW_KEYSET_ORDERING,
+        request.GET.get("cursor"),
+        REVIEW_PAGE_SIZE,
+        request,
+    )
+
+
+async def driver_reviews_view(request, pk):
+    return TemplateResponse(
+        request,
+        "app/htmx/review_rows.html",
+        {"reviews": await review_page(request, pk), "driver_pk": pk},
+    )
+
+
 def delete_comment_view(request, pk):
     comment = get_object_or_404(Comment, pk=pk)
     comment.delete()
@@ -362,7 +620,9 @@ def edit_comment_view(request, pk):
 
 def carpool_change_status_view(request, pk):
     carpool = get_object_or_404(Carpool, pk=pk)
-    if carpool.driver != request.user.to_driver():
+    # 比對 driver_id，不必再載入司機
+    driver = request.user.to_driver()
+    if carpool.driver_id != (driver.pk if driver else None):
         return HttpResponse("you are not the driver")
 
     if carpool.status == "w":
@@ -372,7 +632,7 @@ def carpool_change_status_view(request, pk):
     else:
         return HttpResponse("Already arrived")
     carpool.status = status
-    carpool.save()
+    carpool.save(update_fields=["status"])
 
     return render(
         request,
@@ -382,15 +642,16 @@ def carpool_change_status_view(request, pk):
 
 
 def carpool_update_status_view(request, pk):
-    carpool = get_object_or_404(Carpool, pk=pk)
+    carpool = get_object_or_404(
+        Carpool.objects.select_related("driver__profile"), pk=pk
+    )
     if request.user.is_authenticated and not carpool.is_student_in(
         request.user.to_student()
     ):
         return HttpResponse("You are not in this carpool")
 
     if carpool.status == "a":
-        request.driver = carpool.driver
-        return CommentCreateView.as_view()(request, driver=carpool.driver)
+        return CommentCreateView.as_view()(request, carpool=carpool)
     else:
         return HttpResponse("waiting or driving")
 
@@ -398,30 +659,31 @@ def carpool_update_status_view(request, pk):
 class CommentCreateView(CreateView, LoginRequiredMixin):
     template_name = "app/htmx/create_comment.html"
     model = Comment
-    fields = ["content", "score"]
+    form_class = CommentCreateForm
+
+    def get_initial(self):
+        initial = super().get_initial()
+        carpool = self.kwargs.get("carpool")
+        if carpool is not None:
+            initial["token"] = CommentCreateForm.make_token(carpool, self.request.user)
+        return initial
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["driver"] = self.request.driver
-        self.request.session["driver_username"] = self.request.driver.username
+        carpool = self.kwargs.get("carpool")
+        context["driver"] = carpool.driver if carpool is not None else None
         return context
 
     def form_valid(self, form):
-        comment = form.save(commit=False)
-
-        driver = Driver.objects.get_by_natural_key(
-            username=self.request.session.get("driver_username")
-        )
-        print(driver)
-        user = get_user(self.request)
-        student = user.to_student()
-
-        comment.criticed = driver
-        comment.critic = student
-        comment.time = now()
-        comment.save()
-        del self.request.session["driver_username"]
+        token = form.cleaned_data["token"]
+        user = self.request.user
+        if not user.is_authenticated or token["student"] != user.pk:
+            return HttpResponse("You are not in this carpool", status=403)
 
+        # 司機與學生都從簽章取得，不必查詢，也只存檔一次
+        form.instance.criticed_id = token["driver"]
+        form.instance.critic_id = token["student"]
+        form.instance.time = now()
         return super().form_valid(form)
 
     def form_invalid(self, form):
@@ -442,12 +704,24 @@ def aboutus_view(request):
     return render(request, template_name="app/aboutus.html")
 
 
-class PriceView(generic.ListView):
-    model = Place
+class PriceView(TemplateView):
     template_name = "app/price.html"
+    read_replica = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # 車資表沒變就直接回 304
+        return conditional_page("price")(super().as_view(**initkwargs))
+
+    async def get(self, request, *args, **kwargs):
+        # 矩陣過期時重新載入要查資料庫
+        self.matrix = await sync_to_async(get_fare_matrix)()
+        return self.render_to_response(self.get_context_data(**kwargs))
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(object_list=object_list, **kwargs)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["place_list"] = self.matrix.places
+        context["fare_rows"] = self.matrix.rows()
         return context
 
 